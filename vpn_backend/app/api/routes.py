@@ -1,22 +1,41 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response
-from sqlalchemy.orm import Session
-from ..db.database import get_db
-from ..db.models import User
-from ..core.security import get_password_hash
-from ..services.firebase_service import verify_token
+import asyncio
+import base64
+import binascii
+import time
+from datetime import datetime
+from typing import Literal, Optional
+from cryptography.fernet import InvalidToken
+from fastapi import APIRouter, Depends, HTTPException, status, Response, Header
+from sqlalchemy import select, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from ..db.database import get_db, SessionLocal
+from ..db.models import User, ConnectionLog, UsageRollup
+from ..core.config import settings
+from ..core.metrics import AUTH_FAILURES, stage
+from ..core.security import get_password_hash_async, HashingBusy, decrypt_secret, encrypt_secret
+from ..services.firebase_service import verify_token_async
+from ..services.admission import user_operations, admit, RateLimited, OperationBusy, retry_after_header
 # Importa las funciones de WireGuard
 from ..services.vpn_service import (
     generate_key_pair, 
-    add_peer_to_server, 
-    remove_peer_from_server, 
-    create_client_config, 
-    get_next_available_ip
+    add_peer_to_server_async, 
+    remove_peer_from_server_async, 
+    render_client_config,
+    config_cache,
+    node_registry
 )
+from ..services.usage_rollups import bucket_start
 
 router = APIRouter()
 
+# Reintentos si el commit de la asignación choca con una restricción única por algo que no
+# es la IP (ej. otra petición del mismo usuario). Los choques de IP no cuentan: cada uno
+# vuelve a leer las IPs del nodo, así que se repiten solo mientras queden IPs libres.
+MAX_IP_ASSIGN_ATTEMPTS = 5
+
 # ... (El código de UserCreate, Token, register_user y login_user es el mismo) ...
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 class UserCreate(BaseModel):
     username: str
@@ -25,119 +44,469 @@ class UserCreate(BaseModel):
 class Token(BaseModel):
     id_token: str
 
+class UsageQuery(Token):
+    granularity: Literal["hour", "day", "month"] = "day"
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
+class HistoryQuery(Token):
+    cursor: Optional[str] = None
+    limit: int = Field(50, ge=1, le=500)
+
+class NodeStatusChange(Token):
+    status: Literal["active", "draining", "disabled"]
+
+class DrainRequest(Token):
+    target: Optional[str] = None
+    limit: Optional[int] = Field(None, ge=1)
+
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    with stage("db_user_lookup"):
+        result = await db.execute(select(User).where(User.username == username))
+        return result.scalars().first()
+
+
+async def ip_taken(db: AsyncSession, node: str, ip: str) -> bool:
+    result = await db.execute(select(User.id).where(User.wg_node == node, User.wg_ip_address == ip).limit(1))
+    return result.first() is not None
+
+
+async def verify_request_token(id_token: str):
+    with stage("auth"):
+        return await verify_token_async(id_token)
+
 @router.post("/register")
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     """
     Ruta para registrar un nuevo usuario.
     """
-    db_user = db.query(User).filter(User.username == user.username).first()
+    db_user = await get_user_by_username(db, user.username)
     if db_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already registered")
 
-    hashed_password = get_password_hash(user.password)
+    # bcrypt consume CPU: se ejecuta en el pool de procesos y, si está saturado, se rechaza en el momento.
+    try:
+        hashed_password = await get_password_hash_async(user.password)
+    except HashingBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server busy, please retry.", headers={"Retry-After": "1"})
     new_user = User(username=user.username, hashed_password=hashed_password)
     
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Otra petición registró el mismo usuario mientras se calculaba el hash.
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already registered")
     
     return {"message": "User registered successfully"}
 
 @router.post("/login")
-def login_user(token: Token, db: Session = Depends(get_db)):
+async def login_user(token: Token, db: AsyncSession = Depends(get_db)):
     """
     Ruta para autenticar un usuario con un token de Firebase.
     """
-    decoded_token = verify_token(token.id_token)
+    decoded_token = await verify_request_token(token.id_token)
     if not decoded_token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Firebase token")
     
     username = decoded_token.get("email")
     if not username:
+        AUTH_FAILURES.inc("missing_email")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not find user in token")
         
-    db_user = db.query(User).filter(User.username == username).first()
+    db_user = await get_user_by_username(db, username)
     if not db_user:
+        AUTH_FAILURES.inc("user_not_found")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found in database")
         
     return {"message": "Login successful"}
 
 
-@router.post("/vpn/connect")
-def connect_vpn(token: Token, db: Session = Depends(get_db)):
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Comprueba la cabecera If-None-Match (lista de ETags o '*') contra el ETag actual."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+async def client_config_response(artifact, output_format: str, if_none_match: Optional[str]) -> Response:
+    """Respuesta con la configuración (o su QR) y su ETag; 304 si el cliente ya la tiene."""
+    etag = artifact.qr_etag if output_format == "qr" else artifact.etag
+    # La configuración lleva la clave privada: solo la guarda el cliente, y siempre la revalida.
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if output_format == "qr":
+        try:
+            # Generar el PNG consume CPU: se hace fuera del bucle de eventos y solo la primera vez.
+            png = await asyncio.get_running_loop().run_in_executor(None, artifact.qr_png)
+        except ImportError:
+            raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="QR codes are not available on this server.")
+        return Response(content=png, media_type="image/png", headers=headers)
+
+    headers["Content-Disposition"] = "attachment; filename=client.conf"
+    return Response(content=artifact.body, media_type="application/octet-stream", headers=headers)
+
+
+async def run_user_operation(username: str, operation: str, func):
     """
-    Ruta para generar el archivo de configuración .conf para el cliente de WireGuard.
+    Ejecuta la operación de connect/disconnect del usuario de una en una: las peticiones
+    repetidas comparten la que está en curso. Traduce el rechazo del control de admisión.
     """
-    decoded_token = verify_token(token.id_token)
-    if not decoded_token:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication token.")
-    
-    username = decoded_token.get("email")
-    db_user = db.query(User).filter(User.username == username).first()
+    try:
+        return await user_operations.run(username, operation, func)
+    except RateLimited as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, please retry later.",
+            headers={"Retry-After": retry_after_header(e.retry_after)}
+        )
+    except OperationBusy:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Another VPN operation is in progress for this user, please retry.",
+            headers={"Retry-After": "1"}
+        )
+
+
+async def provision_peer(db: AsyncSession, username: str):
+    """Asigna claves, nodo e IP al usuario, añade su peer si no está activo y retorna su configuración."""
+    # Antes de leer: un disconnect de otro worker que invalide después no deja en caché una configuración vieja.
+    read_at = time.time()
+    db_user = await get_user_by_username(db, username)
     if not db_user:
+        AUTH_FAILURES.inc("user_not_found")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
 
-    # 1. Asignar claves y IP si no existen
+    # El usuario se queda en su nodo; solo se coloca en otro si el suyo ya no lo admite.
+    node = node_registry.sticky_node(db_user.wg_node, bool(db_user.wg_ip_address))
+    needs_peer = not db_user.wg_public_key or not node or not db_user.wg_ip_address or not db_user.wg_peer_added_at
+    if needs_peer:
+        # Control de admisión antes de generar claves y ejecutar 'wg'.
+        await admit(username)
+
+    # 1. Asignar claves si no existen. Se conservan aunque el peer se haya retirado por inactividad.
+    new_keys = None
     if not db_user.wg_public_key:
-        private_key, public_key = generate_key_pair()
-        if not private_key:
+        new_keys = generate_key_pair()
+        if not new_keys[0]:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not generate WireGuard keys. Server issue.")
 
-        # Obtener la próxima IP disponible
-        used_ips = [user.wg_ip_address for user in db.query(User).all() if user.wg_ip_address]
-        client_ip = get_next_available_ip(used_ips)
-        if not client_ip:
-            raise HTTPException(status_code=status.HTTP_507_INSUFFICIENT_STORAGE, detail="No available IP addresses.")
+    # 2. Asignar nodo e IP y añadir el peer si no está activo en el servidor (usuario nuevo o peer retirado).
+    if needs_peer:
+        # Obtener la próxima IP disponible del asignador del nodo y guardar todo en la base de datos.
+        # Si otro worker ya guardó la misma IP, la restricción única lo rechaza y se prueba la siguiente.
+        conflicts = 0
+        while True:
+            if new_keys:
+                # La clave privada se guarda cifrada; el cifrador se construye una sola vez al arrancar.
+                db_user.wg_private_key, db_user.wg_public_key = encrypt_secret(new_keys[0]), new_keys[1]
+            if not node:
+                # Nodo activo con menos carga.
+                node = node_registry.place()
+                if not node:
+                    raise HTTPException(status_code=status.HTTP_507_INSUFFICIENT_STORAGE, detail="No available IP addresses.")
+                db_user.wg_node = node.name
+                db_user.wg_ip_address = None
+            client_ip = None
+            if not db_user.wg_ip_address:
+                # La reclama de la IP en el almacén local se hace fuera del bucle de eventos.
+                client_ip = await node.pool.allocate_async()
+                if not client_ip:
+                    raise HTTPException(status_code=status.HTTP_507_INSUFFICIENT_STORAGE, detail="No available IP addresses.")
+                db_user.wg_ip_address = client_ip
+            # Se marca antes del 'wg set' y en el mismo commit que la IP: el reaper no retira un peer
+            # que se está añadiendo, y la instantánea del asignador ve la asignación.
+            db_user.wg_peer_added_at = datetime.utcnow()
+            try:
+                await db.commit()
+                break
+            except IntegrityError:
+                await db.rollback()
+                if client_ip and await ip_taken(db, node.name, client_ip):
+                    # El asignador de este worker no veía IPs que ya guardaron otros: se vuelve
+                    # a leer de 'users' (la IP queda marcada) y se prueba con la siguiente libre.
+                    await asyncio.to_thread(node.rescan_pool)
+                else:
+                    if client_ip:
+                        await node.pool.release_async(client_ip)
+                    conflicts += 1
+                    if conflicts >= MAX_IP_ASSIGN_ATTEMPTS:
+                        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Could not assign an IP address, please retry.")
+                db_user = await get_user_by_username(db, username)
+                if db_user.wg_public_key:
+                    # Otra petición del mismo usuario ya guardó sus claves.
+                    new_keys = None
+                node = node_registry.sticky_node(db_user.wg_node, bool(db_user.wg_ip_address))
 
-        # Guardar todo en la base de datos
-        db_user.wg_public_key = public_key
-        db_user.wg_private_key = private_key
-        db_user.wg_ip_address = client_ip
-        db.commit()
+        # **¡Paso Crítico de Linux!** Añade el peer a la configuración del servidor de WireGuard.
+        if not await add_peer_to_server_async(node, db_user.wg_public_key, db_user.wg_ip_address):
+            # Se deshace la asignación: el usuario queda sin peer y la IP vuelve al rango.
+            client_ip = db_user.wg_ip_address
+            db_user.wg_ip_address = None
+            db_user.wg_peer_added_at = None
+            await db.commit()
+            await node.pool.release_async(client_ip)
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to add peer to WireGuard server. Check if you are running in Linux/WSL with sudo.")
 
-        # 2. **¡Paso Crítico de Linux!** Añade el peer a la configuración del servidor de WireGuard.
-        if not add_peer_to_server(public_key, client_ip):
-             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to add peer to WireGuard server. Check if you are running in Linux/WSL with sudo.")
+    # 3. Generar el archivo de configuración para el cliente con los valores guardados y guardarlo en caché.
+    if new_keys:
+        private_key = new_keys[0]
+    else:
+        try:
+            with stage("decrypt_key"):
+                private_key = decrypt_secret(db_user.wg_private_key)
+        except InvalidToken:
+            print(f"No se pudo descifrar la clave privada del usuario {db_user.id}: falta su clave en ENCRYPTION_KEYS.")
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not read stored WireGuard keys. Server issue.")
+    return render_client_config(username, node, private_key, db_user.wg_ip_address, read_at)
 
-    # 3. Usar los valores guardados
-    private_key = db_user.wg_private_key
-    public_key = db_user.wg_public_key
-    client_ip = db_user.wg_ip_address
-    
-    # 4. Generar el archivo de configuración para el cliente.
-    server_public_key = "vaVEwDDfPYafXQe+GfVhcv6yLGmtDEwqdyteBd1mLHo="
-    server_ip = "192.168.160.1"
-    
-    client_config = create_client_config(private_key, client_ip, server_public_key, server_ip)
 
-    # Retorna el archivo de configuración como una respuesta de descarga
-    return Response(content=client_config, media_type="application/octet-stream", headers={"Content-Disposition": "attachment; filename=client.conf"})
-
-
-@router.post("/vpn/disconnect")
-def disconnect_vpn(token: Token, db: Session = Depends(get_db)):
+@router.post("/vpn/connect")
+async def connect_vpn(
+    token: Token,
+    format: Literal["conf", "qr"] = "conf",
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
     """
-    Ruta para revocar el acceso VPN.
+    Ruta para generar el archivo de configuración .conf para el cliente de WireGuard.
+    Con '?format=qr' retorna la misma configuración como código QR (PNG).
     """
-    decoded_token = verify_token(token.id_token)
+    decoded_token = await verify_request_token(token.id_token)
     if not decoded_token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication token.")
     
     username = decoded_token.get("email")
-    db_user = db.query(User).filter(User.username == username).first()
+
+    # Camino rápido: el usuario ya tiene su peer activo y la configuración está en caché (sin consultar la base de datos).
+    artifact = await config_cache.get_async(username, node_registry.config_versions())
+    if artifact:
+        return await client_config_response(artifact, format, if_none_match)
+
+    # Los connect simultáneos del mismo usuario comparten una sola asignación.
+    artifact = await run_user_operation(username, "connect", lambda: provision_peer(db, username))
+
+    # Retorna el archivo de configuración como una respuesta de descarga
+    return await client_config_response(artifact, format, if_none_match)
+
+
+async def revoke_peer(db: AsyncSession, username: str) -> dict:
+    """Retira el peer del usuario del servidor, borra sus claves y libera su IP."""
+    db_user = await get_user_by_username(db, username)
     if not db_user or not db_user.wg_public_key:
         return {"message": "User not connected or already disconnected."}
 
     public_key = db_user.wg_public_key
+    client_ip = db_user.wg_ip_address
+    node = node_registry.node_for(db_user.wg_node)
 
     # **¡Paso Crítico de Linux!** Eliminar el peer de la configuración del servidor de WireGuard.
-    if not remove_peer_from_server(public_key):
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to remove peer from WireGuard server. Check if you are running in Linux/WSL with sudo.")
+    # Si el nodo ya no está registrado no hay nada que retirar.
+    if node:
+        await admit(username)
+        if not await remove_peer_from_server_async(node, public_key):
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to remove peer from WireGuard server. Check if you are running in Linux/WSL with sudo.")
 
     # Limpiar las claves de la base de datos
     db_user.wg_public_key = None
     db_user.wg_private_key = None
     db_user.wg_ip_address = None
-    db.commit()
+    db_user.wg_peer_added_at = None
+    await db.commit()
+    await config_cache.invalidate_async([username])
+
+    # Devolver la IP al asignador del nodo para que pueda reutilizarse.
+    if node and client_ip:
+        await node.pool.release_async(client_ip)
+
+    return {"message": "VPN disconnected successfully."}
+
+
+@router.post("/vpn/disconnect")
+async def disconnect_vpn(token: Token, db: AsyncSession = Depends(get_db)):
+    """
+    Ruta para revocar el acceso VPN.
+    """
+    decoded_token = await verify_request_token(token.id_token)
+    if not decoded_token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication token.")
+    
+    username = decoded_token.get("email")
+    # Nunca a la vez que un connect del mismo usuario: espera a que termine el que esté en curso.
+    return await run_user_operation(username, "disconnect", lambda: revoke_peer(db, username))
+
+
+async def get_authenticated_user(db: AsyncSession, id_token: str) -> User:
+    decoded_token = await verify_request_token(id_token)
+    if not decoded_token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication token.")
+    db_user = await get_user_by_username(db, decoded_token.get("email"))
+    if not db_user:
+        AUTH_FAILURES.inc("user_not_found")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
+    return db_user
+
+
+async def get_usage_summary(db: AsyncSession, scope: str, scope_id: str, query: UsageQuery) -> dict:
+    """
+    Lee los resúmenes precalculados de 'usage_rollups' para el rango pedido.
+    Solo incluye sesiones ya cerradas.
+    """
+    stmt = select(
+        UsageRollup.bucket_start, UsageRollup.sessions, UsageRollup.rx_bytes,
+        UsageRollup.tx_bytes, UsageRollup.seconds
+    ).where(
+        UsageRollup.scope == scope,
+        UsageRollup.scope_id == scope_id,
+        UsageRollup.granularity == query.granularity
+    )
+    if query.start:
+        stmt = stmt.where(UsageRollup.bucket_start >= bucket_start(query.start, query.granularity))
+    if query.end:
+        stmt = stmt.where(UsageRollup.bucket_start < query.end)
+    result = await db.execute(stmt.order_by(UsageRollup.bucket_start))
+
+    buckets = []
+    totals = {"sessions": 0, "rx_bytes": 0, "tx_bytes": 0, "minutes": 0.0}
+    for start, sessions, rx_bytes, tx_bytes, seconds in result:
+        minutes = round(seconds / 60, 2)
+        buckets.append({
+            "bucket_start": start.isoformat(),
+            "sessions": sessions,
+            "rx_bytes": rx_bytes,
+            "tx_bytes": tx_bytes,
+            "minutes": minutes,
+        })
+        totals["sessions"] += sessions
+        totals["rx_bytes"] += rx_bytes
+        totals["tx_bytes"] += tx_bytes
+        totals["minutes"] = round(totals["minutes"] + minutes, 2)
+    return {"granularity": query.granularity, "totals": totals, "buckets": buckets}
+
+
+def encode_cursor(connected_at: datetime, log_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{connected_at.isoformat()}|{log_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        connected_at, log_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(connected_at), int(log_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+
+
+@router.post("/usage/summary")
+async def usage_summary(query: UsageQuery, db: AsyncSession = Depends(get_db)):
+    """
+    Ruta para consultar el uso del usuario (sesiones, bytes y minutos) por hora, día o mes.
+    """
+    db_user = await get_authenticated_user(db, query.id_token)
+    return await get_usage_summary(db, "user", str(db_user.id), query)
+
+
+@router.post("/usage/history")
+async def usage_history(query: HistoryQuery, db: AsyncSession = Depends(get_db)):
+    """
+    Ruta para consultar el historial de sesiones del usuario, de la más reciente a la más antigua.
+    Se pagina con un cursor: se envía el 'next_cursor' de la respuesta anterior.
+    """
+    db_user = await get_authenticated_user(db, query.id_token)
+    stmt = select(
+        ConnectionLog.id, ConnectionLog.connected_at, ConnectionLog.disconnected_at,
+        ConnectionLog.interface, ConnectionLog.rx_bytes, ConnectionLog.tx_bytes
+    ).where(ConnectionLog.user_id == db_user.id)
+    if query.cursor:
+        connected_at, log_id = decode_cursor(query.cursor)
+        stmt = stmt.where(or_(
+            ConnectionLog.connected_at < connected_at,
+            and_(ConnectionLog.connected_at == connected_at, ConnectionLog.id < log_id)
+        ))
+    result = await db.execute(
+        stmt.order_by(ConnectionLog.connected_at.desc(), ConnectionLog.id.desc()).limit(query.limit + 1)
+    )
+    rows = result.all()
+
+    items = [
+        {
+            "id": log_id,
+            "connected_at": connected_at.isoformat(),
+            "disconnected_at": disconnected_at.isoformat() if disconnected_at else None,
+            "server": interface,
+            "rx_bytes": rx_bytes or 0,
+            "tx_bytes": tx_bytes or 0,
+        }
+        for log_id, connected_at, disconnected_at, interface, rx_bytes, tx_bytes in rows[:query.limit]
+    ]
+    next_cursor = None
+    if len(rows) > query.limit:
+        last = rows[query.limit - 1]
+        next_cursor = encode_cursor(last[1], last[0])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+async def get_admin_user(db: AsyncSession, id_token: str) -> User:
+    db_user = await get_authenticated_user(db, id_token)
+    if db_user.username not in settings.ADMIN_EMAILS:
+        AUTH_FAILURES.inc("forbidden")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required.")
+    return db_user
+
+
+@router.post("/usage/servers/{interface}/summary")
+async def server_usage_summary(interface: str, query: UsageQuery, db: AsyncSession = Depends(get_db)):
+    """
+    Ruta de administración para consultar el uso total de un servidor (nombre del nodo de WireGuard).
+    """
+    await get_admin_user(db, query.id_token)
+    return await get_usage_summary(db, "server", interface, query)
+
 
-    return {"message": "VPN disconnected successfully."}
\ No newline at end of file
+@router.post("/admin/nodes")
+async def list_nodes(token: Token, db: AsyncSession = Depends(get_db)):
+    """
+    Ruta de administración para consultar los nodos de WireGuard y su carga.
+    """
+    await get_admin_user(db, token.id_token)
+    return {"strategy": node_registry.strategy, "nodes": node_registry.stats()}
+
+
+def _set_node_status(name: str, new_status: str) -> bool:
+    with SessionLocal() as sync_db:
+        return node_registry.set_status(sync_db, name, new_status)
+
+
+@router.post("/admin/nodes/{name}/status")
+async def set_node_status(name: str, change: NodeStatusChange, db: AsyncSession = Depends(get_db)):
+    """
+    Ruta de administración para activar, vaciar ('draining') o desactivar un nodo.
+    """
+    await get_admin_user(db, change.id_token)
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(None, _set_node_status, name, change.status):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Node not found.")
+    return node_registry.node_for(name).stats()
+
+
+@router.post("/admin/nodes/{name}/drain")
+async def drain_node(name: str, request: DrainRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Ruta de administración para vaciar un nodo: deja de recibir peers nuevos y sus
+    peers se mueven a 'target' o a los nodos con menos carga. Con 'limit' se mueven
+    como máximo esos peers por llamada, para vaciarlo por partes.
+    """
+    await get_admin_user(db, request.id_token)
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(None, _set_node_status, name, "draining"):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Node not found.")
+    try:
+        # Mueve los peers en lotes de 'wg set' fuera del bucle de eventos.
+        result = await loop.run_in_executor(None, node_registry.rebalance, name, request.target, request.limit)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {"node": name, **result}
@@ -7,12 +7,113 @@ load_dotenv()
 class Settings:
     # Configuración de la base de datos
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./vpn.db")
+    # URL con driver asíncrono para las rutas. Si no se indica, se deriva de DATABASE_URL.
+    ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+    # Conexiones del pool asíncrono que se abren al arrancar, antes de la primera petición.
+    DB_WARM_CONNECTIONS = int(os.getenv("DB_WARM_CONNECTIONS", "4"))
 
     # Configuración de Firebase
     FIREBASE_SERVICE_ACCOUNT_PATH = os.getenv("FIREBASE_SERVICE_ACCOUNT_PATH")
+    # Segundos entre descargas en segundo plano de los certificados de firma de Google.
+    FIREBASE_CERT_REFRESH_INTERVAL = int(os.getenv("FIREBASE_CERT_REFRESH_INTERVAL", "900"))
+
+    # Caché de tokens ya verificados (expira con el 'exp' de cada token).
+    TOKEN_CACHE_ENABLED = os.getenv("TOKEN_CACHE_ENABLED", "true").lower() == "true"
+    TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+    # Comparte la caché entre los workers de la misma máquina a través del almacén local.
+    TOKEN_CACHE_SHARED = os.getenv("TOKEN_CACHE_SHARED", "false").lower() == "true"
+
+    # Fichero SQLite que comparten los workers de la misma máquina.
+    LOCAL_STORE_PATH = os.getenv("LOCAL_STORE_PATH", "./vpn_local_store.db")
+
+    # Métricas en formato Prometheus en /metrics. Desactivadas por defecto: la ruta no tiene
+    # autenticación, así que solo deben activarse si no es accesible desde fuera.
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+    # Permite pedir la cabecera Server-Timing (tiempo por etapa) enviando 'X-Debug-Timing'. Solo para depurar.
+    METRICS_TIMING_HEADER = os.getenv("METRICS_TIMING_HEADER", "false").lower() == "true"
 
     # Clave de encriptación (¡IMPORTANTE: Usar una clave fuerte y secreta!)
     SECRET_KEY = os.getenv("SECRET_KEY")
+    # Claves Fernet (separadas por comas) con las que se cifran las claves privadas de WireGuard en la
+    # base de datos. La primera cifra y todas descifran. Para rotar: añadir la nueva al principio,
+    # desplegar, ejecutar 'python -m app.services.key_rotation run' y después retirar la antigua.
+    # Por defecto, SECRET_KEY.
+    ENCRYPTION_KEYS = [
+        key.strip() for key in os.getenv("ENCRYPTION_KEYS", SECRET_KEY or "").split(",") if key.strip()
+    ]
+
+    # Emails (separados por comas) con acceso a las rutas de administración.
+    ADMIN_EMAILS = [email.strip() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()]
+
+    # Hashing de contraseñas
+    # Coste de bcrypt de los hashes nuevos.
+    BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    # Procesos dedicados a bcrypt y máximo de hashes en cola antes de rechazar con 503.
+    HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+    HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", "32"))
+
+    # Configuración de WireGuard
+    # Rango de direcciones para los clientes (ej. 10.0.0.0/24 o 10.8.0.0/16).
+    # La primera dirección útil queda reservada para el servidor.
+    WG_CLIENT_CIDR = os.getenv("WG_CLIENT_CIDR", "10.0.0.0/24")
+
+    # Número de pares de claves pre-generados listos para /vpn/connect.
+    WG_KEY_POOL_SIZE = int(os.getenv("WG_KEY_POOL_SIZE", "64"))
+
+    # Comando 'wg' a ejecutar. Puede apuntar a un sustituto local para pruebas (ej. "python benchmarks/fake_wg.py").
+    WG_COMMAND = os.getenv("WG_COMMAND", "sudo wg")
+    WG_INTERFACE = os.getenv("WG_INTERFACE", "wg0")
+    # Nodo por defecto: se registra en 'wg_nodes' con los valores de abajo si la tabla está vacía.
+    WG_NODE_NAME = os.getenv("WG_NODE_NAME", WG_INTERFACE)
+    # Datos del servidor que se escriben en la configuración de cada cliente.
+    WG_SERVER_PUBLIC_KEY = os.getenv("WG_SERVER_PUBLIC_KEY", "vaVEwDDfPYafXQe+GfVhcv6yLGmtDEwqdyteBd1mLHo=")
+    WG_SERVER_ENDPOINT = os.getenv("WG_SERVER_ENDPOINT", "192.168.160.1")
+    WG_SERVER_PORT = int(os.getenv("WG_SERVER_PORT", "51820"))
+    WG_CLIENT_DNS = os.getenv("WG_CLIENT_DNS", "8.8.8.8, 8.8.4.4")
+    # Comando 'wg' que se ejecuta en los nodos remotos (driver "ssh").
+    WG_REMOTE_COMMAND = os.getenv("WG_REMOTE_COMMAND", "sudo wg")
+    # Segundos que puede tardar un comando 'wg' (local o por SSH) y en conectar por SSH con un nodo.
+    WG_COMMAND_TIMEOUT = int(os.getenv("WG_COMMAND_TIMEOUT", "10"))
+    WG_SSH_CONNECT_TIMEOUT = int(os.getenv("WG_SSH_CONNECT_TIMEOUT", "5"))
+    # Criterio para colocar peers nuevos: "peers" (menos peers) o "throughput" (menos tráfico reciente).
+    WG_PLACEMENT_STRATEGY = os.getenv("WG_PLACEMENT_STRATEGY", "peers")
+    # Segundos entre recargas de la tabla 'wg_nodes' (0 = solo al arrancar).
+    WG_NODE_REFRESH_INTERVAL = int(os.getenv("WG_NODE_REFRESH_INTERVAL", "60"))
+    # Ventana en milisegundos para agrupar cambios de peers en un solo 'wg set'.
+    WG_BATCH_WINDOW_MS = int(os.getenv("WG_BATCH_WINDOW_MS", "20"))
+    WG_BATCH_MAX_PEERS = int(os.getenv("WG_BATCH_MAX_PEERS", "256"))
+    # Segundos entre reconciliaciones completas contra 'wg show <interfaz> dump' (0 = desactivado).
+    WG_RECONCILE_INTERVAL = int(os.getenv("WG_RECONCILE_INTERVAL", "300"))
+    # Un peer se considera conectado si su último handshake es más reciente que esto (segundos).
+    WG_HANDSHAKE_TIMEOUT = int(os.getenv("WG_HANDSHAKE_TIMEOUT", "180"))
+    # Segundos entre lecturas de 'wg show <interfaz> dump' para la telemetría (0 = desactivado).
+    TELEMETRY_INTERVAL = int(os.getenv("TELEMETRY_INTERVAL", "30"))
+    # Los peers sin handshake desde hace más de estos segundos se retiran de la interfaz y liberan su IP.
+    WG_PEER_TTL = int(os.getenv("WG_PEER_TTL", "86400"))
+    # Segundos entre revisiones de peers inactivos (0 = desactivado).
+    WG_REAPER_INTERVAL = int(os.getenv("WG_REAPER_INTERVAL", "600"))
+    # Las tareas periódicas de los nodos se ejecutan en un solo worker por máquina, el que tiene
+    # la concesión en el almacén local. Si ese worker muere, otro la toma a los segundos indicados.
+    WG_BACKGROUND_LEASE_TTL = int(os.getenv("WG_BACKGROUND_LEASE_TTL", "15"))
+
+
+    # Caché de configuraciones de cliente ya generadas para /vpn/connect.
+    CONFIG_CACHE_SIZE = int(os.getenv("CONFIG_CACHE_SIZE", "10000"))
+    CONFIG_CACHE_TTL = int(os.getenv("CONFIG_CACHE_TTL", "3600"))
+    # Propaga las invalidaciones a los demás workers de la máquina a través del almacén local.
+    CONFIG_CACHE_SHARED = os.getenv("CONFIG_CACHE_SHARED", "true").lower() == "true"
+
+    # Control de admisión de /vpn/connect y /vpn/disconnect en los caminos que ejecutan 'wg':
+    # token bucket por usuario y global (ráfaga y tokens que se recuperan por segundo; 0 = sin límite).
+    RATE_LIMIT_USER_BURST = int(os.getenv("RATE_LIMIT_USER_BURST", "5"))
+    RATE_LIMIT_USER_PER_SECOND = float(os.getenv("RATE_LIMIT_USER_PER_SECOND", "0.1"))
+    RATE_LIMIT_GLOBAL_BURST = int(os.getenv("RATE_LIMIT_GLOBAL_BURST", "500"))
+    RATE_LIMIT_GLOBAL_PER_SECOND = float(os.getenv("RATE_LIMIT_GLOBAL_PER_SECOND", "100"))
+    # Segundos que una operación de un usuario espera a que termine otra suya en otro worker
+    # (y duración máxima del cerrojo si el worker que lo tenía muere).
+    USER_LOCK_TIMEOUT = int(os.getenv("USER_LOCK_TIMEOUT", "30"))
+    # Comparte los límites y los cerrojos por usuario entre los workers de la máquina a través del almacén local.
+    ADMISSION_SHARED = os.getenv("ADMISSION_SHARED", "true").lower() == "true"
 
 
 settings = Settings()
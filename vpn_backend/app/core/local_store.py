@@ -0,0 +1,178 @@
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+from .config import settings
+
+LEASE_NAMESPACE = "lease"
+# Segundos mínimos entre limpiezas de las entradas caducadas, que hace el propio proceso al escribir.
+PURGE_INTERVAL = 300
+
+
+class LocalStore:
+    """
+    Almacén clave-valor con expiración en un fichero SQLite local.
+    Permite que varios workers de la misma máquina compartan datos sin un servicio externo.
+    Las entradas caducadas se borran al escribir, como mucho cada 'purge_interval' segundos.
+    """
+
+    def __init__(self, path: str, purge_interval: float = PURGE_INTERVAL):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._purge_lock = threading.Lock()
+        self._next_purge = time.monotonic() + purge_interval
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS kv ("
+                        "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                        "expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+                    )
+                    self._initialized = True
+        return conn
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        row = self._connection().execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (namespace, key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def keys(self, namespace: str) -> List[str]:
+        """Claves vigentes del espacio de nombres."""
+        return [row[0] for row in self._connection().execute(
+            "SELECT key FROM kv WHERE namespace = ? AND expires_at > ?", (namespace, time.time())
+        )]
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        if now < self._next_purge:
+            return
+        with self._purge_lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + self.purge_interval
+        try:
+            self.purge_expired()
+        except sqlite3.Error as e:
+            print(f"Error al limpiar el almacén local: {e}")
+
+    def set(self, namespace: str, key: str, value: str, expires_at: float):
+        self._maybe_purge()
+        self._connection().execute(
+            "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, value, expires_at)
+        )
+
+    def add(self, namespace: str, key: str, value: str, expires_at: float) -> bool:
+        """Escribe 'value' solo si la clave no existe o caducó. Retorna si se escribió."""
+        self._maybe_purge()
+        return self._connection().execute(
+            "INSERT INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE kv.expires_at <= ?",
+            (namespace, key, value, expires_at, time.time())
+        ).rowcount == 1
+
+    def compare_and_set(self, namespace: str, key: str, expected: Optional[str], value: str, expires_at: float) -> bool:
+        """
+        Escribe 'value' solo si el valor vigente sigue siendo 'expected' (None: la clave
+        no existe o caducó). Retorna si se escribió; si no, otro worker se adelantó.
+        """
+        if expected is None:
+            return self.add(namespace, key, value, expires_at)
+        return self._connection().execute(
+            "UPDATE kv SET value = ?, expires_at = ? WHERE namespace = ? AND key = ? AND value = ? AND expires_at > ?",
+            (value, expires_at, namespace, key, expected, time.time())
+        ).rowcount == 1
+
+    def delete(self, namespace: str, key: str, expected: Optional[str] = None):
+        """Borra la clave. Con 'expected', solo si su valor sigue siendo ese (ej. liberar un cerrojo propio)."""
+        if expected is None:
+            self._connection().execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+        else:
+            self._connection().execute(
+                "DELETE FROM kv WHERE namespace = ? AND key = ? AND value = ?", (namespace, key, expected)
+            )
+
+    def purge_expired(self) -> int:
+        """Elimina las entradas caducadas. Retorna cuántas se borraron."""
+        return self._connection().execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),)).rowcount
+
+
+class Lease:
+    """
+    Concesión con nombre en el almacén local: solo la tiene un proceso de la máquina
+    a la vez. Un hilo la toma o la renueva cada 'ttl / 3' segundos; si el proceso
+    muere, caduca a los 'ttl' segundos y la toma otro. El proceso deja de considerarla
+    suya un tercio antes de que caduque en el almacén, así nunca la tienen dos a la vez.
+    """
+
+    def __init__(self, store: LocalStore, name: str, ttl: float = 15.0):
+        self.store = store
+        self.name = name
+        self.ttl = max(ttl, 1.0)
+        self.owner = uuid.uuid4().hex
+        self._held_until = 0.0  # time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def held(self) -> bool:
+        return time.monotonic() < self._held_until
+
+    def renew(self) -> bool:
+        """Toma la concesión si está libre o renueva la propia. Retorna si este proceso la tiene."""
+        started = time.monotonic()
+        expires_at = time.time() + self.ttl
+        try:
+            held = (
+                self.store.compare_and_set(LEASE_NAMESPACE, self.name, self.owner, self.owner, expires_at)
+                or self.store.add(LEASE_NAMESPACE, self.name, self.owner, expires_at)
+            )
+        except Exception as e:
+            print(f"Error al renovar la concesión {self.name}: {e}")
+            held = False
+        self._held_until = started + self.ttl * 2 / 3 if held else 0.0
+        return held
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self.renew()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Detiene la renovación y libera la concesión para que otro proceso la tome en el momento."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._held_until:
+            self._held_until = 0.0
+            try:
+                self.store.delete(LEASE_NAMESPACE, self.name, expected=self.owner)
+            except Exception as e:
+                print(f"Error al liberar la concesión {self.name}: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.ttl / 3):
+            self.renew()
+
+
+local_store = LocalStore(settings.LOCAL_STORE_PATH)
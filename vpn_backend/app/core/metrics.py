@@ -0,0 +1,268 @@
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Límites (en segundos) de los histogramas de latencia.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Tiempos por etapa de la petición en curso, solo si pidió la cabecera de tiempos.
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """Métrica con etiquetas. Los valores se guardan por tupla de valores de etiqueta."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _samples(self) -> Iterable[Tuple[str, tuple, str, float]]:
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name, labels, "", value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, extra, value in self._samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # [cuenta por intervalo (el último es +Inf), suma]
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def _samples(self):
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket", labels, f'le="{bound}"', cumulative
+            cumulative += counts[-1]
+            yield f"{self.name}_bucket", labels, 'le="+Inf"', cumulative
+            yield f"{self.name}_sum", labels, "", total
+            yield f"{self.name}_count", labels, "", cumulative
+
+
+class CallbackMetric(Metric):
+    """Métrica cuyo valor se lee al exportar, con una función que retorna [(etiquetas, valor), ...]."""
+
+    def __init__(self, name: str, documentation: str, type: str, labelnames: Iterable[str], function: Callable):
+        super().__init__(name, documentation, labelnames)
+        self.type = type
+        self.function = function
+
+    def _samples(self):
+        try:
+            values = list(self.function())
+        except Exception as e:
+            print(f"Error al leer la métrica {self.name}: {e}")
+            return
+        for labels, value in values:
+            if value is not None:
+                yield self.name, tuple(labels), "", value
+
+
+class MetricsRegistry:
+    """Conjunto de métricas que se exportan en formato de texto de Prometheus."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, type: str, labelnames: Iterable[str], function: Callable) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, type, labelnames, function))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+REQUESTS_IN_FLIGHT = registry.gauge("vpn_http_requests_in_flight", "Peticiones HTTP en curso.")
+REQUEST_SECONDS = registry.histogram(
+    "vpn_http_request_duration_seconds", "Duración de las peticiones HTTP.", ("method", "route", "status")
+)
+STAGE_SECONDS = registry.histogram(
+    "vpn_stage_duration_seconds", "Duración de cada etapa de las peticiones y tareas.", ("stage",)
+)
+DB_QUERY_SECONDS = registry.histogram(
+    "vpn_db_query_duration_seconds", "Duración de las consultas a la base de datos.", ("engine",)
+)
+WG_COMMAND_SECONDS = registry.histogram(
+    "vpn_wg_command_duration_seconds", "Duración de las invocaciones de 'wg'.", ("command",)
+)
+WG_COMMAND_FAILURES = registry.counter(
+    "vpn_wg_command_failures_total", "Invocaciones de 'wg' que fallaron.", ("command",)
+)
+AUTH_FAILURES = registry.counter(
+    "vpn_auth_failures_total", "Autenticaciones rechazadas.", ("reason",)
+)
+
+
+def add_timing(name: str, seconds: float):
+    """Añade un tiempo a la cabecera de tiempos de la petición en curso (si la pidió)."""
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+class stage:
+    """
+    Mide una etapa: 'with stage("firebase_verify"): ...'.
+    Se guarda en el histograma de etapas y en la cabecera de tiempos de la petición.
+    """
+
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        STAGE_SECONDS.observe(elapsed, self.name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((self.name, elapsed))
+        return False
+
+
+def server_timing(timings: List[Tuple[str, float]]) -> str:
+    """Valor de la cabecera Server-Timing: suma los tiempos de cada etapa, en milisegundos."""
+    totals: Dict[str, float] = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in totals.items())
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI que cuenta las peticiones en curso y mide su duración por ruta.
+    Si 'timing_header' está activo y la petición envía 'X-Debug-Timing', la
+    respuesta incluye una cabecera Server-Timing con el tiempo de cada etapa.
+    """
+
+    def __init__(self, app, timing_header: bool = False):
+        self.app = app
+        self.timing_header = timing_header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        timings = None
+        if self.timing_header and any(name == b"x-debug-timing" for name, _ in scope["headers"]):
+            timings = []
+        token = _request_timings.set(timings)
+        status = 500
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if timings is not None:
+                    timings.append(("total", time.perf_counter() - started))
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", server_timing(timings).encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                status
+            )
+            _request_timings.reset(token)
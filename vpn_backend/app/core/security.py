@@ -1,28 +1,158 @@
-from cryptography.fernet import Fernet
+import asyncio
+import hashlib
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import Optional
+from cryptography.fernet import Fernet, MultiFernet
 import bcrypt
 from .config import settings
+from .metrics import stage
 
 # Encriptación de datos
 
+# Los tokens Fernet empiezan por el byte de versión 0x80 ("gAAAAA" en base64) y son
+# bastante más largos que una clave de WireGuard (44 caracteres).
+FERNET_PREFIX = "gAAAAA"
+WG_KEY_LENGTH = 44
+
+_cipher: Optional[MultiFernet] = None
+_cipher_lock = threading.Lock()
+
+
+def get_cipher() -> MultiFernet:
+    """
+    Cifrador construido una sola vez a partir de ENCRYPTION_KEYS: cifra con la
+    primera clave y descifra con cualquiera de ellas, para poder rotarlas.
+    """
+    global _cipher
+    if _cipher is None:
+        with _cipher_lock:
+            if _cipher is None:
+                if not settings.ENCRYPTION_KEYS:
+                    raise ValueError("No hay claves de encriptación: define ENCRYPTION_KEYS (o SECRET_KEY).")
+                _cipher = MultiFernet([Fernet(key.encode()) for key in settings.ENCRYPTION_KEYS])
+    return _cipher
+
+
+def primary_key_id() -> str:
+    """Huella de la clave con la que se cifra (la primera de ENCRYPTION_KEYS)."""
+    if not settings.ENCRYPTION_KEYS:
+        raise ValueError("No hay claves de encriptación: define ENCRYPTION_KEYS (o SECRET_KEY).")
+    return hashlib.sha256(settings.ENCRYPTION_KEYS[0].encode()).hexdigest()[:16]
+
 
 def encrypt_data(data: bytes) -> bytes:
-    key = settings.SECRET_KEY.encode()
-    f = Fernet(key)
-    return f.encrypt(data)
+    return get_cipher().encrypt(data)
 
 
 def decrypt_data(token: bytes) -> bytes:
-    key = settings.SECRET_KEY.encode()
-    f = Fernet(key)
-    return f.decrypt(token)
+    return get_cipher().decrypt(token)
+
+
+def is_encrypted(value: str) -> bool:
+    return len(value) > WG_KEY_LENGTH and value.startswith(FERNET_PREFIX)
+
+
+def encrypt_secret(value: str) -> str:
+    """Cifra un secreto (ej. una clave privada de WireGuard) para guardarlo en la base de datos."""
+    return encrypt_data(value.encode()).decode()
+
+
+def decrypt_secret(value: Optional[str]) -> Optional[str]:
+    """
+    Descifra un secreto guardado. Los valores anteriores a la encriptación (en claro)
+    se retornan tal cual hasta que el comando de rotación los cifre.
+    Lanza InvalidToken si ninguna clave de ENCRYPTION_KEYS lo descifra.
+    """
+    if not value or not is_encrypted(value):
+        return value
+    return decrypt_data(value.encode()).decode()
+
+
+def rotate_secret(value: str) -> str:
+    """Vuelve a cifrar un secreto con la clave principal (o lo cifra, si estaba en claro)."""
+    if is_encrypted(value):
+        return get_cipher().rotate(value.encode()).decode()
+    return encrypt_secret(value)
 
 # Hashing de contraseñas
 
 
-def get_password_hash(password: str) -> str:
-    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+def get_password_hash(password: str, rounds: Optional[int] = None) -> str:
+    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds or settings.BCRYPT_ROUNDS))
     return hashed.decode('utf-8')
 
 
 def verify_password(password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+def _warm_up():
+    return None
+
+
+class HashingBusy(Exception):
+    """La cola de hashing está llena; la petición debe rechazarse."""
+
+
+class HashingPool:
+    """
+    Pool de procesos dedicado a bcrypt con admisión acotada.
+
+    Como mucho 'max_pending' operaciones esperan o se ejecutan a la vez; el resto
+    se rechaza en el momento con HashingBusy, de modo que una ráfaga de registros
+    no ocupa los hilos ni la CPU que necesitan las demás rutas.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = max(workers, 1)
+        self.max_pending = max(max_pending, 1)
+        self._executor = None
+        self._pending = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._executor is None:
+            # 'spawn' evita heredar los hilos del servidor en los procesos hijos.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            for _ in range(self.workers):
+                self._executor.submit(_warm_up)
+
+    def warm_up(self, timeout: float = 30) -> bool:
+        """Arranca el pool y espera a que sus procesos respondan (con 'spawn', cada uno importa bcrypt al nacer)."""
+        self.start()
+        done, not_done = wait([self._executor.submit(_warm_up) for _ in range(self.workers)], timeout)
+        return not not_done
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def run(self, func, *args):
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise HashingBusy()
+        self.start()
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+
+
+hashing_pool = HashingPool(settings.HASH_WORKERS, settings.HASH_MAX_PENDING)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Calcula el hash en el pool de procesos. Lanza HashingBusy si la cola está llena."""
+    with stage("password_hash"):
+        return await hashing_pool.run(get_password_hash, password, settings.BCRYPT_ROUNDS)
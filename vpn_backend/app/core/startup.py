@@ -0,0 +1,120 @@
+import asyncio
+import json
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Se importa antes que el resto de la aplicación: marca el inicio del arranque del worker.
+IMPORT_STARTED = time.perf_counter()
+
+
+class Readiness:
+    """
+    Estado del arranque del worker: cada tarea de calentamiento se registra con su
+    resultado y su duración. El worker está listo cuando todas terminaron y las
+    obligatorias (base de datos, nodos, Firebase) lo hicieron sin error.
+    """
+
+    def __init__(self):
+        self.import_seconds: Optional[float] = None
+        self.ready_seconds: Optional[float] = None
+        self._components: Dict[str, dict] = {}
+
+    def imported(self):
+        """Marca el final de la importación de la aplicación."""
+        self.import_seconds = time.perf_counter() - IMPORT_STARTED
+
+    def add(self, name: str, required: bool = True):
+        self._components[name] = {"required": required, "status": "pending", "seconds": None}
+
+    async def run(self, name: str, func: Callable, *args, required: bool = True, blocking: bool = True):
+        """
+        Ejecuta una tarea de calentamiento y guarda su resultado.
+        Las funciones bloqueantes se ejecutan en un hilo para poder lanzar varias en paralelo.
+        """
+        if name not in self._components:
+            self.add(name, required)
+        component = self._components[name]
+        started = time.perf_counter()
+        try:
+            result = await (asyncio.to_thread(func, *args) if blocking else func(*args))
+            # Una tarea que retorna False terminó, pero sin conseguir su objetivo.
+            component["status"] = "failed" if result is False else "ok"
+        except Exception as e:
+            print(f"Error en el arranque ({name}): {e}")
+            component["status"] = "failed"
+            component["error"] = str(e)
+            result = None
+        component["seconds"] = time.perf_counter() - started
+        self._check()
+        return result
+
+    def skip(self, name: str):
+        """Marca como omitida una tarea que dependía de otra que falló."""
+        self._components[name]["status"] = "skipped"
+        self._check()
+
+    def status(self, name: str) -> Optional[str]:
+        component = self._components.get(name)
+        return component["status"] if component else None
+
+    def _check(self):
+        if self.ready_seconds is None and self.ready:
+            self.ready_seconds = time.perf_counter() - IMPORT_STARTED
+
+    @property
+    def finished(self) -> bool:
+        # Sin tareas registradas, el calentamiento aún no empezó.
+        return bool(self._components) and all(component["status"] != "pending" for component in self._components.values())
+
+    @property
+    def ready(self) -> bool:
+        return self.finished and all(
+            component["status"] == "ok" for component in self._components.values() if component["required"]
+        )
+
+    def timings(self) -> List[Tuple[Tuple[str], Optional[float]]]:
+        """Duración de cada fase del arranque, para las métricas: [((fase,), segundos), ...]."""
+        phases = [(("import",), self.import_seconds), (("ready",), self.ready_seconds)]
+        return phases + [((name,), component["seconds"]) for name, component in self._components.items()]
+
+    def snapshot(self) -> dict:
+        return {
+            "status": "ready" if self.ready else ("failed" if self.finished else "starting"),
+            "import_s": self.import_seconds,
+            "ready_s": self.ready_seconds,
+            "components": {name: dict(component) for name, component in self._components.items()},
+        }
+
+
+class ReadinessMiddleware:
+    """
+    Middleware ASGI que responde 503 mientras el worker no está listo, salvo en
+    las rutas de sondeo y métricas, para que ninguna petición llegue a una base
+    de datos o a unos nodos sin cargar.
+    """
+
+    def __init__(self, app, readiness: Readiness, exempt=("/healthz", "/readyz", "/metrics")):
+        self.app = app
+        self.readiness = readiness
+        self.exempt = frozenset(exempt)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.readiness.ready_seconds is not None or scope["path"] in self.exempt:
+            await self.app(scope, receive, send)
+            return
+
+        detail = "Service unavailable: startup failed." if self.readiness.finished else "Service is starting, please retry."
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", b"1"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+readiness = Readiness()
@@ -1,27 +1,98 @@
-from sqlalchemy import create_engine
+import asyncio
+import time
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from .models import Base
 from ..core.config import settings
+from ..core.metrics import DB_QUERY_SECONDS, add_timing
+
+# Drivers asíncronos equivalentes a los drivers síncronos de DATABASE_URL.
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+
+def get_async_database_url(url: str) -> str:
+    """
+    Convierte la URL de la base de datos a su equivalente con driver asíncrono.
+    """
+    if settings.ASYNC_DATABASE_URL:
+        return settings.ASYNC_DATABASE_URL
+    scheme, sep, rest = url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
 
 # Crea la conexión a la base de datos usando la URL de PostgreSQL.
+# El motor síncrono lo usan las tareas en segundo plano y la creación de tablas.
 engine = create_engine(settings.DATABASE_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# El motor asíncrono lo usan las rutas de la API.
+async_engine = create_async_engine(get_async_database_url(settings.DATABASE_URL))
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+def instrument_engine(sync_engine, label: str):
+    """
+    Mide la duración de cada consulta del motor (histograma por motor y cabecera de tiempos).
+    """
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _query_started(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _query_finished(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        DB_QUERY_SECONDS.observe(elapsed, label)
+        add_timing("db", elapsed)
+
+
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+
 
 def create_db_tables():
     """
     Crea todas las tablas definidas en 'models.py' en la base de datos.
     """
-    Base.metadata.create_all(bind=engine)
+    for attempt in range(3):
+        try:
+            Base.metadata.create_all(bind=engine)
+            return
+        except (OperationalError, ProgrammingError):
+            # En el primer arranque con varios workers, otro puede crear la misma tabla a la vez:
+            # se vuelve a intentar y create_all omite las que ya existen.
+            if attempt == 2:
+                raise
+            time.sleep(0.1)
 
 
-def get_db():
+async def warm_up_pool(connections: int) -> int:
     """
-    Una función 'generadora' para obtener una sesión de base de datos.
+    Abre a la vez hasta 'connections' conexiones del pool asíncrono y las devuelve al
+    pool, para que las primeras peticiones no paguen el coste de conectar.
+    Retorna el número de conexiones abiertas.
     """
-    db = SessionLocal()
+    size = getattr(async_engine.pool, "size", None)
+    count = max(min(connections, size()) if callable(size) else connections, 1)
+    conns = [async_engine.connect() for _ in range(count)]
     try:
-        yield db
+        await asyncio.gather(*(conn.start() for conn in conns))
+        await asyncio.gather(*(conn.execute(text("SELECT 1")) for conn in conns))
     finally:
-        db.close()
+        await asyncio.gather(*(conn.close() for conn in conns), return_exceptions=True)
+    return count
+
+
+async def get_db():
+    """
+    Una función 'generadora' para obtener una sesión asíncrona de base de datos.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
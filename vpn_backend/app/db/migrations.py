@@ -0,0 +1,259 @@
+"""
+Migraciones del esquema para bases de datos creadas con versiones anteriores.
+
+'create_db_tables' (create_all) crea las tablas que faltan, pero no añade columnas
+ni cambia índices o restricciones de las que ya existen. Cada migración mira el
+esquema real y solo se aplica si hace falta, así que ejecutarlas todas es seguro.
+Al arrancar, la API comprueba que no quede ninguna pendiente.
+
+Uso (desde vpn_backend/, con la API detenida):
+    python -m app.db.migrations           aplica las migraciones pendientes
+    python -m app.db.migrations --check   solo las lista (sale con 1 si hay alguna)
+"""
+import argparse
+import sys
+from datetime import datetime
+from typing import Callable, Iterable, List, NamedTuple
+
+from sqlalchemy import MetaData, inspect, literal, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import AddConstraint, CreateTable
+
+from .models import Base
+
+connection_logs = Base.metadata.tables["connection_logs"]
+users = Base.metadata.tables["users"]
+ip_pool_state = Base.metadata.tables["ip_pool_state"]
+
+
+class Migration(NamedTuple):
+    name: str
+    description: str
+    # Recibe el inspector de la conexión y retorna si hay que aplicarla.
+    pending: Callable
+    apply: Callable[[Connection], None]
+
+
+def _missing_columns(inspector, table, names: Iterable[str]) -> List[str]:
+    existing = {column["name"] for column in inspector.get_columns(table.name)}
+    return [name for name in names if name not in existing]
+
+
+def _missing_indexes(inspector, table, names: Iterable[str]) -> List[str]:
+    existing = {index["name"] for index in inspector.get_indexes(table.name)}
+    return [name for name in names if name not in existing]
+
+
+def _add_columns(conn: Connection, table, names: Iterable[str]):
+    """Añade las columnas del modelo que falten. Las NOT NULL toman su valor por defecto en las filas existentes."""
+    for name in _missing_columns(inspect(conn), table, names):
+        column = table.c[name]
+        ddl = f"ALTER TABLE {table.name} ADD COLUMN {name} {column.type.compile(dialect=conn.dialect)}"
+        if not column.nullable:
+            value = literal(column.default.arg, column.type).compile(
+                dialect=conn.dialect, compile_kwargs={"literal_binds": True}
+            )
+            ddl += f" NOT NULL DEFAULT {value}"
+        conn.execute(text(ddl))
+
+
+def _create_indexes(conn: Connection, table, names: Iterable[str]):
+    names = set(_missing_indexes(inspect(conn), table, names))
+    for index in table.indexes:
+        if index.name in names:
+            index.create(conn)
+
+
+def _unique_columns(inspector, table) -> List[tuple]:
+    """Columnas de cada restricción o índice único de la tabla."""
+    uniques = [tuple(unique["column_names"]) for unique in inspector.get_unique_constraints(table.name)]
+    uniques += [tuple(index["column_names"]) for index in inspector.get_indexes(table.name) if index["unique"]]
+    return uniques
+
+
+def _rebuild_table(conn: Connection, table):
+    """
+    SQLite no puede quitar ni añadir restricciones a una tabla: se crea otra con el
+    esquema del modelo, se copian las columnas que ya existían y se cambia por la original.
+    """
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    columns = ", ".join(column.name for column in table.columns if column.name in existing)
+    copy = table.to_metadata(MetaData(), name=f"{table.name}__new")
+    conn.execute(CreateTable(copy))
+    conn.execute(text(f"INSERT INTO {copy.name} ({columns}) SELECT {columns} FROM {table.name}"))
+    conn.execute(text(f"DROP TABLE {table.name}"))
+    conn.execute(text(f"ALTER TABLE {copy.name} RENAME TO {table.name}"))
+    for index in table.indexes:
+        index.create(conn)
+
+
+# --- Telemetría de WireGuard en 'connection_logs' -----------------------------------
+
+TELEMETRY_COLUMNS = ("public_key", "interface", "rx_bytes", "tx_bytes")
+TELEMETRY_INDEXES = ("ix_connection_logs_public_key", "uq_connection_logs_open_session")
+
+
+def _telemetry_pending(inspector) -> bool:
+    return bool(
+        _missing_columns(inspector, connection_logs, TELEMETRY_COLUMNS)
+        or _missing_indexes(inspector, connection_logs, TELEMETRY_INDEXES)
+    )
+
+
+def _telemetry_apply(conn: Connection):
+    _add_columns(conn, connection_logs, TELEMETRY_COLUMNS)
+    conn.execute(text("UPDATE connection_logs SET rx_bytes = 0 WHERE rx_bytes IS NULL"))
+    conn.execute(text("UPDATE connection_logs SET tx_bytes = 0 WHERE tx_bytes IS NULL"))
+    # Sesiones abiertas repetidas (varios colectores a la vez): son copias de la misma
+    # sesión, se conserva la primera para poder crear el índice único.
+    conn.execute(text(
+        "DELETE FROM connection_logs WHERE disconnected_at IS NULL AND public_key IS NOT NULL "
+        "AND id NOT IN (SELECT MIN(id) FROM connection_logs WHERE disconnected_at IS NULL "
+        "AND public_key IS NOT NULL GROUP BY interface, public_key)"
+    ))
+    _create_indexes(conn, connection_logs, TELEMETRY_INDEXES)
+
+
+# --- Resúmenes de uso ---------------------------------------------------------------
+
+ROLLUP_INDEXES = ("ix_connection_logs_user_connected", "ix_connection_logs_pending_rollup")
+
+
+def _rollups_pending(inspector) -> bool:
+    return bool(
+        _missing_columns(inspector, connection_logs, ["rolled_up"])
+        or _missing_indexes(inspector, connection_logs, ROLLUP_INDEXES)
+    )
+
+
+def _rollups_apply(conn: Connection):
+    # Las sesiones existentes quedan sin contar: la siguiente actualización las suma.
+    _add_columns(conn, connection_logs, ["rolled_up"])
+    _create_indexes(conn, connection_logs, ROLLUP_INDEXES)
+
+
+# --- Retirada de peers inactivos -------------------------------------------------------
+
+def _peer_added_at_pending(inspector) -> bool:
+    return bool(_missing_columns(inspector, users, ["wg_peer_added_at"]))
+
+
+def _peer_added_at_apply(conn: Connection):
+    _add_columns(conn, users, ["wg_peer_added_at"])
+    # Los peers que ya existen cuentan como añadidos ahora: el reaper solo retira usuarios
+    # con la marca, y así se retiran si pasan el TTL sin handshake.
+    conn.execute(
+        text("UPDATE users SET wg_peer_added_at = :now WHERE wg_ip_address IS NOT NULL AND wg_peer_added_at IS NULL"),
+        {"now": datetime.utcnow()},
+    )
+
+
+# --- Nodos de WireGuard ----------------------------------------------------------------
+
+def _users_nodes_pending(inspector) -> bool:
+    uniques = _unique_columns(inspector, users)
+    return bool(
+        _missing_columns(inspector, users, ["wg_node"])
+        or _missing_indexes(inspector, users, ["ix_users_wg_node"])
+        or ("wg_ip_address",) in uniques
+        or ("wg_node", "wg_ip_address") not in uniques
+    )
+
+
+def _users_nodes_apply(conn: Connection):
+    # La IP pasa a ser única dentro de cada nodo. Los usuarios existentes quedan sin
+    # nodo y la API los asigna al nodo por defecto al arrancar.
+    if conn.dialect.name == "sqlite":
+        _rebuild_table(conn, users)
+        return
+    _add_columns(conn, users, ["wg_node"])
+    for unique in inspect(conn).get_unique_constraints(users.name):
+        if unique["column_names"] == ["wg_ip_address"]:
+            conn.execute(text(f'ALTER TABLE {users.name} DROP CONSTRAINT "{unique["name"]}"'))
+    if ("wg_node", "wg_ip_address") not in _unique_columns(inspect(conn), users):
+        conn.execute(AddConstraint(next(c for c in users.constraints if c.name == "uq_users_node_ip")))
+    _create_indexes(conn, users, ["ix_users_wg_node"])
+
+
+def _ip_pool_state_nodes_pending(inspector) -> bool:
+    return bool(
+        _missing_columns(inspector, ip_pool_state, ["node"])
+        or ("node", "cidr") not in _unique_columns(inspector, ip_pool_state)
+        or ("cidr",) in _unique_columns(inspector, ip_pool_state)
+    )
+
+
+def _ip_pool_state_nodes_apply(conn: Connection):
+    # Solo guarda instantáneas del asignador: se vuelve a crear vacía y el siguiente arranque guarda otra.
+    ip_pool_state.drop(conn)
+    ip_pool_state.create(conn)
+
+
+MIGRATIONS = [
+    Migration(
+        "connection_logs_telemetry",
+        "columnas de telemetría de connection_logs y una sola sesión abierta por peer y nodo",
+        _telemetry_pending,
+        _telemetry_apply,
+    ),
+    Migration(
+        "connection_logs_rollups",
+        "marca 'rolled_up' de connection_logs e índices del historial y de los resúmenes",
+        _rollups_pending,
+        _rollups_apply,
+    ),
+    Migration(
+        "users_peer_added_at",
+        "columna 'wg_peer_added_at' de users, con los peers existentes marcados como añadidos ahora",
+        _peer_added_at_pending,
+        _peer_added_at_apply,
+    ),
+    Migration(
+        "users_nodes",
+        "columna 'wg_node' de users y la IP única dentro de cada nodo en lugar de en toda la tabla",
+        _users_nodes_pending,
+        _users_nodes_apply,
+    ),
+    Migration(
+        "ip_pool_state_nodes",
+        "instantáneas del asignador de IPs por nodo y rango (se descartan las anteriores)",
+        _ip_pool_state_nodes_pending,
+        _ip_pool_state_nodes_apply,
+    ),
+]
+
+
+def pending_migrations(engine: Engine) -> List[Migration]:
+    """Migraciones que faltan por aplicar en la base de datos. Las tablas deben existir (create_all)."""
+    with engine.connect() as conn:
+        inspector = inspect(conn)
+        return [migration for migration in MIGRATIONS if migration.pending(inspector)]
+
+
+def run_migrations(engine: Engine) -> List[str]:
+    """Aplica las migraciones pendientes, cada una en su transacción. Retorna sus nombres."""
+    applied = []
+    for migration in MIGRATIONS:
+        with engine.begin() as conn:
+            if not migration.pending(inspect(conn)):
+                continue
+            migration.apply(conn)
+        applied.append(migration.name)
+    return applied
+
+
+if __name__ == "__main__":
+    from .database import create_db_tables, engine
+
+    parser = argparse.ArgumentParser(description="Actualiza el esquema de una base de datos existente.")
+    parser.add_argument("--check", action="store_true", help="solo lista las migraciones pendientes")
+    args = parser.parse_args()
+
+    create_db_tables()
+    if args.check:
+        pending = pending_migrations(engine)
+        for migration in pending:
+            print(f"{migration.name}\t{migration.description}")
+        sys.exit(1 if pending else 0)
+    for name in run_migrations(engine):
+        print(f"Aplicada: {name}")
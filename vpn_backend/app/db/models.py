@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from sqlalchemy import Column, Integer, BigInteger, Float, String, DateTime, Boolean, LargeBinary, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 
@@ -19,8 +19,56 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     # CAMPOS PARA WIREGUARD
     wg_public_key = Column(String, unique=True, nullable=True) # Clave pública del cliente
-    wg_private_key = Column(String, unique=True, nullable=True) # Clave privada del cliente
-    wg_ip_address = Column(String, unique=True, nullable=True) # La IP interna asignada (ej. 10.0.0.X)
+    wg_private_key = Column(String, unique=True, nullable=True) # Clave privada del cliente, cifrada con ENCRYPTION_KEYS
+    wg_ip_address = Column(String, nullable=True) # La IP interna asignada (ej. 10.0.0.X)
+    wg_peer_added_at = Column(DateTime, nullable=True) # Cuándo se añadió el peer al servidor (None si no está activo)
+    wg_node = Column(String, index=True, nullable=True) # Nombre del nodo de WireGuard del usuario
+
+    __table_args__ = (
+        # Cada nodo tiene su propio rango: la IP solo es única dentro del nodo.
+        UniqueConstraint("wg_node", "wg_ip_address", name="uq_users_node_ip"),
+    )
+
+
+class WgNode(Base):
+    """
+    Modelo de la tabla 'wg_nodes'.
+    Servidores (interfaces) de WireGuard entre los que se reparten los peers.
+    """
+    __tablename__ = "wg_nodes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True, nullable=False)
+    interface = Column(String, nullable=False, default="wg0")
+    endpoint = Column(String, nullable=False) # IP o dominio público del servidor
+    port = Column(Integer, default=51820)
+    public_key = Column(String, nullable=False)
+    client_cidr = Column(String, nullable=False) # Rango de direcciones de los clientes del nodo
+    dns = Column(String, default="8.8.8.8, 8.8.4.4")
+    driver = Column(String, default="local") # "local", "ssh" o "fake"
+    driver_target = Column(String, nullable=True) # Comando 'wg' (local) o host (ssh)
+    weight = Column(Float, default=1.0) # Capacidad relativa del nodo en el reparto de peers
+    status = Column(String, default="active") # "active", "draining" o "disabled"
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class KeyRotationProgress(Base):
+    """
+    Modelo de la tabla 'key_rotation_progress'.
+    Progreso de la re-encriptación de las claves privadas, una fila por clave de
+    destino, para poder reanudarla donde se quedó.
+    """
+    __tablename__ = "key_rotation_progress"
+
+    id = Column(Integer, primary_key=True, index=True)
+    key_id = Column(String, unique=True, nullable=False) # Huella de la clave principal de destino
+    last_user_id = Column(Integer, default=0, nullable=False) # Último usuario procesado (paginación por id)
+    rotated = Column(Integer, default=0)
+    skipped = Column(Integer, default=0) # Filas que cambiaron durante la rotación (ya las reescribió la API)
+    failed = Column(Integer, default=0) # Filas que ninguna clave pudo descifrar
+    started_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
 
 
 class ConnectionLog(Base):
@@ -34,4 +82,68 @@ class ConnectionLog(Base):
     user_id = Column(Integer, index=True)
     ip_address = Column(String)
     connected_at = Column(DateTime, default=datetime.utcnow)
-    disconnected_at = Column(DateTime, nullable=True)
\ No newline at end of file
+    disconnected_at = Column(DateTime, nullable=True)
+    # Datos del peer de WireGuard recogidos por el colector de telemetría.
+    public_key = Column(String, index=True, nullable=True)
+    interface = Column(String, nullable=True)
+    rx_bytes = Column(BigInteger, default=0)
+    tx_bytes = Column(BigInteger, default=0)
+    # True cuando la sesión cerrada ya está sumada en 'usage_rollups'.
+    rolled_up = Column(Boolean, default=False, nullable=False)
+
+    __table_args__ = (
+        # Historial por usuario ordenado por fecha (paginación por cursor).
+        Index("ix_connection_logs_user_connected", "user_id", "connected_at", "id"),
+        # Sesiones pendientes de sumar a los resúmenes de uso.
+        Index("ix_connection_logs_pending_rollup", "rolled_up", "id"),
+        # Como mucho una sesión abierta por peer y nodo, aunque lean dos colectores a la vez.
+        Index(
+            "uq_connection_logs_open_session", "interface", "public_key", unique=True,
+            sqlite_where=disconnected_at.is_(None), postgresql_where=disconnected_at.is_(None)
+        ),
+    )
+
+
+class IPPoolState(Base):
+    """
+    Modelo de la tabla 'ip_pool_state'.
+    Guarda una instantánea del bitmap de direcciones asignadas por cada nodo y rango,
+    tomada al recorrer 'users'. Al arrancar se usa en lugar de recorrerla otra vez si
+    sigue vigente; la fuente de verdad sigue siendo 'users.wg_ip_address'.
+    """
+    __tablename__ = "ip_pool_state"
+
+    id = Column(Integer, primary_key=True, index=True)
+    node = Column(String, nullable=True)
+    cidr = Column(String, index=True)
+    bitmap = Column(LargeBinary)
+    allocated = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow) # Momento en que se empezó a leer 'users'
+
+    __table_args__ = (
+        UniqueConstraint("node", "cidr", name="uq_ip_pool_state_node_cidr"),
+    )
+
+
+class UsageRollup(Base):
+    """
+    Modelo de la tabla 'usage_rollups'.
+    Resumen de uso (sesiones, bytes y segundos) por usuario o por servidor,
+    agrupado por hora, día o mes. Se alimenta de 'connection_logs'.
+    """
+    __tablename__ = "usage_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String, nullable=False)  # "user" o "server"
+    scope_id = Column(String, nullable=False)  # id del usuario o nombre de la interfaz
+    granularity = Column(String, nullable=False)  # "hour", "day" o "month"
+    bucket_start = Column(DateTime, nullable=False)
+    sessions = Column(Integer, default=0)
+    rx_bytes = Column(BigInteger, default=0)
+    tx_bytes = Column(BigInteger, default=0)
+    seconds = Column(BigInteger, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("scope", "scope_id", "granularity", "bucket_start", name="uq_usage_rollups_bucket"),
+    )
+
@@ -1,21 +1,229 @@
-from fastapi import FastAPI
-import uvicorn
-from .api.routes import router
-from .db.database import create_db_tables
-from .services.firebase_service import initialize_firebase
+# Primero: marca el inicio del arranque para medir cuánto tarda el worker en estar listo.
+from .core.startup import readiness, ReadinessMiddleware
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
 from .core.config import settings
+from .core import metrics
 
-# Crea la instancia principal de la aplicación FastAPI.
-app = FastAPI(title="VPN Project Backend")
+# Las rutas y los servicios (cryptography, SQLAlchemy, nodos de WireGuard, Firebase...)
+# se importan en el calentamiento, no al importar este módulo: así el worker responde
+# a /healthz en cuanto arranca.
 
-# Inicializa la base de datos al iniciar la aplicación.
-create_db_tables()
+# Segundos que se espera a que termine el calentamiento al apagar el worker.
+WARM_UP_SHUTDOWN_TIMEOUT = 10
 
-# Inicializa la conexión con Firebase.
-initialize_firebase()
 
-# Incluye las rutas de la API.
-app.include_router(router)
+def load_application():
+    """
+    Importa las rutas y, con ellas, los servicios. Retorna el router de la API.
+    """
+    from .api.routes import router
+    return router
+
+
+def load_nodes() -> int:
+    """
+    Crea las tablas que falten y carga los nodos de WireGuard, reconstruyendo sus
+    asignadores de IPs a partir de los usuarios existentes. Falla si el esquema de
+    una base de datos anterior no está migrado.
+    """
+    from .db.database import create_db_tables, engine, SessionLocal
+    from .db.migrations import pending_migrations
+    from .services.vpn_service import node_registry
+
+    create_db_tables()
+    pending = pending_migrations(engine)
+    if pending:
+        names = ", ".join(migration.name for migration in pending)
+        raise RuntimeError(f"Migraciones pendientes ({names}): ejecuta 'python -m app.db.migrations'.")
+    with SessionLocal() as db:
+        return node_registry.load(db)
+
+
+def load_peer_state() -> bool:
+    """
+    Lee los peers actuales de cada nodo ('wg show <interfaz> dump') y aplica la diferencia con la base de datos.
+    """
+    from .services.vpn_service import node_registry
+
+    results = node_registry.sync_peers()
+    return all("error" not in result for result in results.values())
+
+
+async def warm_up():
+    """
+    Calentamiento del worker. Primero se importan las rutas y los servicios y, después,
+    las tareas independientes se ejecutan en paralelo:
+        - base de datos (tablas y nodos) y, después, el estado de los peers de cada nodo,
+        - conexiones del pool asíncrono de la base de datos,
+        - Firebase (credenciales) y, después, sus certificados de firma,
+        - pool de claves de WireGuard y procesos de hashing,
+        - cifrador de las claves privadas guardadas.
+    """
+    readiness.add("application")
+    readiness.add("database")
+    readiness.add("peer_state", required=False)
+    readiness.add("database_pool", required=False)
+    readiness.add("firebase")
+    readiness.add("firebase_certs", required=False)
+    readiness.add("key_pool", required=False)
+    readiness.add("hashing_pool", required=False)
+    readiness.add("encryption")
+
+    router = await readiness.run("application", load_application)
+    if readiness.status("application") != "ok":
+        for name in ("database", "peer_state", "database_pool", "firebase", "firebase_certs", "key_pool", "hashing_pool", "encryption"):
+            readiness.skip(name)
+        return
+    # Hasta estar listo, ReadinessMiddleware responde 503 en estas rutas.
+    app.include_router(router)
+    register_metrics()
+
+    from .core.security import get_cipher, hashing_pool
+    from .db.database import warm_up_pool
+    from .services.firebase_service import initialize_firebase, start_cert_refresher
+    from .services.vpn_service import key_pool, node_registry
+
+    async def database_and_peers():
+        await readiness.run("database", load_nodes)
+        if readiness.status("database") != "ok":
+            readiness.skip("peer_state")
+            return
+        await readiness.run("peer_state", load_peer_state, required=False)
+        node_registry.start()
+
+    async def firebase():
+        await readiness.run("firebase", initialize_firebase)
+        if readiness.status("firebase") != "ok":
+            readiness.skip("firebase_certs")
+            return
+        await readiness.run("firebase_certs", start_cert_refresher, required=False)
+
+    await asyncio.gather(
+        database_and_peers(),
+        readiness.run("database_pool", warm_up_pool, settings.DB_WARM_CONNECTIONS, required=False, blocking=False),
+        firebase(),
+        readiness.run("key_pool", key_pool.start, required=False),
+        readiness.run("hashing_pool", hashing_pool.warm_up, required=False),
+        readiness.run("encryption", get_cipher),
+    )
+
+
+def stop_services():
+    """Detiene los hilos y procesos que arrancó el calentamiento."""
+    from .core.security import hashing_pool
+    from .services.firebase_service import stop_cert_refresher
+    from .services.vpn_service import key_pool, node_registry
+
+    key_pool.stop()
+    node_registry.stop()
+    stop_cert_refresher()
+    hashing_pool.stop()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    El calentamiento se lanza en segundo plano: el worker acepta conexiones en el
+    momento, /healthz responde y /readyz indica cuándo puede recibir tráfico.
+    Hasta entonces, el resto de rutas responden 503.
+    """
+    # Aquí ya terminó de importarse todo lo que carga uvicorn antes de arrancar el worker.
+    readiness.imported()
+    warm_up_task = asyncio.create_task(warm_up())
+    yield
+    # Si el calentamiento sigue en marcha (ej. base de datos colgada), no se espera indefinidamente.
+    done, _ = await asyncio.wait({warm_up_task}, timeout=WARM_UP_SHUTDOWN_TIMEOUT)
+    if not done:
+        warm_up_task.cancel()
+    # Si las rutas no llegaron a importarse, no se arrancó ningún servicio.
+    if readiness.status("application") == "ok":
+        stop_services()
+
+
+# Crea la instancia principal de la aplicación FastAPI. Las rutas de la API se añaden en el calentamiento.
+app = FastAPI(title="VPN Project Backend", lifespan=lifespan)
+
+# Rechaza las peticiones con 503 hasta que el calentamiento termine.
+app.add_middleware(ReadinessMiddleware, readiness=readiness)
+
+if settings.METRICS_ENABLED:
+    # Peticiones en curso y duración por ruta (y, bajo demanda, la cabecera Server-Timing).
+    app.add_middleware(metrics.MetricsMiddleware, timing_header=settings.METRICS_TIMING_HEADER)
+
+
+def register_metrics():
+    """Métricas que se leen de los componentes en el momento de exportarlas (una vez importados)."""
+    from .core.security import hashing_pool
+    from .services.admission import user_operations, user_limiter, global_limiter
+    from .services.firebase_service import token_cache
+    from .services.vpn_service import key_pool, node_registry, config_cache
+
+    metrics.registry.callback(
+        "vpn_key_pool_available", "Pares de claves pre-generados listos.", "gauge", (),
+        lambda: [((), key_pool.stats()["available"])]
+    )
+    metrics.registry.callback(
+        "vpn_key_pool_misses_total", "Pares de claves generados en el momento por tener el pool vacío.", "counter", (),
+        lambda: [((), key_pool.stats()["misses"])]
+    )
+    metrics.registry.callback(
+        "vpn_hashing_pending", "Hashes de contraseña en cola o en ejecución.", "gauge", (),
+        lambda: [((), hashing_pool.pending)]
+    )
+    metrics.registry.callback(
+        "vpn_hashing_rejected_total", "Hashes de contraseña rechazados por tener la cola llena.", "counter", (),
+        lambda: [((), hashing_pool.rejected)]
+    )
+    metrics.registry.callback(
+        "vpn_cache_hits_total", "Aciertos de las cachés de tokens y de configuraciones.", "counter", ("cache",),
+        lambda: [(("config",), config_cache.hits)] + ([(("token",), token_cache.hits)] if token_cache else [])
+    )
+    metrics.registry.callback(
+        "vpn_cache_misses_total", "Fallos de las cachés de tokens y de configuraciones.", "counter", ("cache",),
+        lambda: [(("config",), config_cache.misses)] + ([(("token",), token_cache.misses)] if token_cache else [])
+    )
+    metrics.registry.callback(
+        "vpn_node_peers", "Peers con IP asignada en cada nodo de WireGuard.", "gauge", ("node", "status"),
+        lambda: [((node.name, node.status), node.peers) for node in node_registry.nodes()]
+    )
+    metrics.registry.callback(
+        "vpn_node_healthy", "1 si el nodo de WireGuard responde, 0 si está fuera del reparto por no responder.", "gauge", ("node",),
+        lambda: [((node.name,), 1 if node.healthy else 0) for node in node_registry.nodes()]
+    )
+    metrics.registry.callback(
+        "vpn_node_open_sessions", "Sesiones abiertas en cada nodo según la última lectura de telemetría.", "gauge", ("node",),
+        lambda: [((node.name,), node.collector.latest().get("open_sessions")) for node in node_registry.nodes()]
+    )
+    metrics.registry.callback(
+        "vpn_rate_limited_total", "Peticiones de connect/disconnect rechazadas por el límite de tasa.", "counter", ("scope",),
+        lambda: [(("user",), user_limiter.rejected), (("global",), global_limiter.rejected)]
+    )
+    metrics.registry.callback(
+        "vpn_user_operations_in_flight", "Usuarios con un connect o disconnect en curso en este worker.", "gauge", (),
+        lambda: [((), user_operations.in_flight())]
+    )
+    metrics.registry.callback(
+        "vpn_user_operations_coalesced_total",
+        "Peticiones que compartieron la operación en curso del mismo usuario o esperaron a que terminara.", "counter", ("mode",),
+        lambda: [
+            (("shared",), user_operations.coalesced),
+            (("serialized",), user_operations.serialized),
+            (("lock_wait",), user_operations.lock_waits),
+        ]
+    )
+
+
+metrics.registry.callback(
+    "vpn_startup_seconds", "Duración de cada fase del arranque del worker (import, tareas de calentamiento y total hasta estar listo).",
+    "gauge", ("phase",), readiness.timings
+)
+metrics.registry.callback(
+    "vpn_ready", "1 si el worker terminó el calentamiento y puede recibir tráfico.", "gauge", (),
+    lambda: [((), int(readiness.ready))]
+)
 
 
 @app.get("/")
@@ -23,5 +231,34 @@ def read_root():
     return {"message": "Welcome to the VPN Backend API"}
 
 
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def read_metrics():
+        """
+        Métricas en formato de texto de Prometheus.
+        """
+        return Response(content=metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """
+    Sonda de vida: el proceso atiende peticiones. No comprueba dependencias.
+    """
+    return {"status": "ok"}
+
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    """
+    Sonda de disponibilidad: 200 cuando el calentamiento terminó bien, 503 mientras
+    tanto o si falló alguna tarea obligatoria. Incluye la duración de cada tarea.
+    """
+    return JSONResponse(readiness.snapshot(), status_code=200 if readiness.ready else 503)
+
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    import uvicorn
+
+    # Sin recarga automática: para desarrollo, 'uvicorn app.main:app --reload'.
+    uvicorn.run(app, host="0.0.0.0", port=8000)
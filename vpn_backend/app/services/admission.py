@@ -0,0 +1,302 @@
+import asyncio
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from ..core.config import settings
+from ..core.local_store import LocalStore, local_store
+
+LIMITER_NAMESPACE = "rate_limit"
+LOCK_NAMESPACE = "user_lock"
+# Reintentos de la actualización atómica del bucket compartido cuando otro worker se adelanta.
+MAX_CAS_ATTEMPTS = 5
+# Espera máxima (segundos) entre intentos de tomar el cerrojo de un usuario que tiene otro worker.
+MAX_LOCK_POLL_INTERVAL = 0.5
+
+
+class RateLimited(Exception):
+    """La petición supera el límite de tasa; 'retry_after' son los segundos hasta el próximo token."""
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded ({scope}).")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class OperationBusy(Exception):
+    """Otra operación del mismo usuario sigue en curso en otro worker después de esperar el máximo."""
+
+
+class TokenBucketLimiter:
+    """
+    Limitador token bucket por clave (usuario o global): admite ráfagas de hasta
+    'burst' peticiones y recupera 'rate' tokens por segundo.
+
+    Con un LocalStore, el estado de cada bucket ("tokens:instante") se comparte entre
+    los workers de la máquina y se actualiza con compare-and-set; las claves caducan
+    cuando el bucket ya estaría lleno, así que los usuarios inactivos no ocupan sitio.
+    'rate' 0 desactiva el límite. Desde el bucle de eventos se usan 'acquire_async' y
+    'refund_async', que leen el almacén en un hilo.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, store: Optional[LocalStore] = None, max_keys: int = 100000):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.store = store
+        self.max_keys = max(max_keys, 1)
+        self._buckets = OrderedDict()  # clave -> (tokens, instante)
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+
+    def _refill(self, state: Optional[Tuple[float, float]], now: float) -> float:
+        if state is None:
+            return self.burst
+        tokens, updated = state
+        return min(self.burst, tokens + max(now - updated, 0.0) * self.rate)
+
+    def _take_local(self, key: str, cost: float, now: float) -> float:
+        with self._lock:
+            tokens = self._refill(self._buckets.get(key), now)
+            if tokens < cost:
+                return (cost - tokens) / self.rate
+            self._buckets[key] = (min(self.burst, tokens - cost), now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return 0.0
+
+    def _take_shared(self, key: str, cost: float, now: float) -> float:
+        store_key = f"{self.name}:{key}"
+        for _ in range(MAX_CAS_ATTEMPTS):
+            raw = self.store.get(LIMITER_NAMESPACE, store_key)
+            state = tuple(map(float, raw.split(":"))) if raw else None
+            tokens = self._refill(state, now)
+            if tokens < cost:
+                return (cost - tokens) / self.rate
+            remaining = min(self.burst, tokens - cost)
+            expires_at = now + (self.burst - remaining) / self.rate
+            if self.store.compare_and_set(LIMITER_NAMESPACE, store_key, raw, f"{remaining!r}:{now!r}", expires_at):
+                return 0.0
+        # Mucha contención en el mismo bucket: se trata como lleno.
+        return 1 / self.rate
+
+    def acquire(self, key: str, cost: float = 1.0) -> float:
+        """Consume 'cost' tokens del bucket de 'key'. Retorna 0 si se admite o los segundos que faltan si no."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.time()
+        wait = None
+        if self.store:
+            try:
+                wait = self._take_shared(key, cost, now)
+            except Exception as e:
+                # Sin almacén compartido se sigue limitando, aunque solo en este worker.
+                print(f"Error al leer el límite de tasa compartido: {e}")
+        if wait is None:
+            wait = self._take_local(key, cost, now)
+        with self._lock:
+            if wait:
+                self.rejected += 1
+            else:
+                self.admitted += 1
+        return wait
+
+    def refund(self, key: str, cost: float = 1.0):
+        """Devuelve 'cost' tokens al bucket de 'key', ej. si otro límite rechazó la petición que los consumió."""
+        if self.rate <= 0:
+            return
+        now = time.time()
+        refunded = False
+        if self.store:
+            try:
+                self._take_shared(key, -cost, now)
+                refunded = True
+            except Exception as e:
+                print(f"Error al devolver tokens al límite de tasa compartido: {e}")
+        if not refunded:
+            self._take_local(key, -cost, now)
+        with self._lock:
+            self.admitted -= 1
+
+    async def acquire_async(self, key: str, cost: float = 1.0) -> float:
+        if self.store and self.rate > 0:
+            return await asyncio.to_thread(self.acquire, key, cost)
+        return self.acquire(key, cost)
+
+    async def refund_async(self, key: str, cost: float = 1.0):
+        if self.store and self.rate > 0:
+            await asyncio.to_thread(self.refund, key, cost)
+        else:
+            self.refund(key, cost)
+
+
+class UserOperations:
+    """
+    Coalescencia ("single-flight") de las operaciones de cada usuario.
+
+    Solo hay una operación en curso por usuario: las peticiones idénticas que llegan
+    mientras tanto (ej. varios /vpn/connect seguidos) esperan a la primera y comparten
+    su resultado, y una operación distinta (connect después de disconnect, o al revés)
+    espera a que termine la anterior y se ejecuta después, nunca a la vez.
+
+    Dentro del worker se coordina con futures del bucle de eventos. Con un LocalStore,
+    la operación además toma un cerrojo por usuario en el almacén, así que otro worker
+    espera a que termine y la repite sobre el estado ya guardado (que no vuelve a
+    generar claves ni a tocar WireGuard). El cerrojo caduca a los 'lock_timeout'
+    segundos por si el worker que lo tenía muere; mientras la operación sigue en
+    curso se renueva cada 'lock_timeout / 3' segundos. Las llamadas al almacén se
+    hacen en un hilo para no bloquear el bucle si otro worker tiene la escritura, y
+    mientras se espera el cerrojo la espera entre intentos se duplica hasta
+    MAX_LOCK_POLL_INTERVAL.
+    """
+
+    def __init__(self, store: Optional[LocalStore] = None, lock_timeout: float = 30.0, poll_interval: float = 0.02):
+        self.store = store
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self.coalesced = 0
+        self.serialized = 0
+        self.lock_waits = 0
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    def busy(self) -> Set[str]:
+        """Usuarios con una operación en curso en este worker y, con LocalStore, en los demás."""
+        users = set(self._inflight)
+        if self.store:
+            try:
+                users.update(self.store.keys(LOCK_NAMESPACE))
+            except Exception as e:
+                print(f"Error al leer los cerrojos compartidos de usuario: {e}")
+        return users
+
+    async def _acquire_lock(self, key: str) -> Optional[str]:
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_timeout
+        delay = self.poll_interval
+        waited = False
+        while True:
+            try:
+                if await asyncio.to_thread(self.store.add, LOCK_NAMESPACE, key, owner, time.time() + self.lock_timeout):
+                    return owner
+            except Exception as e:
+                # Sin almacén compartido solo se coordina dentro del worker.
+                print(f"Error al tomar el cerrojo compartido del usuario: {e}")
+                return None
+            if not waited:
+                waited = True
+                self.lock_waits += 1
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise OperationBusy(key)
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, MAX_LOCK_POLL_INTERVAL)
+
+    async def _renew_lock(self, key: str, owner: str):
+        while True:
+            await asyncio.sleep(self.lock_timeout / 3)
+            try:
+                renewed = await asyncio.to_thread(
+                    self.store.compare_and_set, LOCK_NAMESPACE, key, owner, owner, time.time() + self.lock_timeout
+                )
+            except Exception as e:
+                print(f"Error al renovar el cerrojo compartido del usuario: {e}")
+                continue
+            if not renewed:
+                print(f"El cerrojo compartido del usuario {key} caducó antes de terminar la operación.")
+                return
+
+    async def _release_lock(self, key: str, owner: Optional[str]):
+        if owner is None:
+            return
+        try:
+            # Protegido: aunque se cancele la petición, el cerrojo se libera.
+            await asyncio.shield(asyncio.to_thread(self.store.delete, LOCK_NAMESPACE, key, owner))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error al liberar el cerrojo compartido del usuario: {e}")
+
+    async def run(self, key: str, operation: str, func: Callable[[], Awaitable]):
+        """Ejecuta 'func' como la operación 'operation' del usuario 'key', o comparte la que ya está en curso."""
+        while True:
+            entry = self._inflight.get(key)
+            if entry is None:
+                break
+            current, future = entry
+            if current != operation:
+                # Operación distinta: se espera a que termine (con el resultado que sea) y se vuelve a mirar.
+                self.serialized += 1
+                await asyncio.wait([future])
+                continue
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # Se canceló la petición que la ejecutaba (no esta): se vuelve a intentar.
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (operation, future)
+        try:
+            owner = await self._acquire_lock(key) if self.store else None
+            renewal = asyncio.create_task(self._renew_lock(key, owner)) if owner else None
+            try:
+                result = await func()
+            finally:
+                if renewal:
+                    renewal.cancel()
+                await self._release_lock(key, owner)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Marca la excepción como leída aunque no haya nadie esperando.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._inflight.get(key, (None, None))[1] is future:
+                del self._inflight[key]
+
+
+async def admit(username: str):
+    """
+    Control de admisión antes de ejecutar 'wg': consume un token del usuario y otro
+    del global. Lanza RateLimited si alguno está vacío; si el rechazo es del global,
+    el token del usuario se devuelve.
+    """
+    wait = await user_limiter.acquire_async(username)
+    if wait:
+        raise RateLimited("user", wait)
+    wait = await global_limiter.acquire_async("all")
+    if wait:
+        await user_limiter.refund_async(username)
+        raise RateLimited("global", wait)
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(math.ceil(seconds), 1))
+
+
+_shared_store = local_store if settings.ADMISSION_SHARED else None
+
+# Operaciones de /vpn/connect y /vpn/disconnect en curso, por usuario.
+user_operations = UserOperations(_shared_store, settings.USER_LOCK_TIMEOUT)
+user_limiter = TokenBucketLimiter(
+    "user", settings.RATE_LIMIT_USER_PER_SECOND, settings.RATE_LIMIT_USER_BURST, _shared_store
+)
+global_limiter = TokenBucketLimiter(
+    "global", settings.RATE_LIMIT_GLOBAL_PER_SECOND, settings.RATE_LIMIT_GLOBAL_BURST, _shared_store
+)
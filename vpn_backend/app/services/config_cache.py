@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Container, Iterable, Optional
+
+from ..core.local_store import LocalStore
+
+STORE_NAMESPACE = "config_invalidated"
+
+
+def server_config_version(*fields) -> str:
+    """Versión corta de la configuración del servidor (clave, endpoint, puerto, DNS...)."""
+    return hashlib.sha256("\x00".join(str(field) for field in fields).encode()).hexdigest()[:16]
+
+
+def render_qr_png(text: str) -> bytes:
+    """
+    Genera un PNG con el código QR del texto.
+    Requiere el paquete opcional 'qrcode' (con Pillow); lanza ImportError si no está instalado.
+    """
+    import qrcode
+
+    buffer = io.BytesIO()
+    qrcode.make(text).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class ConfigArtifact:
+    """
+    Configuración .conf ya generada de un usuario, con su ETag y (si se pidió) su QR.
+    'created_at' es el momento en que se leyeron los datos del usuario con los que se generó.
+    """
+
+    __slots__ = ("version", "body", "etag", "created_at", "_qr", "_qr_lock")
+
+    def __init__(self, version: str, body: str, created_at: Optional[float] = None):
+        self.version = version
+        self.body = body
+        self.etag = '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+        self.created_at = time.time() if created_at is None else created_at
+        self._qr = None
+        self._qr_lock = threading.Lock()
+
+    @property
+    def qr_etag(self) -> str:
+        return self.etag[:-1] + '-qr"'
+
+    def qr_png(self, renderer: Callable[[str], bytes] = render_qr_png) -> bytes:
+        """El QR se genera solo la primera vez que se pide y se guarda junto a la configuración."""
+        with self._qr_lock:
+            if self._qr is None:
+                self._qr = renderer(self.body)
+            return self._qr
+
+
+class ConfigCache:
+    """
+    Caché LRU de configuraciones de cliente ya generadas.
+
+    Cada entrada pertenece a un usuario y a una versión de la configuración de
+    su nodo: si esa versión deja de estar vigente, la entrada deja de valer. Se
+    invalida al cambiar las claves, la IP o el nodo del usuario, y las entradas
+    caducan tras 'ttl' segundos. Con un LocalStore, las invalidaciones llegan también a los demás
+    workers de la máquina; desde el bucle de eventos se usan 'get_async' e 'invalidate_async',
+    que consultan el almacén en un hilo.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, store: Optional[LocalStore] = None):
+        self.max_entries = max(max_entries, 1)
+        self.ttl = ttl
+        self.store = store
+        self._entries = OrderedDict()  # usuario -> ConfigArtifact
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _invalidated_after(self, username: str, created_at: float) -> bool:
+        if not self.store:
+            return False
+        try:
+            value = self.store.get(STORE_NAMESPACE, username)
+        except Exception as e:
+            print(f"Error al leer las invalidaciones de configuraciones: {e}")
+            return False
+        return value is not None and float(value) >= created_at
+
+    def _lookup(self, username: str, versions: Container[str]) -> Optional[ConfigArtifact]:
+        """Entrada local del usuario, si sigue vigente (sin consultar el almacén)."""
+        now = time.time()
+        with self._lock:
+            artifact = self._entries.get(username)
+            if artifact and (artifact.version not in versions or artifact.created_at + self.ttl <= now):
+                del self._entries[username]
+                artifact = None
+            if artifact:
+                self._entries.move_to_end(username)
+        return artifact
+
+    def _discard(self, username: str, artifact: ConfigArtifact):
+        with self._lock:
+            if self._entries.get(username) is artifact:
+                del self._entries[username]
+
+    def _count(self, artifact: Optional[ConfigArtifact]) -> Optional[ConfigArtifact]:
+        with self._lock:
+            if artifact:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return artifact
+
+    def get(self, username: str, versions: Container[str]) -> Optional[ConfigArtifact]:
+        """Retorna la configuración en caché del usuario, o None si no está, caducó o su versión ya no está en 'versions'."""
+        artifact = self._lookup(username, versions)
+        if artifact and self._invalidated_after(username, artifact.created_at):
+            self._discard(username, artifact)
+            artifact = None
+        return self._count(artifact)
+
+    async def get_async(self, username: str, versions: Container[str]) -> Optional[ConfigArtifact]:
+        """Igual que 'get'; la consulta al almacén (solo si hay entrada local) se hace en un hilo."""
+        artifact = self._lookup(username, versions)
+        if artifact and self.store and await asyncio.to_thread(self._invalidated_after, username, artifact.created_at):
+            self._discard(username, artifact)
+            artifact = None
+        return self._count(artifact)
+
+    def put(self, username: str, version: str, body: str, read_at: Optional[float] = None) -> ConfigArtifact:
+        """
+        Guarda la configuración recién generada y la retorna. 'read_at' es el momento en que
+        se leyó el estado del usuario: una invalidación publicada después de leerlo descarta
+        la entrada aunque llegue antes de guardarla.
+        """
+        artifact = ConfigArtifact(version, body, read_at)
+        with self._lock:
+            self._entries[username] = artifact
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return artifact
+
+    def invalidate(self, usernames: Iterable[str]):
+        """Descarta las configuraciones de los usuarios (en este worker y, con LocalStore, en los demás)."""
+        usernames = list(usernames)
+        with self._lock:
+            for username in usernames:
+                self._entries.pop(username, None)
+        if self.store:
+            now = time.time()
+            try:
+                for username in usernames:
+                    self.store.set(STORE_NAMESPACE, username, repr(now), now + self.ttl)
+            except Exception as e:
+                print(f"Error al publicar las invalidaciones de configuraciones: {e}")
+
+    async def invalidate_async(self, usernames: Iterable[str]):
+        """Igual que 'invalidate'; la escritura en el almacén se hace en un hilo."""
+        if self.store:
+            await asyncio.to_thread(self.invalidate, list(usernames))
+        else:
+            self.invalidate(usernames)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            }
@@ -1,27 +1,128 @@
-import firebase_admin
-from firebase_admin import credentials, auth
+import asyncio
+import threading
 from ..core.config import settings
-from firebase_admin.exceptions import FirebaseError
+from ..core.local_store import local_store
+from ..core.metrics import AUTH_FAILURES, stage
+from .token_cache import TokenCache
+
+# 'firebase_admin' (y las librerías de Google que arrastra) se importa al inicializar
+# Firebase, en el calentamiento del worker, y no al importar la aplicación.
+
+# Caché de tokens verificados. Es None si está desactivada.
+token_cache = TokenCache(
+    settings.TOKEN_CACHE_SIZE,
+    store=local_store if settings.TOKEN_CACHE_SHARED else None
+) if settings.TOKEN_CACHE_ENABLED else None
+
+_cert_refresher_stop = threading.Event()
+_cert_refresher_thread = None
 
 
 def initialize_firebase():
     """
     Inicializa la aplicación de Firebase si no ha sido inicializada.
     """
+    import firebase_admin
+    from firebase_admin import credentials
+
     if not firebase_admin._apps:
         cred = credentials.Certificate(settings.FIREBASE_SERVICE_ACCOUNT_PATH)
         firebase_admin.initialize_app(cred)
 
 
+def prefetch_signing_certs() -> bool:
+    """
+    Descarga los certificados de firma de Google a través del mismo cliente HTTP
+    (con caché) que usa 'auth.verify_id_token', para que ninguna petición tenga que esperarlos.
+
+    'firebase_admin' no expone ese cliente: se usa su API interna, por eso la versión
+    está fijada en requirements.txt. Si cambia, solo se pierde la precarga (retorna False).
+    """
+    try:
+        from firebase_admin import auth
+
+        verifier = auth._get_client(None)._token_verifier
+        # 'no-cache' fuerza la descarga, pero la respuesta vuelve a quedar en la caché.
+        verifier.request(
+            url=verifier.id_token_verifier.cert_url,
+            method="GET",
+            headers={"Cache-Control": "no-cache"}
+        )
+        return True
+    except Exception as e:
+        print(f"Error al descargar los certificados de Firebase: {e}")
+        return False
+
+
+def _refresh_certs_loop():
+    while not _cert_refresher_stop.wait(settings.FIREBASE_CERT_REFRESH_INTERVAL):
+        prefetch_signing_certs()
+
+
+def start_cert_refresher() -> bool:
+    """
+    Descarga los certificados y arranca el hilo que los renueva periódicamente.
+    Retorna si la primera descarga funcionó.
+    """
+    global _cert_refresher_thread
+    if _cert_refresher_thread and _cert_refresher_thread.is_alive():
+        return True
+    fetched = prefetch_signing_certs()
+    _cert_refresher_stop.clear()
+    _cert_refresher_thread = threading.Thread(target=_refresh_certs_loop, name="firebase-certs", daemon=True)
+    _cert_refresher_thread.start()
+    return fetched
+
+
+def stop_cert_refresher():
+    global _cert_refresher_thread
+    _cert_refresher_stop.set()
+    if _cert_refresher_thread:
+        _cert_refresher_thread.join(timeout=5)
+        _cert_refresher_thread = None
+
+
 def verify_token(id_token: str) -> dict:
     """
     Verifica el token de autenticación de Firebase.
     Retorna los datos del usuario si el token es válido.
+    Los tokens ya verificados se sirven desde la caché hasta su expiración.
     """
+    if token_cache:
+        cached = token_cache.get(id_token)
+        if cached:
+            return cached
+    return _verify_with_firebase(id_token)
+
+
+def _verify_with_firebase(id_token: str) -> dict:
+    from firebase_admin import auth
+    from firebase_admin.exceptions import FirebaseError
+
     try:
-        decoded_token = auth.verify_id_token(id_token)
-        return decoded_token
+        with stage("firebase_verify"):
+            decoded_token = auth.verify_id_token(id_token)
     except FirebaseError as e:
         # Aquí puedes manejar diferentes tipos de errores (token expirado, inválido, etc.)
+        AUTH_FAILURES.inc(type(e).__name__)
         print(f"Firebase token verification failed: {e}")
         return None
+
+    if token_cache:
+        token_cache.put(id_token, decoded_token)
+    return decoded_token
+
+
+async def verify_token_async(id_token: str) -> dict:
+    """
+    Versión asíncrona de 'verify_token'.
+    Un acierto en la memoria del worker se resuelve en el momento; si no, la consulta
+    al almacén compartido y la verificación se ejecutan en un hilo para no bloquear
+    el bucle de eventos.
+    """
+    if token_cache:
+        cached = token_cache.get_local(id_token)
+        if cached:
+            return cached
+    # 'to_thread' conserva el contexto, así el tiempo de la verificación llega a la cabecera de tiempos.
+    return await asyncio.to_thread(verify_token, id_token)
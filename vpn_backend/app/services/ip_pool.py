@@ -0,0 +1,295 @@
+import asyncio
+import ipaddress
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..core.local_store import LocalStore
+from ..db.models import User, IPPoolState
+
+# Número de filas que se leen por bloque al reconstruir el bitmap.
+REBUILD_CHUNK_SIZE = 5000
+# Margen (segundos) para las altas con una hora algo anterior a la instantánea que se
+# guardaron después de tomarla (o en otra máquina con el reloj desviado).
+SNAPSHOT_CLOCK_MARGIN = 60
+CLAIM_NAMESPACE = "ip_claim"
+# Segundos que dura la reclama de una IP: basta para guardarla en la base de datos,
+# que a partir de ahí la protege con su restricción única.
+IP_CLAIM_TTL = 60
+
+
+class IPPool:
+    """
+    Asignador de direcciones IP para los clientes de WireGuard.
+
+    Mantiene en memoria un bitmap (un bit por dirección del rango) más una pila
+    de direcciones liberadas, de modo que asignar y liberar son O(1) amortizado
+    independientemente del número de usuarios. Si se indica 'node', solo
+    cuenta las direcciones de los usuarios de ese nodo.
+
+    Cada worker tiene su propio bitmap, que no ve las IPs que asignan los demás.
+    Con un LocalStore, cada IP asignada se reclama en el almacén durante
+    IP_CLAIM_TTL segundos, así dos workers de la máquina no reparten la misma a la
+    vez; 'resync' pone el bitmap al día con 'users'. Desde el bucle de eventos se
+    usan 'allocate_async' y 'release_async', que acceden al almacén en un hilo.
+    """
+
+    def __init__(self, cidr: str, node: Optional[str] = None, store: Optional[LocalStore] = None):
+        self.node = node
+        self.store = store
+        self.network = ipaddress.ip_network(cidr, strict=False)
+        if self.network.num_addresses < 4:
+            raise ValueError(f"El rango {cidr} es demasiado pequeño para asignar clientes.")
+
+        self._base = int(self.network.network_address)
+        self._size = self.network.num_addresses
+        self._bitmap = bytearray((self._size + 7) // 8)
+        self._free = []  # Offsets liberados recientemente, se reutilizan primero.
+        self._cursor = 0  # Byte desde el que continúa la búsqueda secuencial.
+        self._allocated = 0
+        self._lock = threading.Lock()
+        self._reserve_fixed()
+
+    def _reserve_fixed(self):
+        # Dirección de red, la del servidor (primera útil) y broadcast.
+        for offset in (0, 1, self._size - 1):
+            self._set(offset)
+        # Bits de relleno del último byte, que no corresponden a ninguna IP.
+        for offset in range(self._size, len(self._bitmap) * 8):
+            self._set(offset)
+
+    @property
+    def capacity(self) -> int:
+        return self._size - 3
+
+    @property
+    def allocated(self) -> int:
+        return self._allocated
+
+    def _is_set(self, offset: int) -> bool:
+        return bool(self._bitmap[offset >> 3] & (1 << (offset & 7)))
+
+    def _set(self, offset: int):
+        self._bitmap[offset >> 3] |= 1 << (offset & 7)
+
+    def _clear(self, offset: int):
+        self._bitmap[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+
+    def _offset(self, ip: str) -> Optional[int]:
+        try:
+            offset = int(ipaddress.ip_address(ip)) - self._base
+        except ValueError:
+            return None
+        if offset <= 1 or offset >= self._size - 1:
+            return None
+        return offset
+
+    def _scan(self) -> Optional[int]:
+        """Busca el primer bit libre a partir del cursor, dando una vuelta como máximo."""
+        total = len(self._bitmap)
+        for start, stop in ((self._cursor, total), (0, self._cursor)):
+            for index in range(start, stop):
+                byte = self._bitmap[index]
+                if byte != 0xFF:
+                    self._cursor = index
+                    # Posición del bit a cero menos significativo.
+                    return (index << 3) + ((~byte & (byte + 1)).bit_length() - 1)
+        return None
+
+    def _claim(self, ip: str) -> bool:
+        if not self.store:
+            return True
+        try:
+            return self.store.add(CLAIM_NAMESPACE, f"{self.node}:{ip}", "1", time.time() + IP_CLAIM_TTL)
+        except Exception as e:
+            # Sin almacén compartido, la restricción única de la base de datos resuelve los choques.
+            print(f"Error al reclamar la IP {ip} en el almacén local: {e}")
+            return True
+
+    def allocate(self) -> Optional[str]:
+        """
+        Reserva y retorna la próxima IP libre, o None si el rango está lleno.
+        Las IPs que ya reclamó otro worker quedan marcadas como usadas y se prueba la siguiente.
+        """
+        while True:
+            ip = self._allocate_local()
+            if ip is None or self._claim(ip):
+                return ip
+
+    async def allocate_async(self) -> Optional[str]:
+        """Igual que 'allocate'; con LocalStore, las reclamas se hacen en un hilo."""
+        if not self.store:
+            return self.allocate()
+        return await asyncio.to_thread(self.allocate)
+
+    def _allocate_local(self) -> Optional[str]:
+        with self._lock:
+            offset = None
+            while self._free:
+                candidate = self._free.pop()
+                if not self._is_set(candidate):
+                    offset = candidate
+                    break
+            if offset is None:
+                offset = self._scan()
+            if offset is None:
+                return None
+            self._set(offset)
+            self._allocated += 1
+            return str(ipaddress.ip_address(self._base + offset))
+
+    def reserve(self, ip: str) -> bool:
+        """Marca una IP concreta como usada. Retorna False si ya lo estaba o no pertenece al rango."""
+        offset = self._offset(ip)
+        if offset is None:
+            return False
+        with self._lock:
+            if self._is_set(offset):
+                return False
+            self._set(offset)
+            self._allocated += 1
+            return True
+
+    def release(self, ip: str) -> bool:
+        """Devuelve una IP al rango para que pueda reutilizarse."""
+        offset = self._offset(ip)
+        if offset is None:
+            return False
+        with self._lock:
+            if not self._is_set(offset):
+                return False
+            self._clear(offset)
+            self._allocated -= 1
+            self._free.append(offset)
+        if self.store:
+            try:
+                self.store.delete(CLAIM_NAMESPACE, f"{self.node}:{ip}")
+            except Exception as e:
+                print(f"Error al liberar la IP {ip} en el almacén local: {e}")
+        return True
+
+    async def release_async(self, ip: str) -> bool:
+        """Igual que 'release'; con LocalStore, la reclama se borra en un hilo."""
+        if not self.store:
+            return self.release(ip)
+        return await asyncio.to_thread(self.release, ip)
+
+    def reset(self):
+        with self._lock:
+            self._bitmap = bytearray(len(self._bitmap))
+            self._free = []
+            self._cursor = 0
+            self._allocated = 0
+            self._reserve_fixed()
+
+    def rebuild(self, db: Session) -> int:
+        """
+        Reconstruye el bitmap: desde la instantánea de 'ip_pool_state' si sigue
+        vigente o, si no, recorriendo 'users' (y entonces guarda una nueva).
+        Retorna el número de IPs asignadas.
+        """
+        if self.load_snapshot(db):
+            return self._allocated
+        taken_at = datetime.utcnow()
+        self.rescan(db)
+        try:
+            self.persist(db, taken_at)
+        except IntegrityError:
+            # Otro worker guardó la suya a la vez (primer arranque con varios workers).
+            db.rollback()
+        except Exception as e:
+            db.rollback()
+            print(f"Error al guardar la instantánea del rango {self.network}: {e}")
+        return self._allocated
+
+    def rescan(self, db: Session) -> int:
+        """
+        Reconstruye el bitmap a partir de la tabla 'users'.
+        Lee solo la columna de IP en bloques, sin crear objetos del ORM, y cambia el
+        bitmap de una vez al terminar: las asignaciones de mientras tanto que aún no
+        están guardadas siguen reclamadas en el almacén.
+        """
+        fresh = IPPool(str(self.network), node=self.node)
+        stmt = select(User.wg_ip_address).where(User.wg_ip_address.isnot(None))
+        if self.node is not None:
+            stmt = stmt.where(User.wg_node == self.node)
+        stmt = stmt.execution_options(yield_per=REBUILD_CHUNK_SIZE)
+        for ip in db.execute(stmt).scalars():
+            if not fresh.reserve(ip) and fresh._offset(ip) is None:
+                print(f"AVISO: la IP {ip} está fuera del rango {self.network}.")
+        with self._lock:
+            self._bitmap = fresh._bitmap
+            self._free = []
+            self._cursor = 0
+            self._allocated = fresh._allocated
+        return self._allocated
+
+    def resync(self, db: Session) -> bool:
+        """
+        Vuelve a leer 'users' si su número de IPs asignadas no coincide con el del bitmap
+        (otros workers asignaron o liberaron IPs). Retorna si se leyó.
+        """
+        stmt = select(func.count(User.id)).where(User.wg_ip_address.isnot(None))
+        if self.node is not None:
+            stmt = stmt.where(User.wg_node == self.node)
+        if db.execute(stmt).scalar() == self._allocated:
+            return False
+        self.rescan(db)
+        return True
+
+    def load_snapshot(self, db: Session) -> bool:
+        """
+        Carga el bitmap guardado por el último 'rescan' si 'users' no cambió desde entonces.
+
+        Toda asignación de IP fija 'wg_peer_added_at' en el mismo commit, así que
+        basta con comprobar que ningún usuario recibió IP después de la instantánea
+        y que el número de IPs asignadas es el mismo (no se liberó ninguna).
+        Retorna False si no hay instantánea o ya no vale.
+        """
+        state = db.execute(
+            select(IPPoolState.bitmap, IPPoolState.allocated, IPPoolState.updated_at)
+            .where(IPPoolState.node == self.node, IPPoolState.cidr == str(self.network))
+        ).first()
+        if not state or not state.bitmap or len(state.bitmap) != len(self._bitmap) or not state.updated_at:
+            return False
+
+        stmt = select(func.count(User.id), func.max(User.wg_peer_added_at)).where(User.wg_ip_address.isnot(None))
+        if self.node is not None:
+            stmt = stmt.where(User.wg_node == self.node)
+        assigned, last_added = db.execute(stmt).one()
+        if assigned != state.allocated:
+            return False
+        if last_added and last_added >= state.updated_at - timedelta(seconds=SNAPSHOT_CLOCK_MARGIN):
+            return False
+
+        with self._lock:
+            self._bitmap = bytearray(state.bitmap)
+            self._free = []
+            self._cursor = 0
+            self._allocated = state.allocated
+        return True
+
+    def snapshot(self) -> bytes:
+        with self._lock:
+            return bytes(self._bitmap)
+
+    def persist(self, db: Session, taken_at: datetime):
+        """
+        Guarda el bitmap en la tabla 'ip_pool_state' con el momento en que se empezó a
+        leer 'users'. Solo tiene sentido justo después de 'rescan': el bitmap en memoria
+        de un worker no ve las IPs que asignan los demás.
+        """
+        cidr = str(self.network)
+        state = db.query(IPPoolState).filter(IPPoolState.node == self.node, IPPoolState.cidr == cidr).first()
+        if not state:
+            state = IPPoolState(node=self.node, cidr=cidr)
+            db.add(state)
+        state.bitmap = self.snapshot()
+        state.allocated = self._allocated
+        state.updated_at = taken_at
+        db.commit()
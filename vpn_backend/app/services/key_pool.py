@@ -0,0 +1,76 @@
+import queue
+import threading
+from typing import Callable, Tuple
+
+KeyPair = Tuple[str, str]
+
+
+class KeyPairPool:
+    """
+    Pool acotado de pares de claves de WireGuard generados por adelantado.
+
+    Un hilo en segundo plano lo mantiene lleno; 'get' solo saca un par listo
+    de la cola y, si está vacía, genera uno en el momento (un "miss").
+    """
+
+    def __init__(self, factory: Callable[[], KeyPair], size: int):
+        self._factory = factory
+        self._size = max(size, 0)
+        self._queue = queue.Queue(maxsize=self._size or 1)
+        self._refill = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        """Arranca el hilo que rellena el pool. Es seguro llamarlo varias veces."""
+        if self._size == 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="wg-key-pool", daemon=True)
+        self._thread.start()
+        self._refill.set()
+
+    def stop(self):
+        self._stop.set()
+        self._refill.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._refill.wait()
+            self._refill.clear()
+            while not self._stop.is_set() and not self._queue.full():
+                try:
+                    self._queue.put_nowait(self._factory())
+                except queue.Full:
+                    break
+
+    def get(self) -> KeyPair:
+        """Retorna un par (privada, pública) del pool o lo genera si no queda ninguno."""
+        try:
+            pair = self._queue.get_nowait()
+            with self._lock:
+                self.hits += 1
+        except queue.Empty:
+            with self._lock:
+                self.misses += 1
+            pair = self._factory()
+        self._refill.set()
+        return pair
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "size": self._size,
+            "available": self._queue.qsize(),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
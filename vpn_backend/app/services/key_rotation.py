@@ -0,0 +1,170 @@
+import argparse
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from cryptography.fernet import InvalidToken
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.orm import Session
+
+from ..core.security import get_cipher, primary_key_id, rotate_secret
+from ..db.models import KeyRotationProgress, User
+
+users = User.__table__
+progress_table = KeyRotationProgress.__table__
+
+
+def _progress(db: Session, key_id: str) -> Optional[KeyRotationProgress]:
+    return db.execute(select(KeyRotationProgress).where(KeyRotationProgress.key_id == key_id)).scalars().first()
+
+
+def remaining(db: Session, last_user_id: int) -> int:
+    """Claves privadas que quedan por procesar después de 'last_user_id'."""
+    return db.execute(
+        select(func.count()).select_from(users).where(users.c.id > last_user_id, users.c.wg_private_key.isnot(None))
+    ).scalar()
+
+
+def rotate_private_keys(
+    session_factory: Callable[[], Session],
+    batch_size: int = 500,
+    pause: float = 0.0,
+    restart: bool = False,
+    max_batches: Optional[int] = None,
+    on_batch: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    """
+    Vuelve a cifrar las claves privadas de todos los usuarios con la clave principal
+    de ENCRYPTION_KEYS (y cifra las que seguían en claro).
+
+    Recorre 'users' por id en lotes de 'batch_size' (paginación por clave, memoria
+    acotada) y cada lote es una transacción corta que también guarda el progreso en
+    'key_rotation_progress': si se interrumpe, la siguiente ejecución sigue por el
+    último lote confirmado. Cada fila solo se actualiza si no cambió desde que se leyó,
+    así no pisa una conexión o desconexión que ocurra a la vez, y no se bloquea la
+    tabla entera. 'pause' (segundos entre lotes) limita la carga sobre la base de datos.
+    """
+    # Falla antes de empezar si alguna clave de ENCRYPTION_KEYS no es válida.
+    get_cipher()
+    key_id = primary_key_id()
+    with session_factory() as db:
+        progress = _progress(db, key_id)
+        if progress is None:
+            progress = KeyRotationProgress(key_id=key_id, last_user_id=0, rotated=0, skipped=0, failed=0)
+            db.add(progress)
+        elif restart:
+            progress.last_user_id, progress.rotated, progress.skipped, progress.failed = 0, 0, 0, 0
+            progress.started_at, progress.finished_at = datetime.utcnow(), None
+        elif progress.finished_at:
+            return {"key_id": key_id, "finished": True, "already_finished": True, "batches": 0,
+                    "rotated": progress.rotated, "skipped": progress.skipped, "failed": progress.failed}
+        db.commit()
+        last_user_id = progress.last_user_id
+
+    totals = {"key_id": key_id, "finished": False, "batches": 0, "rotated": 0, "skipped": 0, "failed": 0}
+    statement = (
+        update(users)
+        .where(users.c.id == bindparam("_id"), users.c.wg_private_key == bindparam("_old"))
+        .values(wg_private_key=bindparam("_new"))
+    )
+    while max_batches is None or totals["batches"] < max_batches:
+        with session_factory() as db:
+            rows = db.execute(
+                select(users.c.id, users.c.wg_private_key)
+                .where(users.c.id > last_user_id, users.c.wg_private_key.isnot(None))
+                .order_by(users.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                db.execute(
+                    update(progress_table)
+                    .where(progress_table.c.key_id == key_id)
+                    .values(finished_at=datetime.utcnow(), updated_at=datetime.utcnow())
+                )
+                db.commit()
+                totals["finished"] = True
+                break
+
+            params, failed = [], 0
+            for user_id, value in rows:
+                try:
+                    params.append({"_id": user_id, "_old": value, "_new": rotate_secret(value)})
+                except InvalidToken:
+                    # Cifrada con una clave que ya no está en ENCRYPTION_KEYS: se deja como está.
+                    print(f"No se pudo descifrar la clave privada del usuario {user_id}.")
+                    failed += 1
+
+            rotated = db.execute(statement, params).rowcount if params else 0
+            # Si el driver no informa de las filas afectadas, se asume que se actualizaron todas.
+            rotated = len(params) if rotated is None or rotated < 0 else rotated
+            skipped = len(params) - rotated
+            last_user_id = rows[-1][0]
+            db.execute(
+                update(progress_table)
+                .where(progress_table.c.key_id == key_id)
+                .values(
+                    last_user_id=last_user_id,
+                    rotated=progress_table.c.rotated + rotated,
+                    skipped=progress_table.c.skipped + skipped,
+                    failed=progress_table.c.failed + failed,
+                    updated_at=datetime.utcnow(),
+                )
+            )
+            db.commit()
+
+        totals["batches"] += 1
+        totals["rotated"] += rotated
+        totals["skipped"] += skipped
+        totals["failed"] += failed
+        if on_batch:
+            on_batch({**totals, "last_user_id": last_user_id})
+        if pause:
+            time.sleep(pause)
+    return totals
+
+
+def print_progress(db: Session):
+    rows = db.execute(select(KeyRotationProgress).order_by(KeyRotationProgress.started_at)).scalars().all()
+    current = primary_key_id()
+    print("clave\t\t\túltimo id\trotadas\tomitidas\tfallidas\tpendientes\tinicio\t\t\tfin")
+    for row in rows:
+        pending = 0 if row.finished_at else remaining(db, row.last_user_id)
+        marker = "*" if row.key_id == current else " "
+        print(
+            f"{marker}{row.key_id}\t{row.last_user_id}\t\t{row.rotated}\t{row.skipped}\t\t{row.failed}\t\t"
+            f"{pending}\t\t{row.started_at:%Y-%m-%d %H:%M:%S}\t{row.finished_at or '-'}"
+        )
+
+
+if __name__ == "__main__":
+    from ..db.database import SessionLocal, create_db_tables
+
+    parser = argparse.ArgumentParser(
+        description="Vuelve a cifrar las claves privadas de WireGuard con la primera clave de ENCRYPTION_KEYS."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="rota las claves (o continúa la rotación interrumpida)")
+    run.add_argument("--batch-size", type=int, default=500)
+    run.add_argument("--pause-ms", type=int, default=0, help="pausa entre lotes para no cargar la base de datos")
+    run.add_argument("--restart", action="store_true", help="empieza desde el principio")
+    commands.add_parser("status", help="muestra el progreso (* = clave principal actual)")
+    args = parser.parse_args()
+
+    create_db_tables()
+    if args.command == "run":
+        def report(totals: dict):
+            print(
+                f"lote {totals['batches']}: hasta el usuario {totals['last_user_id']}, "
+                f"{totals['rotated']} rotadas, {totals['skipped']} omitidas, {totals['failed']} fallidas"
+            )
+
+        try:
+            result = rotate_private_keys(
+                SessionLocal, max(args.batch_size, 1), args.pause_ms / 1000, args.restart, on_batch=report
+            )
+        except ValueError as e:
+            parser.error(str(e))
+        if result.get("already_finished"):
+            print("La rotación a la clave actual ya estaba terminada (usa --restart para repetirla).")
+    with SessionLocal() as db:
+        print_progress(db)
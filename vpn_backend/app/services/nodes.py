@@ -0,0 +1,588 @@
+import argparse
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..core.local_store import Lease, LocalStore
+from ..db.models import User, WgNode
+from .config_cache import server_config_version
+from .ip_pool import IPPool
+from .peer_reconciler import DesiredState, PeerReconciler, WgUnavailable, desired_peers, peer_keys
+from .reaper import PeerReaper
+from .telemetry import TelemetryCollector
+from .usage_rollups import refresh_rollups
+from .wg_drivers import WgDriver, create_driver
+
+NODE_STATUSES = ("active", "draining", "disabled")
+PLACEMENT_STRATEGIES = ("peers", "throughput")
+# Segundos que un nodo que no responde queda fuera del reparto antes de volver a probarlo.
+NODE_RETRY_AFTER = 30
+
+users = User.__table__
+
+
+class NodeRuntime:
+    """
+    Nodo de WireGuard en marcha: los datos del servidor para las configuraciones
+    de cliente, su propio asignador de IPs y sus hilos (reconciliador, colector
+    de telemetría y reaper), todos a través del driver del nodo.
+
+    Si el nodo no responde (WgUnavailable), queda marcado como no disponible
+    durante NODE_RETRY_AFTER segundos o hasta la siguiente llamada que funcione.
+    """
+
+    def __init__(
+        self,
+        row: WgNode,
+        driver: WgDriver,
+        session_factory: Callable,
+        on_reaped: Optional[Callable[[List[str]], None]] = None,
+        busy_users: Optional[Callable[[], Iterable[str]]] = None,
+        active: Optional[Callable[[], bool]] = None,
+        store: Optional[LocalStore] = None,
+    ):
+        self.name = row.name
+        self.interface = row.interface
+        self.driver = driver
+        self.session_factory = session_factory
+        self.last_error: Optional[str] = None
+        self._unavailable_until = 0.0
+        # Usuarios con un connect/disconnect en curso: la reconciliación no toca sus peers.
+        self.busy_users = busy_users
+        self.update(row)
+        self.pool = IPPool(row.client_cidr, node=row.name, store=store)
+        self.reconciler = PeerReconciler(
+            row.interface,
+            self.run_wg,
+            window=settings.WG_BATCH_WINDOW_MS / 1000,
+            max_batch=settings.WG_BATCH_MAX_PEERS,
+            reconcile_interval=settings.WG_RECONCILE_INTERVAL,
+            desired_state=self.load_desired_peers,
+            managed_cidr=row.client_cidr,
+            active=active
+        )
+        self.collector = TelemetryCollector(
+            row.interface,
+            self.run_wg,
+            session_factory,
+            interval=settings.TELEMETRY_INTERVAL,
+            active_window=settings.WG_HANDSHAKE_TIMEOUT,
+            on_poll=refresh_rollups,
+            label=row.name,
+            active=active,
+            store=store
+        )
+        self.reaper = PeerReaper(
+            self.reconciler,
+            session_factory,
+            self.pool,
+            ttl=settings.WG_PEER_TTL,
+            interval=settings.WG_REAPER_INTERVAL,
+            on_reaped=on_reaped,
+            node=row.name,
+            active=active
+        )
+
+    def update(self, row: WgNode):
+        """Copia los datos del nodo que pueden cambiar sin reiniciarlo."""
+        self.endpoint = row.endpoint
+        self.port = row.port or 51820
+        self.public_key = row.public_key
+        self.dns = row.dns or settings.WG_CLIENT_DNS
+        self.weight = row.weight or 1.0
+        self.status = row.status or "active"
+        # Si cambia algún dato que aparece en las configuraciones, las de la caché dejan de valer.
+        self.config_version = server_config_version(self.name, self.public_key, self.endpoint, self.port, self.dns)
+
+    def run_wg(self, args: List[str]) -> str:
+        """Ejecuta 'wg' a través del driver y registra si el nodo responde."""
+        try:
+            output = self.driver(args)
+        except WgUnavailable as e:
+            self.last_error = str(e)
+            self._unavailable_until = time.monotonic() + NODE_RETRY_AFTER
+            raise
+        self._unavailable_until = 0.0
+        return output
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self._unavailable_until
+
+    def load_desired_peers(self) -> DesiredState:
+        """
+        Lee de la base de datos los peers que deberían estar en la interfaz del nodo y
+        las claves de los usuarios con una operación en curso, que se dejan como están.
+        """
+        # Los usuarios ocupados se leen antes que los peers: si su operación termina
+        # entre las dos lecturas, la base de datos ya tiene su estado final.
+        busy = set(self.busy_users()) if self.busy_users else set()
+        with self.session_factory() as db:
+            return desired_peers(db, self.name), peer_keys(db, busy)
+
+    def rescan_pool(self) -> int:
+        """Vuelve a leer de 'users' las IPs del nodo, ej. si otro worker ya guardó una que este creía libre."""
+        with self.session_factory() as db:
+            return self.pool.rescan(db)
+
+    def sync(self) -> tuple:
+        """Lee los peers actuales de la interfaz y aplica la diferencia con la base de datos. Retorna (añadidos, eliminados)."""
+        return self.reconciler.reconcile()
+
+    def start(self):
+        self.reconciler.start()
+        self.collector.start()
+        self.reaper.start()
+
+    def stop(self):
+        self.reaper.stop()
+        self.collector.stop()
+        self.reconciler.stop()
+
+    @property
+    def peers(self) -> int:
+        return self.pool.allocated
+
+    @property
+    def bytes_per_s(self) -> float:
+        return self.collector.latest().get("bytes_per_s", 0.0)
+
+    def has_room(self) -> bool:
+        return self.pool.allocated < self.pool.capacity
+
+    def load(self, strategy: str) -> tuple:
+        """Carga del nodo relativa a su peso; el nodo con el valor más bajo recibe el siguiente peer."""
+        peers = self.peers / self.weight
+        throughput = self.bytes_per_s / self.weight
+        return (throughput, peers) if strategy == "throughput" else (peers, throughput)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "interface": self.interface,
+            "endpoint": f"{self.endpoint}:{self.port}",
+            "status": self.status,
+            "healthy": self.healthy,
+            "last_error": self.last_error,
+            "weight": self.weight,
+            "peers": self.peers,
+            "capacity": self.pool.capacity,
+            "open_sessions": self.collector.latest().get("open_sessions"),
+            "bytes_per_s": self.bytes_per_s,
+        }
+
+
+class NodeRegistry:
+    """
+    Registro de los nodos de WireGuard que gestiona este proceso.
+
+    Los nodos se leen de la tabla 'wg_nodes'; el nodo por defecto se define en
+    'settings'. Los peers nuevos van al nodo activo con menos carga (por número
+    de peers o por tráfico reciente) y cada usuario se queda en su nodo mientras
+    exista y no se esté vaciando. Un nodo 'draining' no recibe peers nuevos y
+    'rebalance' mueve sus peers a los demás.
+
+    Con varios workers, todos cargan los nodos y atienden las rutas, pero las
+    tareas periódicas (reconciliación completa, telemetría y reaper) y la
+    alineación al arrancar solo las ejecuta el que tiene 'lease' (uno por máquina,
+    a través del almacén local); los demás leen la última telemetría que publicó.
+    Cada worker tiene su propio asignador de IPs por nodo: las IPs se reclaman en
+    el almacén para no repartir la misma a la vez, y cada 'refresh_interval' el
+    asignador se vuelve a leer de 'users' si no coincide con ella.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable,
+        strategy: str = "peers",
+        refresh_interval: float = 0,
+        driver_factory: Callable[[str, Optional[str]], WgDriver] = create_driver,
+        on_change: Optional[Callable[[List[str]], None]] = None,
+        busy_users: Optional[Callable[[], Iterable[str]]] = None,
+        lease: Optional[Lease] = None,
+    ):
+        if strategy not in PLACEMENT_STRATEGIES:
+            raise ValueError(f"Criterio de reparto no válido: {strategy}")
+        self.session_factory = session_factory
+        self.strategy = strategy
+        self.refresh_interval = refresh_interval
+        self.driver_factory = driver_factory
+        # Se llama con los usuarios cuya configuración cambió (peer retirado o movido de nodo).
+        self.on_change = on_change
+        # Usuarios con una operación en curso, que la reconciliación no debe tocar.
+        self.busy_users = busy_users
+        # Sin concesión, este proceso ejecuta siempre las tareas periódicas de los nodos.
+        self.lease = lease
+        self._nodes: Dict[str, NodeRuntime] = {}
+        self._versions = frozenset()
+        self._lock = threading.Lock()
+        self._started = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def ensure_default_node(self, db: Session):
+        """Crea o actualiza el nodo por defecto con los valores de 'settings' (conserva su estado y peso)."""
+        for _ in range(2):
+            row = db.execute(select(WgNode).where(WgNode.name == settings.WG_NODE_NAME)).scalars().first()
+            if not row:
+                row = WgNode(name=settings.WG_NODE_NAME, driver="local", status="active", weight=1.0)
+                db.add(row)
+            row.interface = settings.WG_INTERFACE
+            row.endpoint = settings.WG_SERVER_ENDPOINT
+            row.port = settings.WG_SERVER_PORT
+            row.public_key = settings.WG_SERVER_PUBLIC_KEY
+            row.client_cidr = settings.WG_CLIENT_CIDR
+            row.dns = settings.WG_CLIENT_DNS
+            try:
+                db.commit()
+                return
+            except IntegrityError:
+                # Otro worker lo creó a la vez (primer arranque con varios workers): se actualiza el suyo.
+                db.rollback()
+        raise RuntimeError(f"No se pudo crear el nodo por defecto {settings.WG_NODE_NAME}.")
+
+    def load(self, db: Session) -> int:
+        """
+        Carga los nodos y reconstruye sus asignadores de IPs desde la base de datos.
+        Los usuarios anteriores al registro de nodos se asignan al nodo por defecto.
+        Retorna el número de nodos.
+        """
+        self.ensure_default_node(db)
+        db.execute(
+            update(users)
+            .where(users.c.wg_node.is_(None), users.c.wg_ip_address.isnot(None))
+            .values(wg_node=settings.WG_NODE_NAME)
+        )
+        db.commit()
+        existing = set(self._nodes)
+        self.refresh(db)
+        # Los nodos nuevos ya se reconstruyen al leerlos.
+        for node in self.nodes():
+            if node.name in existing:
+                node.pool.rebuild(db)
+        return len(self._nodes)
+
+    def refresh(self, db: Session):
+        """Vuelve a leer 'wg_nodes': añade los nodos nuevos y actualiza el estado y los datos de los existentes."""
+        rows = db.execute(select(WgNode)).scalars().all()
+        with self._lock:
+            nodes = dict(self._nodes)
+
+        for row in rows:
+            node = nodes.get(row.name)
+            if node:
+                node.update(row)
+                continue
+            try:
+                driver = self.driver_factory(row.driver or "local", row.driver_target)
+                node = NodeRuntime(
+                    row, driver, self.session_factory, on_reaped=self.on_change, busy_users=self.busy_users,
+                    active=self.owns_background_tasks, store=self.lease.store if self.lease else None
+                )
+            except ValueError as e:
+                print(f"Error al cargar el nodo de WireGuard {row.name}: {e}")
+                continue
+            node.pool.rebuild(db)
+            nodes[row.name] = node
+
+        # Un nodo borrado de la tabla se trata como desactivado.
+        names = {row.name for row in rows}
+        for name, node in nodes.items():
+            if name not in names:
+                node.status = "disabled"
+
+        with self._lock:
+            self._nodes = nodes
+            self._versions = frozenset(node.config_version for node in nodes.values() if node.status != "disabled")
+            started = self._started
+        if started:
+            for node in nodes.values():
+                if node.status == "disabled":
+                    node.stop()
+                else:
+                    node.start()
+
+    def owns_background_tasks(self) -> bool:
+        """Indica si este proceso debe ejecutar las tareas periódicas de los nodos."""
+        return self.lease is None or self.lease.held
+
+    def node_for(self, name: Optional[str]) -> Optional[NodeRuntime]:
+        return self._nodes.get(name) if name else None
+
+    def nodes(self) -> List[NodeRuntime]:
+        return list(self._nodes.values())
+
+    def config_versions(self) -> frozenset:
+        """Versiones de configuración vigentes (una por nodo no desactivado)."""
+        return self._versions
+
+    def sticky_node(self, name: Optional[str], has_ip: bool) -> Optional[NodeRuntime]:
+        """
+        Nodo en el que sigue un usuario, o None si hay que colocarlo de nuevo
+        (el nodo ya no existe, está desactivado, o se está vaciando o no responde y el usuario no tiene IP).
+        """
+        node = self.node_for(name)
+        if not node or node.status == "disabled":
+            return None
+        if not has_ip and (node.status == "draining" or not node.healthy):
+            return None
+        return node
+
+    def place(self, exclude: Iterable[str] = ()) -> Optional[NodeRuntime]:
+        """Nodo activo, que responde, con menos carga y con IPs libres, o None si no hay ninguno."""
+        exclude = set(exclude)
+        candidates = [
+            node for node in self.nodes()
+            if node.status == "active" and node.healthy and node.name not in exclude and node.has_room()
+        ]
+        return min(candidates, key=lambda node: node.load(self.strategy), default=None)
+
+    def sync_peers(self) -> Dict[str, dict]:
+        """
+        Alinea la interfaz de cada nodo no desactivado con la base de datos, todos a la vez.
+        Se usa al arrancar, para no esperar a la primera reconciliación periódica.
+        Si otro worker tiene la concesión, la alineación le corresponde a él y no se hace nada.
+        """
+        if self.lease and not (self.lease.held or self.lease.renew()):
+            return {}
+        nodes = [node for node in self.nodes() if node.status != "disabled"]
+        if not nodes:
+            return {}
+        results = {}
+        with ThreadPoolExecutor(max_workers=len(nodes), thread_name_prefix="wg-sync") as executor:
+            futures = {node.name: executor.submit(node.sync) for node in nodes}
+            for name, future in futures.items():
+                try:
+                    added, removed = future.result()
+                    results[name] = {"added": added, "removed": removed}
+                except Exception as e:
+                    print(f"Error al leer el estado de los peers del nodo {name}: {e}")
+                    results[name] = {"error": str(e)}
+        return results
+
+    def start(self):
+        if self.lease:
+            self.lease.start()
+        with self._lock:
+            self._started = True
+        for node in self.nodes():
+            if node.status != "disabled":
+                node.start()
+        if self.refresh_interval and not (self._thread and self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="wg-node-registry", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        with self._lock:
+            self._started = False
+        for node in self.nodes():
+            node.stop()
+        if self.lease:
+            self.lease.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                with self.session_factory() as db:
+                    self.refresh(db)
+                    # Los demás workers también asignan y liberan IPs.
+                    for node in self.nodes():
+                        node.pool.resync(db)
+            except Exception as e:
+                print(f"Error al recargar los nodos de WireGuard: {e}")
+
+    def set_status(self, db: Session, name: str, status: str) -> bool:
+        """Cambia el estado de un nodo ('active', 'draining' o 'disabled'). Retorna False si no existe."""
+        if status not in NODE_STATUSES:
+            raise ValueError(f"Estado de nodo no válido: {status}")
+        row = db.execute(select(WgNode).where(WgNode.name == name)).scalars().first()
+        if not row:
+            return False
+        row.status = status
+        db.commit()
+        self.refresh(db)
+        return True
+
+    def stats(self) -> List[dict]:
+        return [node.stats() for node in self.nodes()]
+
+    def rebalance(self, source: str, target: Optional[str] = None, limit: Optional[int] = None) -> dict:
+        """
+        Mueve los peers del nodo 'source' al nodo 'target' o, si no se indica, al
+        nodo con menos carga en cada momento. Para vaciar un nodo, primero se marca
+        como 'draining' para que no reciba peers nuevos.
+
+        Cada peer se añade en el nodo nuevo antes de quitarlo del anterior, en lotes
+        de 'wg set'. Los usuarios movidos reciben la configuración nueva en su
+        siguiente /vpn/connect. Retorna {moved, failed, remaining}.
+        """
+        src = self.node_for(source)
+        if not src:
+            raise KeyError(source)
+        dst = None
+        if target:
+            dst = self.node_for(target)
+            if not dst or dst is src or dst.status != "active":
+                raise ValueError(f"El nodo {target} no puede recibir peers.")
+
+        moved = failed = 0
+        with self.session_factory() as db:
+            if src.status != "active":
+                # Usuarios del nodo sin peer activo: se colocarán en otro nodo al volver a conectarse.
+                db.execute(
+                    update(users)
+                    .where(users.c.wg_node == source, users.c.wg_ip_address.is_(None))
+                    .values(wg_node=None)
+                )
+                db.commit()
+
+            last_id = 0
+            while limit is None or moved + failed < limit:
+                size = src.reconciler.max_batch if limit is None else min(src.reconciler.max_batch, limit - moved - failed)
+                rows = db.execute(
+                    select(User.id, User.username, User.wg_public_key, User.wg_ip_address)
+                    .where(
+                        User.wg_node == source,
+                        User.wg_ip_address.isnot(None),
+                        User.wg_public_key.isnot(None),
+                        User.id > last_id
+                    )
+                    .order_by(User.id)
+                    .limit(size)
+                ).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                batch_moved, planned = self._move(db, src, dst, rows)
+                moved += batch_moved
+                failed += planned - batch_moved
+                if planned < len(rows):
+                    # No quedan IPs libres en los nodos de destino.
+                    break
+
+            remaining = db.execute(
+                select(func.count(User.id)).where(User.wg_node == source, User.wg_ip_address.isnot(None))
+            ).scalar()
+        return {"moved": moved, "failed": failed, "remaining": remaining}
+
+    def _move(self, db: Session, src: NodeRuntime, dst: Optional[NodeRuntime], rows) -> tuple:
+        """Mueve un lote de usuarios de 'src'. Retorna (movidos, intentados)."""
+        plan = []
+        for row in rows:
+            node = dst or self.place(exclude=[src.name])
+            ip = node.pool.allocate() if node else None
+            if not ip:
+                break
+            plan.append((row, node, ip))
+        attempted = len(plan)
+
+        # 1. Añadir los peers en sus nodos nuevos.
+        by_node = defaultdict(dict)
+        for row, node, ip in plan:
+            by_node[node.name][row.wg_public_key] = ip
+        added = {}
+        for name, desired in by_node.items():
+            added.update(self._nodes[name].reconciler.apply_many(desired))
+        for row, node, ip in plan:
+            if not added.get(row.wg_public_key):
+                node.pool.release(ip)
+        plan = [entry for entry in plan if added.get(entry[0].wg_public_key)]
+        if not plan:
+            return 0, attempted
+
+        # 2. Cambiar el nodo en la base de datos, solo si el usuario sigue en 'src' con la misma clave.
+        db.execute(
+            update(users)
+            .where(
+                users.c.id == bindparam("b_id"),
+                users.c.wg_node == src.name,
+                users.c.wg_public_key == bindparam("b_key")
+            )
+            .values(wg_node=bindparam("b_node"), wg_ip_address=bindparam("b_ip"), wg_peer_added_at=datetime.utcnow()),
+            [{"b_id": row.id, "b_key": row.wg_public_key, "b_node": node.name, "b_ip": ip} for row, node, ip in plan]
+        )
+        db.commit()
+        current = {
+            user_id: (node_name, ip)
+            for user_id, node_name, ip in db.execute(
+                select(User.id, User.wg_node, User.wg_ip_address).where(User.id.in_([row.id for row, _, _ in plan]))
+            )
+        }
+        done = [entry for entry in plan if current.get(entry[0].id) == (entry[1].name, entry[2])]
+
+        # Usuarios que se desconectaron mientras tanto: se deshace el alta en el nodo nuevo.
+        undo = defaultdict(dict)
+        for row, node, ip in plan:
+            if current.get(row.id) != (node.name, ip):
+                undo[node.name][row.wg_public_key] = None
+                node.pool.release(ip)
+        for name, desired in undo.items():
+            self._nodes[name].reconciler.apply_many(desired)
+
+        # 3. Quitar los peers del nodo anterior. Si falla, la reconciliación completa los retirará.
+        src.reconciler.apply_many({row.wg_public_key: None for row, _, _ in done})
+        for row, _, _ in done:
+            src.pool.release(row.wg_ip_address)
+        if self.on_change and done:
+            self.on_change([row.username for row, _, _ in done])
+        return len(done), attempted
+
+
+if __name__ == "__main__":
+    from ..db.database import SessionLocal, create_db_tables
+
+    parser = argparse.ArgumentParser(
+        description="Gestiona los nodos de WireGuard. Para vaciar un nodo usa la ruta /admin/nodes/{nombre}/drain."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="lista los nodos")
+    add = commands.add_parser("add", help="registra un nodo")
+    add.add_argument("name")
+    add.add_argument("--endpoint", required=True, help="IP o dominio público del servidor")
+    add.add_argument("--public-key", required=True)
+    add.add_argument("--cidr", required=True, help="rango de direcciones de los clientes")
+    add.add_argument("--interface", default="wg0")
+    add.add_argument("--port", type=int, default=51820)
+    add.add_argument("--dns", default=settings.WG_CLIENT_DNS)
+    add.add_argument("--driver", default="ssh", choices=["local", "ssh", "fake"])
+    add.add_argument("--target", help="comando 'wg' (local) o host (ssh)")
+    add.add_argument("--weight", type=float, default=1.0)
+    set_status = commands.add_parser("status", help="cambia el estado de un nodo")
+    set_status.add_argument("name")
+    set_status.add_argument("status", choices=NODE_STATUSES)
+    args = parser.parse_args()
+
+    create_db_tables()
+    with SessionLocal() as db:
+        if args.command == "add":
+            try:
+                create_driver(args.driver, args.target)
+            except ValueError as e:
+                parser.error(str(e))
+            db.add(WgNode(
+                name=args.name, interface=args.interface, endpoint=args.endpoint, port=args.port,
+                public_key=args.public_key, client_cidr=args.cidr, dns=args.dns,
+                driver=args.driver, driver_target=args.target, weight=args.weight, status="active"
+            ))
+            db.commit()
+        elif args.command == "status":
+            row = db.execute(select(WgNode).where(WgNode.name == args.name)).scalars().first()
+            if not row:
+                parser.error(f"El nodo {args.name} no existe.")
+            row.status = args.status
+            db.commit()
+        for row in db.execute(select(WgNode).order_by(WgNode.name)).scalars():
+            print(f"{row.name}\t{row.status}\t{row.interface}\t{row.endpoint}:{row.port}\t{row.client_cidr}\t{row.driver}\t{row.weight}")
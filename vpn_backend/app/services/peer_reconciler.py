@@ -0,0 +1,355 @@
+import ipaddress
+import queue
+import shlex
+import subprocess
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Collection, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..core.metrics import WG_COMMAND_FAILURES, WG_COMMAND_SECONDS
+from ..db.models import User
+
+# Tiempo máximo que una petición HTTP espera el resultado de su lote.
+PEER_CHANGE_TIMEOUT = 30
+# Segundos que puede tardar un comando 'wg' antes de darlo por fallido.
+WG_COMMAND_TIMEOUT = 10
+# Máximo de nombres de usuario por consulta 'IN'.
+LOOKUP_CHUNK_SIZE = 500
+
+# Estado deseado de una interfaz: ({clave pública: IP}, claves que no se deben tocar).
+DesiredState = Tuple[Dict[str, str], Collection[str]]
+
+
+class WgCommandError(Exception):
+    """El comando 'wg' terminó con error."""
+
+
+class WgUnavailable(WgCommandError):
+    """No se pudo hablar con 'wg' (no responde, no se puede ejecutar o el host no es accesible)."""
+
+
+class WgRunner:
+    """
+    Ejecuta el binario 'wg' con el comando indicado (ej. WG_COMMAND).
+    Se puede sustituir por cualquier ejecutable compatible (ej. un 'wg' falso para pruebas).
+    Un comando que tarda más de 'timeout' segundos se mata y cuenta como fallido.
+    Los códigos de salida de 'unavailable_codes' (ej. 255 de ssh, sin conexión) indican
+    que no se llegó a ejecutar 'wg'.
+    """
+
+    def __init__(self, command: str, timeout: float = WG_COMMAND_TIMEOUT, unavailable_codes: Collection[int] = ()):
+        self.command = shlex.split(command)
+        self.timeout = timeout
+        self.unavailable_codes = set(unavailable_codes)
+
+    def __call__(self, args: List[str]) -> str:
+        command = args[0] if args else ""
+        started = time.perf_counter()
+        try:
+            result = subprocess.run(self.command + args, capture_output=True, text=True, check=True, timeout=self.timeout)
+        except FileNotFoundError as e:
+            WG_COMMAND_FAILURES.inc(command)
+            raise WgUnavailable(f"El comando '{self.command[0]}' no fue encontrado.") from e
+        except subprocess.TimeoutExpired as e:
+            WG_COMMAND_FAILURES.inc(command)
+            raise WgUnavailable(f"El comando '{self.command[0]}' no respondió en {self.timeout} s.") from e
+        except OSError as e:
+            # Ej. sin permiso de ejecución.
+            WG_COMMAND_FAILURES.inc(command)
+            raise WgUnavailable(f"No se pudo ejecutar '{self.command[0]}': {e}") from e
+        except subprocess.CalledProcessError as e:
+            WG_COMMAND_FAILURES.inc(command)
+            error = WgUnavailable if e.returncode in self.unavailable_codes else WgCommandError
+            raise error(e.stderr.strip() or str(e)) from e
+        finally:
+            WG_COMMAND_SECONDS.observe(time.perf_counter() - started, command)
+        return result.stdout
+
+
+def parse_dump(output: str) -> Iterator[Tuple[str, str, int, int, int]]:
+    """
+    Recorre la salida de 'wg show <interfaz> dump'.
+    Retorna (clave pública, allowed-ips, último handshake, bytes rx, bytes tx) por cada peer.
+    La primera línea describe la interfaz y se ignora.
+    """
+    lines = output.splitlines()
+    for line in lines[1:]:
+        fields = line.split("\t")
+        if len(fields) < 8:
+            continue
+        yield fields[0], fields[3], int(fields[4]), int(fields[5]), int(fields[6])
+
+
+class PeerChange:
+    """Cambio deseado para un peer: añadirlo con 'allowed_ip' o eliminarlo si es None."""
+
+    __slots__ = ("public_key", "allowed_ip", "futures")
+
+    def __init__(self, public_key: str, allowed_ip: Optional[str]):
+        self.public_key = public_key
+        self.allowed_ip = allowed_ip
+        self.futures = [Future()]
+
+    def args(self) -> List[str]:
+        if self.allowed_ip is None:
+            return ["peer", self.public_key, "remove"]
+        return ["peer", self.public_key, "allowed-ips", f"{self.allowed_ip}/32"]
+
+
+class PeerReconciler:
+    """
+    Agrupa los cambios de peers pedidos por las rutas y los aplica en lotes.
+
+    Los cambios que llegan dentro de la misma ventana se combinan (el último
+    cambio de cada clave gana) y se aplican con un único 'wg set'. Si el lote
+    falla, se reintenta peer por peer para saber qué cambio falló. Cada petición
+    recibe su resultado a través de un Future.
+
+    Si se indica 'managed_cidr', la reconciliación completa solo elimina peers con
+    una IP de ese rango: los que el operador añada a mano fuera de él se respetan.
+    Con 'active', la reconciliación periódica solo se hace mientras retorne True
+    (ej. en el worker con la concesión de las tareas de los nodos); los lotes de
+    cambios se aplican siempre.
+    """
+
+    def __init__(
+        self,
+        interface: str,
+        runner: Callable[[List[str]], str],
+        window: float,
+        max_batch: int,
+        reconcile_interval: float = 0,
+        desired_state: Optional[Callable[[], DesiredState]] = None,
+        managed_cidr: Optional[str] = None,
+        active: Optional[Callable[[], bool]] = None,
+    ):
+        self.interface = interface
+        self.runner = runner
+        self.window = window
+        self.max_batch = max(max_batch, 1)
+        self.reconcile_interval = reconcile_interval
+        self.desired_state = desired_state
+        self.network = ipaddress.ip_network(managed_cidr, strict=False) if managed_cidr else None
+        self.active = active
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._apply_lock = threading.Lock()
+        self.batches = 0
+        self.peers_applied = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"wg-reconciler-{self.interface}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        # Aplica lo que quedó pendiente para no dejar peticiones esperando.
+        pending = self._drain(time.monotonic())
+        if pending:
+            self._apply(pending)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def submit(self, public_key: str, allowed_ip: Optional[str]) -> Future:
+        """
+        Encola un cambio y retorna un Future que se resuelve a True/False.
+        Si el hilo no está en marcha, el cambio se aplica inmediatamente.
+        """
+        change = PeerChange(public_key, allowed_ip)
+        if not self.running:
+            self._apply([change])
+        else:
+            self._queue.put(change)
+        return change.futures[0]
+
+    def _drain(self, deadline: float) -> List[PeerChange]:
+        changes = []
+        while len(changes) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout <= 0:
+                    changes.append(self._queue.get_nowait())
+                else:
+                    changes.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return changes
+
+    def _run(self):
+        next_reconcile = time.monotonic() + self.reconcile_interval
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                first = None
+
+            if first is not None:
+                batch = [first] + self._drain(time.monotonic() + self.window)
+                self._apply(batch)
+
+            if self.reconcile_interval and self.desired_state and time.monotonic() >= next_reconcile:
+                next_reconcile = time.monotonic() + self.reconcile_interval
+                if self.active and not self.active():
+                    continue
+                try:
+                    self.reconcile()
+                except Exception as e:
+                    print(f"Error en la reconciliación completa de {self.interface}: {e}")
+
+    def _coalesce(self, changes: List[PeerChange]) -> List[PeerChange]:
+        """
+        Deja un cambio por clave, el último. Si el anterior era igual, sus peticiones
+        comparten el resultado; si era distinto (ej. un alta seguida de una baja), no
+        llega a aplicarse y sus peticiones reciben False.
+        """
+        merged: Dict[str, PeerChange] = {}
+        for change in changes:
+            previous = merged.pop(change.public_key, None)
+            if previous:
+                if previous.allowed_ip == change.allowed_ip:
+                    change.futures = previous.futures + change.futures
+                else:
+                    self._resolve(previous, False)
+            merged[change.public_key] = change
+        return list(merged.values())
+
+    def _resolve(self, change: PeerChange, ok: bool):
+        for future in change.futures:
+            if not future.done():
+                future.set_result(ok)
+
+    def _apply(self, changes: List[PeerChange]):
+        changes = self._coalesce(changes)
+        try:
+            with self._apply_lock:
+                self._apply_batch(changes)
+        except Exception as e:
+            # Error que no es de 'wg' (ej. del driver): el lote se da por fallido y el hilo sigue.
+            print(f"Error inesperado al aplicar un lote en {self.interface}: {e}")
+            for change in changes:
+                self._resolve(change, False)
+
+    def _apply_batch(self, changes: List[PeerChange]):
+        """Aplica el lote con un solo 'wg set' y, si falla, peer por peer. Requiere '_apply_lock'."""
+        args = ["set", self.interface]
+        for change in changes:
+            args.extend(change.args())
+        try:
+            self.runner(args)
+            self.batches += 1
+            self.peers_applied += len(changes)
+            for change in changes:
+                self._resolve(change, True)
+            return
+        except WgUnavailable as e:
+            # Repetirlo peer por peer solo esperaría otra vez a un nodo que no responde.
+            print(f"WireGuard no está disponible en {self.interface}: {e}")
+            for change in changes:
+                self._resolve(change, False)
+            return
+        except WgCommandError as e:
+            if len(changes) == 1:
+                print(f"Error al aplicar el peer {changes[0].public_key} en WireGuard: {e}")
+                self._resolve(changes[0], False)
+                return
+
+        # El lote falló: se aplica peer por peer para saber cuál es el problemático.
+        for change in changes:
+            try:
+                self.runner(["set", self.interface] + change.args())
+                self.peers_applied += 1
+                self._resolve(change, True)
+            except WgCommandError as e:
+                print(f"Error al aplicar el peer {change.public_key} en WireGuard: {e}")
+                self._resolve(change, False)
+
+    def apply_many(self, desired: Dict[str, Optional[str]]) -> Dict[str, bool]:
+        """
+        Aplica muchos cambios directamente, en lotes de 'max_batch' peers por 'wg set'.
+        Retorna el resultado de cada clave.
+        """
+        changes = [PeerChange(key, ip) for key, ip in desired.items()]
+        for start in range(0, len(changes), self.max_batch):
+            self._apply(changes[start:start + self.max_batch])
+        return {change.public_key: change.futures[0].result() for change in changes}
+
+    def dump_handshakes(self) -> Dict[str, int]:
+        """Retorna el último handshake (timestamp, 0 si nunca) de cada peer de la interfaz."""
+        output = self.runner(["show", self.interface, "dump"])
+        return {public_key: handshake for public_key, _, handshake, _, _ in parse_dump(output)}
+
+    def dump(self) -> Dict[str, str]:
+        """Retorna los peers activos en la interfaz: {clave pública: IP}."""
+        output = self.runner(["show", self.interface, "dump"])
+        return {
+            public_key: allowed_ips.split(",")[0].split("/")[0]
+            for public_key, allowed_ips, _, _, _ in parse_dump(output)
+        }
+
+    def manages(self, ip: str) -> bool:
+        """Indica si la IP pertenece al rango que gestiona este reconciliador (todas si no tiene rango)."""
+        if self.network is None:
+            return True
+        try:
+            return ipaddress.ip_address(ip) in self.network
+        except ValueError:
+            return False
+
+    def reconcile(self, desired: Optional[Dict[str, str]] = None, skip: Collection[str] = ()) -> Tuple[int, int]:
+        """
+        Compara la interfaz con el estado deseado y aplica la diferencia en un solo lote.
+
+        Sin 'desired', el estado se pide a 'desired_state' después de leer la interfaz,
+        así un peer recién añadido ya figura en la base de datos (connect guarda la IP
+        antes del 'wg set'). Las claves de 'skip' (usuarios con una operación en curso,
+        ej. un disconnect que ya quitó el peer pero aún no borró sus claves) no se tocan,
+        y solo se eliminan peers dentro del rango gestionado.
+        Retorna (peers añadidos o corregidos, peers eliminados).
+        """
+        current = self.dump()
+        if desired is None:
+            desired, skip = self.desired_state()
+        skip = set(skip)
+        changes = {key: ip for key, ip in desired.items() if key not in skip and current.get(key) != ip}
+        removed = [key for key, ip in current.items() if key not in desired and key not in skip and self.manages(ip)]
+        self.apply_many({**changes, **{key: None for key in removed}})
+        return len(changes), len(removed)
+
+
+def desired_peers(db: Session, node: Optional[str] = None) -> Dict[str, str]:
+    """
+    Estado deseado según la base de datos: {clave pública: IP} de cada usuario con VPN.
+    Si se indica 'node', solo los usuarios de ese nodo.
+    """
+    stmt = select(User.wg_public_key, User.wg_ip_address).where(
+        User.wg_public_key.isnot(None), User.wg_ip_address.isnot(None)
+    )
+    if node is not None:
+        stmt = stmt.where(User.wg_node == node)
+    return {public_key: ip for public_key, ip in db.execute(stmt)}
+
+
+def peer_keys(db: Session, usernames: Iterable[str]) -> Set[str]:
+    """Claves públicas de los usuarios indicados (los que tengan)."""
+    usernames = list(usernames)
+    keys = set()
+    for start in range(0, len(usernames), LOOKUP_CHUNK_SIZE):
+        keys.update(db.execute(
+            select(User.wg_public_key).where(
+                User.username.in_(usernames[start:start + LOOKUP_CHUNK_SIZE]), User.wg_public_key.isnot(None)
+            )
+        ).scalars())
+    return keys
@@ -0,0 +1,153 @@
+import threading
+import time
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from sqlalchemy import bindparam, select, update
+
+from ..db.models import ConnectionLog, User
+from .ip_pool import IPPool
+from .peer_reconciler import PeerReconciler, WgCommandError
+
+# Máximo de claves por consulta 'IN'.
+LOOKUP_CHUNK_SIZE = 500
+
+users = User.__table__
+connection_logs = ConnectionLog.__table__
+
+
+class PeerReaper:
+    """
+    Retira de la interfaz los peers inactivos.
+
+    Un peer es inactivo si su último handshake (o, si nunca hizo handshake, el
+    momento en que se añadió) es más antiguo que el TTL. Se eliminan todos en
+    lotes de 'wg set', se libera su IP y se cierran sus sesiones abiertas. Las
+    claves se quedan en la base de datos, así que al volver el usuario solo hay
+    que asignarle IP y añadir el peer de nuevo.
+
+    Solo se retiran peers de usuarios con 'wg_peer_added_at' anterior al corte:
+    connect lo fija antes del 'wg set', así que un peer que se está añadiendo
+    nunca se retira, y los usuarios sin él no tienen peer que retirar.
+
+    Con 'active', el hilo solo retira peers mientras retorne True (ej. en el worker
+    con la concesión de las tareas de los nodos).
+    """
+
+    def __init__(
+        self,
+        reconciler: PeerReconciler,
+        session_factory: Callable,
+        pool: IPPool,
+        ttl: float,
+        interval: float,
+        on_reaped: Optional[Callable[[List[str]], None]] = None,
+        node: Optional[str] = None,
+        active: Optional[Callable[[], bool]] = None,
+    ):
+        self.reconciler = reconciler
+        self.session_factory = session_factory
+        self.pool = pool
+        self.ttl = ttl
+        self.interval = interval
+        # Se llama con los nombres de usuario cuyos peers se retiraron.
+        self.on_reaped = on_reaped
+        # Si se indica, solo se retiran peers de usuarios de este nodo.
+        self.node = node
+        self.active = active
+        self._stop = threading.Event()
+        self._thread = None
+        self.reaped_total = 0
+
+    def start(self):
+        if not self.interval or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"wg-reaper-{self.reconciler.interface}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.active and not self.active():
+                continue
+            try:
+                self.reap()
+            except WgCommandError as e:
+                print(f"Error al leer los peers de {self.reconciler.interface}: {e}")
+            except Exception as e:
+                print(f"Error al retirar peers inactivos de {self.reconciler.interface}: {e}")
+
+    def reap(self, now: Optional[float] = None) -> dict:
+        """Retira los peers inactivos. Retorna estadísticas de la ejecución."""
+        now = now or time.time()
+        cutoff = now - self.ttl
+        cutoff_dt = datetime.utcfromtimestamp(cutoff)
+        handshakes = self.reconciler.dump_handshakes()
+        stale_keys = [key for key, handshake in handshakes.items() if handshake < cutoff]
+
+        # Solo se retiran peers de usuarios conocidos que no se hayan (re)conectado después del corte.
+        candidates = []
+        with self.session_factory() as db:
+            for start in range(0, len(stale_keys), LOOKUP_CHUNK_SIZE):
+                chunk = stale_keys[start:start + LOOKUP_CHUNK_SIZE]
+                stmt = select(User.id, User.username, User.wg_public_key, User.wg_ip_address).where(
+                    User.wg_public_key.in_(chunk),
+                    User.wg_peer_added_at < cutoff_dt
+                )
+                if self.node is not None:
+                    stmt = stmt.where(User.wg_node == self.node)
+                candidates.extend(db.execute(stmt).all())
+
+        if not candidates:
+            return {"peers": len(handshakes), "reaped": 0, "skipped": 0}
+
+        results = self.reconciler.apply_many({row.wg_public_key: None for row in candidates})
+        removed = [row for row in candidates if results.get(row.wg_public_key)]
+
+        closed_at = datetime.utcfromtimestamp(now)
+        with self.session_factory() as db:
+            if removed:
+                # La condición sobre 'wg_peer_added_at' evita pisar a un usuario que acaba de reconectarse.
+                db.execute(
+                    update(users)
+                    .where(
+                        users.c.id == bindparam("b_id"),
+                        users.c.wg_peer_added_at < cutoff_dt
+                    )
+                    .values(wg_ip_address=None, wg_peer_added_at=None),
+                    [{"b_id": row.id} for row in removed]
+                )
+                # Usuarios que sí se actualizaron (los que se reconectaron conservan su IP).
+                ids = [row.id for row in removed]
+                released = set()
+                for start in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+                    released.update(db.execute(
+                        select(User.id).where(User.id.in_(ids[start:start + LOOKUP_CHUNK_SIZE]), User.wg_ip_address.is_(None))
+                    ).scalars())
+                removed = [row for row in removed if row.id in released]
+                keys = [row.wg_public_key for row in removed]
+                for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+                    db.execute(
+                        update(connection_logs)
+                        .where(
+                            connection_logs.c.public_key.in_(keys[start:start + LOOKUP_CHUNK_SIZE]),
+                            connection_logs.c.disconnected_at.is_(None)
+                        )
+                        .values(disconnected_at=closed_at)
+                    )
+            db.commit()
+
+        for row in removed:
+            if row.wg_ip_address:
+                self.pool.release(row.wg_ip_address)
+        self.reaped_total += len(removed)
+        if self.on_reaped and removed:
+            self.on_reaped([row.username for row in removed])
+
+        return {"peers": len(handshakes), "reaped": len(removed), "skipped": len(candidates) - len(removed)}
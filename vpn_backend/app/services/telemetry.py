@@ -0,0 +1,297 @@
+import json
+import threading
+import time
+from array import array
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from ..core.local_store import LocalStore
+from ..db.models import ConnectionLog, User
+from .peer_reconciler import WgCommandError
+
+# Máximo de claves por consulta 'IN' al buscar a qué usuario pertenece cada peer.
+LOOKUP_CHUNK_SIZE = 500
+STORE_NAMESPACE = "telemetry"
+
+connection_logs = ConnectionLog.__table__
+
+
+class PeerSnapshot:
+    """
+    Estado de todos los peers de una interfaz en un instante.
+    Guarda los contadores en arrays compactos de enteros de 64 bits indexados por
+    posición, en lugar de un objeto por peer.
+    """
+
+    __slots__ = ("index", "handshake", "rx", "tx")
+
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.handshake = array("q")
+        self.rx = array("q")
+        self.tx = array("q")
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @classmethod
+    def parse(cls, output: str) -> "PeerSnapshot":
+        """Construye la instantánea a partir de la salida de 'wg show <interfaz> dump'."""
+        snapshot = cls()
+        index = snapshot.index
+        handshake, rx, tx = snapshot.handshake, snapshot.rx, snapshot.tx
+        lines = output.split("\n")
+        # La primera línea describe la interfaz, no un peer.
+        for line in lines[1:]:
+            fields = line.split("\t")
+            if len(fields) < 8:
+                continue
+            index[fields[0]] = len(handshake)
+            handshake.append(int(fields[4]))
+            rx.append(int(fields[5]))
+            tx.append(int(fields[6]))
+        return snapshot
+
+
+class TelemetryCollector:
+    """
+    Lee periódicamente 'wg show <interfaz> dump' y rellena 'connection_logs'.
+
+    Compara cada instantánea con la anterior en memoria: un peer cuyo último
+    handshake entra en la ventana de actividad abre una sesión, y uno que sale
+    de ella (o desaparece de la interfaz) la cierra. Los bytes rx/tx transcurridos
+    se suman a la sesión abierta. Todas las escrituras de una lectura se hacen
+    con un INSERT y un UPDATE masivos en una sola transacción.
+
+    Solo debe leer un colector por interfaz: con 'active', el hilo solo lee mientras
+    retorne True (ej. mientras este worker tenga la concesión de las tareas de los
+    nodos), y publica cada lectura en 'store' para los demás workers. Aun así, la base
+    de datos no admite dos sesiones abiertas del mismo peer.
+    """
+
+    def __init__(
+        self,
+        interface: str,
+        runner: Callable[[List[str]], str],
+        session_factory: Callable,
+        interval: float,
+        active_window: float,
+        on_poll: Optional[Callable] = None,
+        label: Optional[str] = None,
+        active: Optional[Callable[[], bool]] = None,
+        store: Optional[LocalStore] = None,
+    ):
+        self.interface = interface
+        # Nombre con el que se guardan las sesiones en 'connection_logs.interface' (por defecto, la interfaz).
+        self.label = label or interface
+        self.runner = runner
+        self.session_factory = session_factory
+        self.interval = interval
+        self.active_window = active_window
+        # Se llama con una sesión de base de datos después de guardar cada lectura.
+        self.on_poll = on_poll
+        self.active = active
+        self.store = store
+        self._previous: Optional[PeerSnapshot] = None
+        self._previous_at: Optional[float] = None
+        self._open: Dict[str, Optional[int]] = {}  # clave pública -> user_id de las sesiones abiertas
+        self._users: Dict[str, Optional[int]] = {}  # clave pública -> user_id (caché)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_poll = {}
+
+    def start(self):
+        if not self.interval or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"wg-telemetry-{self.interface}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.active and not self.active():
+                # Lee otro worker: al volver a leer, se parte de las sesiones que él dejó abiertas.
+                self.reset()
+                continue
+            try:
+                self.poll()
+            except WgCommandError as e:
+                print(f"Error al leer la telemetría de {self.interface}: {e}")
+            except Exception as e:
+                print(f"Error al guardar la telemetría de {self.interface}: {e}")
+
+    def reset(self):
+        """Olvida la lectura anterior: la siguiente vuelve a cargar las sesiones abiertas de la base de datos."""
+        with self._lock:
+            self._previous = None
+            self._previous_at = None
+            self._open = {}
+            self.last_poll = {}
+
+    def latest(self) -> dict:
+        """Última lectura: la de este worker o, si lee otro, la que publicó en el almacén local."""
+        if self.last_poll or not self.store:
+            return self.last_poll
+        try:
+            value = self.store.get(STORE_NAMESPACE, self.label)
+        except Exception as e:
+            print(f"Error al leer la telemetría publicada de {self.interface}: {e}")
+            return {}
+        return json.loads(value) if value else {}
+
+    def _publish(self, now: float):
+        if not self.store:
+            return
+        try:
+            self.store.set(STORE_NAMESPACE, self.label, json.dumps(self.last_poll), now + 3 * max(self.interval, 1))
+        except Exception as e:
+            print(f"Error al publicar la telemetría de {self.interface}: {e}")
+
+    def _insert_sessions(self, db, rows: List[dict]):
+        """Inserta las sesiones nuevas, omitiendo las que ya estén abiertas (ej. las abrió otro colector)."""
+        dialect = db.bind.dialect.name
+        if dialect == "sqlite":
+            stmt = sqlite.insert(connection_logs).on_conflict_do_nothing()
+        elif dialect == "postgresql":
+            stmt = postgresql.insert(connection_logs).on_conflict_do_nothing()
+        else:
+            stmt = insert(connection_logs)
+        db.execute(stmt, rows)
+
+    def _load_open_sessions(self, db):
+        stmt = select(ConnectionLog.public_key, ConnectionLog.user_id).where(
+            ConnectionLog.interface == self.label,
+            ConnectionLog.disconnected_at.is_(None),
+            ConnectionLog.public_key.isnot(None)
+        )
+        self._open = {public_key: user_id for public_key, user_id in db.execute(stmt)}
+
+    def _resolve_users(self, db, keys: List[str]):
+        for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+            chunk = keys[start:start + LOOKUP_CHUNK_SIZE]
+            stmt = select(User.wg_public_key, User.id).where(User.wg_public_key.in_(chunk))
+            found = dict(db.execute(stmt).all())
+            for key in chunk:
+                self._users[key] = found.get(key)
+
+    def poll(self, now: Optional[float] = None) -> dict:
+        """Hace una lectura completa y guarda los cambios. Retorna estadísticas de la lectura."""
+        with self._lock:
+            return self._poll(now)
+
+    def _poll(self, now: Optional[float]) -> dict:
+        started = time.perf_counter()
+        current = PeerSnapshot.parse(self.runner(["show", self.interface, "dump"]))
+        now = now or time.time()
+        threshold = now - self.active_window
+        previous = self._previous
+        first_poll = previous is None
+        if first_poll:
+            # Sesiones que quedaron abiertas en la base de datos (ej. antes de reiniciar).
+            with self.session_factory() as db:
+                self._load_open_sessions(db)
+
+        opened, changed = [], []
+        transferred = 0
+        for key, i in current.index.items():
+            last_handshake = current.handshake[i]
+            online = last_handshake > 0 and last_handshake >= threshold
+
+            # Bytes desde la lectura anterior. Si el contador bajó, el peer se re-creó.
+            j = previous.index.get(key) if previous else None
+            if j is not None and current.rx[i] >= previous.rx[j] and current.tx[i] >= previous.tx[j]:
+                rx, tx = current.rx[i] - previous.rx[j], current.tx[i] - previous.tx[j]
+            elif first_poll:
+                rx = tx = 0
+            else:
+                rx, tx = current.rx[i], current.tx[i]
+            transferred += rx + tx
+
+            if online and key not in self._open:
+                opened.append((key, datetime.utcfromtimestamp(last_handshake), rx, tx))
+            elif key in self._open and (rx or tx or not online):
+                closed_at = None if online else datetime.utcfromtimestamp(last_handshake or now)
+                changed.append({"b_key": key, "b_rx": rx, "b_tx": tx, "b_closed": closed_at})
+
+        # Peers con sesión abierta que ya no están en la interfaz.
+        closed_at = datetime.utcfromtimestamp(now)
+        for key in self._open:
+            if key not in current.index:
+                changed.append({"b_key": key, "b_rx": 0, "b_tx": 0, "b_closed": closed_at})
+
+        with self.session_factory() as db:
+            unknown = [row[0] for row in opened if row[0] not in self._users]
+            if unknown:
+                self._resolve_users(db, unknown)
+
+            if opened:
+                self._insert_sessions(db, [
+                    {
+                        "user_id": self._users.get(key),
+                        "public_key": key,
+                        "interface": self.label,
+                        "connected_at": connected_at,
+                        "rx_bytes": rx,
+                        "tx_bytes": tx,
+                    }
+                    for key, connected_at, rx, tx in opened
+                ])
+            if changed:
+                db.execute(
+                    update(connection_logs)
+                    .where(
+                        connection_logs.c.public_key == bindparam("b_key"),
+                        connection_logs.c.interface == self.label,
+                        connection_logs.c.disconnected_at.is_(None)
+                    )
+                    .values(
+                        rx_bytes=connection_logs.c.rx_bytes + bindparam("b_rx"),
+                        tx_bytes=connection_logs.c.tx_bytes + bindparam("b_tx"),
+                        disconnected_at=bindparam("b_closed")
+                    ),
+                    changed
+                )
+            db.commit()
+            if self.on_poll and changed:
+                try:
+                    self.on_poll(db)
+                except Exception as e:
+                    db.rollback()
+                    print(f"Error al procesar la lectura de telemetría de {self.interface}: {e}")
+
+        for key, _, _, _ in opened:
+            self._open[key] = self._users.get(key)
+        closed = 0
+        for row in changed:
+            if row["b_closed"] is not None:
+                self._open.pop(row["b_key"], None)
+                closed += 1
+        # Solo se recuerdan los usuarios de peers que siguen en la interfaz.
+        if len(self._users) > len(current):
+            self._users = {key: user_id for key, user_id in self._users.items() if key in current.index}
+        elapsed = now - self._previous_at if self._previous_at else 0
+        self._previous = current
+        self._previous_at = now
+
+        self.last_poll = {
+            "peers": len(current),
+            "opened": len(opened),
+            "closed": closed,
+            "updated": len(changed) - closed,
+            "open_sessions": len(self._open),
+            # Tráfico total de la interfaz desde la lectura anterior.
+            "bytes_per_s": transferred / elapsed if elapsed > 0 else 0.0,
+            "duration_s": time.perf_counter() - started,
+        }
+        self._publish(now)
+        return self.last_poll
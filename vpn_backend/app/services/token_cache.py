@@ -0,0 +1,113 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from ..core.local_store import LocalStore
+
+STORE_NAMESPACE = "verified_token"
+
+
+class TokenCache:
+    """
+    Caché LRU de tokens de Firebase ya verificados.
+
+    La clave es el SHA-256 del token (el token nunca se guarda) y cada entrada
+    caduca en el 'exp' del propio token. Opcionalmente se apoya en un LocalStore
+    para que los demás workers de la máquina reutilicen la verificación.
+    """
+
+    def __init__(self, max_entries: int, store: Optional[LocalStore] = None):
+        self.max_entries = max(max_entries, 1)
+        self.store = store
+        self._entries = OrderedDict()  # clave -> (claims, expira_en)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(id_token: str) -> str:
+        return hashlib.sha256(id_token.encode()).hexdigest()
+
+    def _remember(self, key: str, claims: dict, expires_at: float):
+        with self._lock:
+            self._entries[key] = (claims, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_local(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                claims, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return claims
+                del self._entries[key]
+        return None
+
+    def get_local(self, id_token: str) -> Optional[dict]:
+        """
+        Como 'get', pero solo en la memoria de este worker (no accede al almacén ni
+        cuenta el fallo). Se usa desde el bucle de eventos antes de pasar a un hilo.
+        """
+        return self._get_local(self._key(id_token))
+
+    def get(self, id_token: str) -> Optional[dict]:
+        """Retorna los claims verificados del token, o None si no está en caché o caducó."""
+        key = self._key(id_token)
+        claims = self._get_local(key)
+        if claims:
+            return claims
+
+        if self.store:
+            try:
+                value = self.store.get(STORE_NAMESPACE, key)
+            except Exception as e:
+                print(f"Error al leer la caché compartida de tokens: {e}")
+                value = None
+            if value:
+                claims = json.loads(value)
+                self._remember(key, claims, float(claims["exp"]))
+                with self._lock:
+                    self.hits += 1
+                    self.shared_hits += 1
+                return claims
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, id_token: str, claims: dict):
+        """Guarda los claims de un token recién verificado hasta su expiración."""
+        expires_at = claims.get("exp")
+        if not expires_at or expires_at <= time.time():
+            return
+        key = self._key(id_token)
+        self._remember(key, claims, float(expires_at))
+        if self.store:
+            try:
+                self.store.set(STORE_NAMESPACE, key, json.dumps(claims), float(expires_at))
+            except Exception as e:
+                print(f"Error al escribir la caché compartida de tokens: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": hits,
+                "shared_hits": self.shared_hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            }
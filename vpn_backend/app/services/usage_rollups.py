@@ -0,0 +1,226 @@
+import argparse
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Tuple
+
+from sqlalchemy import bindparam, delete, func, insert, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from ..db.models import ConnectionLog, UsageRollup
+
+GRANULARITIES = ("hour", "day", "month")
+# Sesiones cerradas que se procesan por bloque (y por transacción).
+CHUNK_SIZE = 5000
+
+usage_rollups = UsageRollup.__table__
+connection_logs = ConnectionLog.__table__
+
+BucketKey = Tuple[str, str, str, datetime]
+
+# Con varios colectores en el mismo proceso, evita que dos hilos sumen las mismas sesiones.
+_refresh_lock = threading.Lock()
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    """Inicio del intervalo (hora, día o mes) al que pertenece 'moment'."""
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "month":
+        return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Granularidad no válida: {granularity}")
+
+
+def next_bucket(start: datetime, granularity: str) -> datetime:
+    """Inicio del intervalo siguiente al que empieza en 'start'."""
+    if granularity == "hour":
+        return start + timedelta(hours=1)
+    if granularity == "day":
+        return start + timedelta(days=1)
+    if granularity == "month":
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    raise ValueError(f"Granularidad no válida: {granularity}")
+
+
+def split_session(
+    connected_at: datetime, disconnected_at: datetime, rx: int, tx: int, granularity: str
+) -> Iterator[Tuple[datetime, int, int, int, int]]:
+    """
+    Reparte una sesión entre los intervalos que abarca, en proporción al tiempo que
+    pasó en cada uno. Retorna (inicio del intervalo, sesiones, rx, tx, segundos) por
+    intervalo; la sesión se cuenta solo en el intervalo en que empezó. Se redondea
+    sobre el acumulado, así que las partes suman exactamente los totales.
+    """
+    start = bucket_start(connected_at, granularity)
+    duration = (disconnected_at - connected_at).total_seconds()
+    if duration <= 0:
+        yield start, 1, rx, tx, 0
+        return
+    seconds = int(duration)
+    sessions = 1
+    elapsed = 0.0
+    given_rx = given_tx = given_seconds = 0
+    while start < disconnected_at:
+        end = next_bucket(start, granularity)
+        if end >= disconnected_at:
+            fraction = 1.0
+        else:
+            elapsed += (end - max(start, connected_at)).total_seconds()
+            fraction = elapsed / duration
+        part_rx, part_tx, part_seconds = round(rx * fraction), round(tx * fraction), round(seconds * fraction)
+        yield start, sessions, part_rx - given_rx, part_tx - given_tx, part_seconds - given_seconds
+        given_rx, given_tx, given_seconds = part_rx, part_tx, part_seconds
+        sessions = 0
+        start = end
+
+
+def _apply(db: Session, totals: Dict[BucketKey, list]):
+    """Suma los totales a los resúmenes existentes e inserta los intervalos nuevos."""
+    keys = list(totals)
+    existing = set()
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        stmt = select(
+            UsageRollup.scope, UsageRollup.scope_id, UsageRollup.granularity, UsageRollup.bucket_start
+        ).where(
+            tuple_(UsageRollup.scope, UsageRollup.scope_id, UsageRollup.granularity, UsageRollup.bucket_start).in_(chunk)
+        )
+        existing.update(tuple(row) for row in db.execute(stmt))
+
+    updates = []
+    inserts = []
+    for key, (sessions, rx, tx, seconds) in totals.items():
+        scope, scope_id, granularity, start = key
+        if key in existing:
+            updates.append({
+                "b_scope": scope, "b_scope_id": scope_id, "b_granularity": granularity, "b_start": start,
+                "b_sessions": sessions, "b_rx": rx, "b_tx": tx, "b_seconds": seconds,
+            })
+        else:
+            inserts.append({
+                "scope": scope, "scope_id": scope_id, "granularity": granularity, "bucket_start": start,
+                "sessions": sessions, "rx_bytes": rx, "tx_bytes": tx, "seconds": seconds,
+            })
+
+    if updates:
+        db.execute(
+            update(usage_rollups)
+            .where(
+                usage_rollups.c.scope == bindparam("b_scope"),
+                usage_rollups.c.scope_id == bindparam("b_scope_id"),
+                usage_rollups.c.granularity == bindparam("b_granularity"),
+                usage_rollups.c.bucket_start == bindparam("b_start")
+            )
+            .values(
+                sessions=usage_rollups.c.sessions + bindparam("b_sessions"),
+                rx_bytes=usage_rollups.c.rx_bytes + bindparam("b_rx"),
+                tx_bytes=usage_rollups.c.tx_bytes + bindparam("b_tx"),
+                seconds=usage_rollups.c.seconds + bindparam("b_seconds")
+            ),
+            updates
+        )
+    if inserts:
+        db.execute(insert(usage_rollups), inserts)
+
+
+def _pending_logs(db: Session, after_id: int, chunk_size: int):
+    stmt = (
+        select(
+            ConnectionLog.id, ConnectionLog.user_id, ConnectionLog.interface,
+            ConnectionLog.connected_at, ConnectionLog.disconnected_at,
+            ConnectionLog.rx_bytes, ConnectionLog.tx_bytes
+        )
+        .where(
+            ConnectionLog.rolled_up.is_(False),
+            ConnectionLog.disconnected_at.isnot(None),
+            ConnectionLog.id > after_id
+        )
+        .order_by(ConnectionLog.id)
+        .limit(chunk_size)
+    )
+    # En PostgreSQL, dos procesos que actualicen a la vez se reparten las filas en vez de sumarlas dos veces.
+    if db.bind.dialect.name == "postgresql":
+        stmt = stmt.with_for_update(skip_locked=True)
+    return db.execute(stmt).all()
+
+
+def refresh_rollups(db: Session, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Suma a los resúmenes las sesiones cerradas que aún no se habían contado.
+
+    Recorre 'connection_logs' por id en bloques (paginación por cursor), sin
+    cargar la tabla en memoria. Cada bloque se suma y se marca como contado en
+    la misma transacción, así que un corte a mitad no cuenta nada dos veces.
+    Una sesión que abarca varios intervalos reparte sus bytes y segundos entre
+    ellos (ver 'split_session'). Retorna el número de sesiones procesadas.
+    """
+    with _refresh_lock:
+        return _refresh(db, chunk_size)
+
+
+def _refresh(db: Session, chunk_size: int) -> int:
+    processed = 0
+    last_id = 0
+    while True:
+        rows = _pending_logs(db, last_id, chunk_size)
+        if not rows:
+            db.commit()
+            return processed
+
+        totals: Dict[BucketKey, list] = defaultdict(lambda: [0, 0, 0, 0])
+        for _, user_id, interface, connected_at, disconnected_at, rx, tx in rows:
+            connected_at = connected_at or disconnected_at
+            scopes = [("server", interface or "")]
+            if user_id is not None:
+                scopes.append(("user", str(user_id)))
+            for granularity in GRANULARITIES:
+                for start, *parts in split_session(connected_at, disconnected_at, rx or 0, tx or 0, granularity):
+                    for scope, scope_id in scopes:
+                        total = totals[(scope, scope_id, granularity, start)]
+                        for i, value in enumerate(parts):
+                            total[i] += value
+
+        _apply(db, totals)
+        ids = [row[0] for row in rows]
+        db.execute(update(connection_logs).where(connection_logs.c.id.in_(ids)).values(rolled_up=True))
+        db.commit()
+        processed += len(rows)
+        last_id = ids[-1]
+
+
+def rebuild_rollups(db: Session, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Borra los resúmenes y los recalcula desde cero recorriendo todo el historial en bloques.
+    Las marcas 'rolled_up' se reinician por rangos de id para no bloquear la tabla entera.
+    Debe ejecutarse con el colector de telemetría detenido.
+    """
+    db.execute(delete(usage_rollups))
+    db.commit()
+    max_id = db.execute(select(func.max(ConnectionLog.id))).scalar() or 0
+    for start in range(0, max_id + 1, chunk_size):
+        db.execute(
+            update(connection_logs)
+            .where(connection_logs.c.id > start, connection_logs.c.id <= start + chunk_size)
+            .values(rolled_up=False)
+        )
+        db.commit()
+    return refresh_rollups(db, chunk_size)
+
+
+if __name__ == "__main__":
+    from ..db.database import SessionLocal, create_db_tables
+
+    parser = argparse.ArgumentParser(description="Actualiza los resúmenes de uso a partir de 'connection_logs'.")
+    parser.add_argument("--rebuild", action="store_true", help="borra los resúmenes y los recalcula desde cero")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    create_db_tables()
+    with SessionLocal() as db:
+        if args.rebuild:
+            count = rebuild_rollups(db, args.chunk_size)
+        else:
+            count = refresh_rollups(db, args.chunk_size)
+    print(f"Sesiones procesadas: {count}")
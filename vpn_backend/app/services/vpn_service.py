@@ -1,6 +1,20 @@
+import asyncio
 import subprocess
 import os
-import re
+import base64
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional
+from ..core.config import settings
+from ..core.local_store import Lease, local_store
+from ..core.metrics import WG_COMMAND_FAILURES, stage
+from ..db.database import SessionLocal
+from .key_pool import KeyPairPool
+from .peer_reconciler import PEER_CHANGE_TIMEOUT
+from .admission import user_operations
+from .config_cache import ConfigCache
+from .nodes import NodeRegistry, NodeRuntime
 
 # ¡IMPORTANTE!: Estas rutas son estándar en Linux.
 # Necesitas configurar tu servidor WireGuard en /etc/wireguard/wg0.conf en Linux/WSL
@@ -8,7 +22,34 @@ WIREGUARD_CONFIG_PATH = "/etc/wireguard/"
 SERVER_CONFIG_FILE = "wg0.conf"
 
 def generate_key_pair():
-    """Genera un par de claves privada y pública para WireGuard."""
+    """
+    Retorna un par de claves (privada, pública) para WireGuard.
+    Toma un par ya generado del pool; si está vacío lo genera en el momento.
+    """
+    with stage("keygen"):
+        return key_pool.get()
+
+def generate_key_pair_local():
+    """
+    Genera un par de claves Curve25519 en el propio proceso, sin llamar a 'wg'.
+    El resultado tiene el mismo formato base64 que 'wg genkey' / 'wg pubkey'.
+    """
+    raw = bytearray(os.urandom(32))
+    # Mismo "clamping" que aplica 'wg genkey' a la clave privada.
+    raw[0] &= 248
+    raw[31] = (raw[31] & 127) | 64
+    private_key = X25519PrivateKey.from_private_bytes(bytes(raw))
+    public_raw = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+    return base64.b64encode(bytes(raw)).decode(), base64.b64encode(public_raw).decode()
+
+# Pool de pares de claves pre-generados que se rellena en segundo plano.
+key_pool = KeyPairPool(generate_key_pair_local, settings.WG_KEY_POOL_SIZE)
+
+def generate_key_pair_subprocess():
+    """Genera un par de claves privada y pública para WireGuard con el comando 'wg'."""
     try:
         # Genera la clave privada
         private_key = subprocess.run(
@@ -30,54 +71,90 @@ def generate_key_pair():
         return private_key, public_key
     except FileNotFoundError:
         # Esto ocurrirá en Windows si no usas WSL
+        WG_COMMAND_FAILURES.inc("genkey")
         print("ERROR: El comando 'wg' no fue encontrado. Asegúrate de tener WireGuard instalado en Linux/WSL.")
         return None, None
     except subprocess.CalledProcessError as e:
+        WG_COMMAND_FAILURES.inc(e.cmd[1] if len(e.cmd) > 1 else "genkey")
         print(f"Error al generar las claves de WireGuard: {e}")
         return None, None
 
-def get_next_available_ip(used_ips: list) -> str:
-    """Busca la próxima IP disponible en el rango 10.0.0.X."""
-    base_ip = "10.0.0."
-    for i in range(2, 255): # Empieza desde .2 para evitar conflictos.
-        ip_candidate = f"{base_ip}{i}"
-        if ip_candidate not in used_ips:
-            return ip_candidate
-    return None # No hay IPs disponibles
+# Configuraciones de cliente ya generadas, por usuario.
+config_cache = ConfigCache(
+    settings.CONFIG_CACHE_SIZE,
+    settings.CONFIG_CACHE_TTL,
+    store=local_store if settings.CONFIG_CACHE_SHARED else None
+)
 
-def add_peer_to_server(public_key: str, client_ip: str):
+# Nodos de WireGuard: cada uno con su asignador de IPs, su reconciliador de peers en lotes,
+# su colector de telemetría y su reaper de peers inactivos. La telemetría la lee un solo
+# worker por máquina, el que tiene la concesión "wg-nodes" del almacén local.
+node_registry = NodeRegistry(
+    SessionLocal,
+    strategy=settings.WG_PLACEMENT_STRATEGY,
+    refresh_interval=settings.WG_NODE_REFRESH_INTERVAL,
+    on_change=config_cache.invalidate,
+    busy_users=user_operations.busy,
+    lease=Lease(local_store, "wg-nodes", settings.WG_BACKGROUND_LEASE_TTL)
+)
+
+def _wait_peer_change(future) -> bool:
+    try:
+        return future.result(timeout=PEER_CHANGE_TIMEOUT)
+    except FutureTimeoutError:
+        print("Error: el cambio de peer en WireGuard no se aplicó a tiempo.")
+        return False
+
+def add_peer_to_server(node: NodeRuntime, public_key: str, client_ip: str):
     """
-    Añade un nuevo peer a la configuración del servidor de WireGuard usando 'sudo wg set'.
+    Añade un nuevo peer a la configuración del servidor de WireGuard del nodo.
+    El cambio se agrupa con otros en un solo 'wg set' y se espera su resultado.
     REQUIERE PRIVILEGIOS DE ROOT (sudo) y LINUX.
     """
-    try:
-        # El comando 'wg' para añadir un peer sin reiniciar la interfaz
-        subprocess.run(
-            ["sudo", "wg", "set", "wg0", "peer", public_key, "allowed-ips", f"{client_ip}/32"],
-            check=True
-        )
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"Error al añadir peer a WireGuard: {e}")
-        return False
+    return _wait_peer_change(node.reconciler.submit(public_key, client_ip))
 
-def remove_peer_from_server(public_key: str):
+def remove_peer_from_server(node: NodeRuntime, public_key: str):
     """
-    Elimina un peer de la configuración del servidor de WireGuard.
+    Elimina un peer de la configuración del servidor de WireGuard del nodo.
+    El cambio se agrupa con otros en un solo 'wg set' y se espera su resultado.
     REQUIERE PRIVILEGIOS DE ROOT (sudo) y LINUX.
     """
+    return _wait_peer_change(node.reconciler.submit(public_key, None))
+
+async def _submit_peer_change_async(node: NodeRuntime, public_key: str, client_ip) -> bool:
+    reconciler = node.reconciler
+    if reconciler.running:
+        future = reconciler.submit(public_key, client_ip)
+    else:
+        # Sin el hilo del reconciliador el cambio se aplica en el momento; se hace fuera del bucle de eventos.
+        future = await asyncio.get_running_loop().run_in_executor(None, reconciler.submit, public_key, client_ip)
     try:
-        # El comando 'wg' para eliminar un peer
-        subprocess.run(
-            ["sudo", "wg", "set", "wg0", "peer", public_key, "remove"],
-            check=True
-        )
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"Error al eliminar peer de WireGuard: {e}")
+        with stage("wg_peer_change"):
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=PEER_CHANGE_TIMEOUT)
+    except asyncio.TimeoutError:
+        print("Error: el cambio de peer en WireGuard no se aplicó a tiempo.")
         return False
-        
-def create_client_config(private_key: str, client_ip: str, server_public_key: str, server_ip: str) -> str:
+
+async def add_peer_to_server_async(node: NodeRuntime, public_key: str, client_ip: str):
+    """
+    Versión asíncrona de 'add_peer_to_server': espera el lote sin ocupar un hilo.
+    """
+    return await _submit_peer_change_async(node, public_key, client_ip)
+
+async def remove_peer_from_server_async(node: NodeRuntime, public_key: str):
+    """
+    Versión asíncrona de 'remove_peer_from_server': espera el lote sin ocupar un hilo.
+    """
+    return await _submit_peer_change_async(node, public_key, None)
+
+def create_client_config(
+    private_key: str,
+    client_ip: str,
+    server_public_key: str,
+    server_ip: str,
+    server_port: int = 51820,
+    dns: str = "8.8.8.8, 8.8.4.4"
+) -> str:
     """
     Genera el archivo de configuración .conf para un cliente de WireGuard.
     """
@@ -85,13 +162,22 @@ def create_client_config(private_key: str, client_ip: str, server_public_key: st
 [Interface]
 PrivateKey = {private_key}
 Address = {client_ip}/32
-DNS = 8.8.8.8, 8.8.4.4
+DNS = {dns}
 # PersistentKeepalive mantiene el túnel activo
 
 [Peer]
 PublicKey = {server_public_key}
-Endpoint = {server_ip}:51820
+Endpoint = {server_ip}:{server_port}
 AllowedIPs = 0.0.0.0/0
 PersistentKeepalive = 25
 """
-    return client_conf
\ No newline at end of file
+    return client_conf
+
+def render_client_config(username: str, node: NodeRuntime, private_key: str, client_ip: str, read_at: Optional[float] = None):
+    """
+    Genera la configuración del cliente con los datos del servidor de su nodo y la guarda en la caché.
+    'read_at' es el momento en que se leyó el usuario de la base de datos. Retorna el ConfigArtifact.
+    """
+    with stage("render_config"):
+        client_config = create_client_config(private_key, client_ip, node.public_key, node.endpoint, node.port, node.dns)
+    return config_cache.put(username, node.config_version, client_config, read_at)
@@ -0,0 +1,99 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from ..core.config import settings
+from .peer_reconciler import WgCommandError, WgRunner, WgUnavailable
+
+# Un driver es cualquier objeto invocable que recibe los argumentos de 'wg' y
+# retorna su salida (lanza WgCommandError si falla). Así un mismo proceso de la
+# API puede gestionar nodos locales, remotos o simulados.
+WgDriver = Callable[[List[str]], str]
+
+
+class FakeDriver:
+    """
+    Nodo de WireGuard simulado en memoria, para pruebas.
+    Entiende 'wg set <if> peer ...' y 'wg show <if> dump', igual que benchmarks/fake_wg.py.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.interfaces: Dict[str, Dict[str, dict]] = {}
+        # Claves cuyo 'set' debe fallar.
+        self.fail_keys = set()
+        # Simula un nodo que no responde.
+        self.down = False
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, args: List[str]) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        if self.down:
+            raise WgUnavailable("El nodo no responde.")
+        with self._lock:
+            self.calls += 1
+            if len(args) >= 2 and args[0] == "set":
+                return self._set(args[1], args[2:])
+            if len(args) == 3 and args[0] == "show" and args[2] == "dump":
+                return self._dump(args[1])
+        raise WgCommandError(f"Comando no soportado: {' '.join(args)}")
+
+    def _set(self, interface: str, args: List[str]) -> str:
+        changes = []
+        i = 0
+        while i < len(args):
+            if args[i] != "peer" or i + 2 >= len(args):
+                raise WgCommandError(f"Argumento inesperado: {args[i]}")
+            key = args[i + 1]
+            if key in self.fail_keys:
+                raise WgCommandError(f"No se pudo aplicar el peer {key}")
+            if args[i + 2:i + 3] == ["remove"]:
+                changes.append((key, None))
+                i += 3
+            elif args[i + 2:i + 3] == ["allowed-ips"] and i + 3 < len(args):
+                changes.append((key, args[i + 3]))
+                i += 4
+            else:
+                raise WgCommandError(f"Argumento inesperado para el peer {key}")
+
+        peers = self.interfaces.setdefault(interface, {})
+        for key, allowed_ips in changes:
+            if allowed_ips is None:
+                peers.pop(key, None)
+            else:
+                peer = peers.setdefault(key, {"handshake": 0, "rx": 0, "tx": 0})
+                peer["allowed_ips"] = allowed_ips
+        return ""
+
+    def _dump(self, interface: str) -> str:
+        lines = ["(hidden)\t(hidden)\t51820\toff"]
+        for key, peer in self.interfaces.get(interface, {}).items():
+            lines.append(
+                f"{key}\t(none)\t(none)\t{peer['allowed_ips']}\t{peer['handshake']}\t{peer['rx']}\t{peer['tx']}\t25"
+            )
+        return "\n".join(lines) + "\n"
+
+
+def create_driver(kind: str, target: Optional[str] = None) -> WgDriver:
+    """
+    Crea el driver de un nodo.
+        local: ejecuta 'wg' en esta máquina ('target' es el comando, por defecto WG_COMMAND).
+        ssh:   ejecuta WG_REMOTE_COMMAND en el host 'target' por SSH.
+        fake:  nodo simulado en memoria.
+    """
+    if kind == "local":
+        return WgRunner(target or settings.WG_COMMAND, timeout=settings.WG_COMMAND_TIMEOUT)
+    if kind == "ssh":
+        if not target:
+            raise ValueError("El driver 'ssh' necesita un host.")
+        # ssh sale con 255 si no consigue conectar o autenticarse.
+        return WgRunner(
+            f"ssh -o BatchMode=yes -o ConnectTimeout={settings.WG_SSH_CONNECT_TIMEOUT} {target} {settings.WG_REMOTE_COMMAND}",
+            timeout=settings.WG_SSH_CONNECT_TIMEOUT + settings.WG_COMMAND_TIMEOUT,
+            unavailable_codes=(255,)
+        )
+    if kind == "fake":
+        return FakeDriver()
+    raise ValueError(f"Driver de WireGuard desconocido: {kind}")
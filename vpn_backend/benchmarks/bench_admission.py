@@ -0,0 +1,211 @@
+"""
+Mide la coalescencia por usuario y el control de admisión de /vpn/connect y
+/vpn/disconnect, dentro del proceso (como bench_async: 'wg' falso y verificador de
+tokens falso).
+
+Escenarios:
+  duplicates  cada usuario nuevo envía --duplicates connect a la vez
+  pairs       cada usuario nuevo envía connect y disconnect a la vez
+  rate_limit  un usuario repite connect/disconnect seguidos con los límites de --user-burst/--user-rate
+
+Los dos primeros se ejecutan con la coalescencia ('coalesced') y sin ella ('direct',
+cada petición hace su propia operación) y comprueban al final que la base de datos y
+la interfaz coinciden: peers de más en 'wg' o usuarios con claves sin peer.
+
+Uso (desde vpn_backend/):
+    python -m benchmarks.bench_admission --users 200 --duplicates 5 --output admission.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from benchmarks.bench_async import configure_environment, reset_state
+from benchmarks.results import summarize, write_results
+
+
+class DirectOperations:
+    """Sin coalescencia: cada petición ejecuta su operación, como antes."""
+
+    async def run(self, key, operation, func):
+        return await func()
+
+
+def wg_peers() -> set:
+    path = os.environ["FAKE_WG_STATE"]
+    if not os.path.exists(path):
+        return set()
+    with open(path) as handle:
+        content = handle.read()
+    state = json.loads(content) if content else {}
+    return {key for peers in state.values() for key in peers}
+
+
+def check_consistency() -> dict:
+    """Compara las claves públicas guardadas con los peers de la interfaz falsa."""
+    from sqlalchemy import select
+
+    from app.db.database import SessionLocal
+    from app.db.models import User
+
+    with SessionLocal() as db:
+        keys = {key for (key,) in db.execute(select(User.wg_public_key).where(User.wg_public_key.isnot(None)))}
+    peers = wg_peers()
+    return {
+        "connected_users": len(keys),
+        "wg_peers": len(peers),
+        "orphan_peers": len(peers - keys),
+        "users_without_peer": len(keys - peers),
+    }
+
+
+async def send(client, path: str, username: str, latencies: list, statuses: dict):
+    started = time.perf_counter()
+    response = await client.post(path, json={"id_token": username})
+    latencies.append(time.perf_counter() - started)
+    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+async def drive(app, requests: list, concurrency: int) -> dict:
+    """Envía las peticiones [(ruta, usuario), ...] a la vez, con un máximo de 'concurrency' en curso."""
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=120) as client:
+        async def one(path: str, username: str):
+            async with semaphore:
+                await send(client, path, username, latencies, statuses)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(path, username) for path, username in requests))
+        elapsed = time.perf_counter() - started
+    return {
+        "requests": len(requests),
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "elapsed_s": elapsed,
+        "throughput_rps": len(requests) / elapsed,
+        "latency": summarize(latencies),
+    }
+
+
+async def scenario(app, mode: str, name: str, users: int, duplicates: int, concurrency: int) -> dict:
+    from app.api import routes
+    from app.services import admission
+    from app.services.vpn_service import config_cache, node_registry
+
+    routes.user_operations = admission.user_operations if mode == "coalesced" else DirectOperations()
+    reset_state(users)
+    usernames = [f"user{i}@bench" for i in range(users)]
+    config_cache.invalidate(usernames)
+    if name == "pairs":
+        requests = [(path, username) for username in usernames for path in ("/vpn/connect", "/vpn/disconnect")]
+    else:
+        requests = [("/vpn/connect", username) for username in usernames for _ in range(duplicates)]
+
+    applied = sum(node.reconciler.peers_applied for node in node_registry.nodes())
+    coalesced = admission.user_operations.coalesced + admission.user_operations.serialized
+    result = await drive(app, requests, concurrency)
+    result["peer_changes"] = sum(node.reconciler.peers_applied for node in node_registry.nodes()) - applied
+    if mode == "coalesced":
+        result["coalesced"] = admission.user_operations.coalesced + admission.user_operations.serialized - coalesced
+    result.update(check_consistency())
+    return result
+
+
+async def rate_limit(app, cycles: int, user_rate: float, user_burst: int) -> dict:
+    from app.api import routes
+    from app.services import admission
+
+    routes.user_operations = admission.user_operations
+    admission.user_limiter = admission.TokenBucketLimiter("user", user_rate, user_burst)
+    reset_state(1)
+    requests = [(path, "user0@bench") for _ in range(cycles) for path in ("/vpn/connect", "/vpn/disconnect")]
+
+    async def sequential():
+        import httpx
+
+        latencies, statuses = [], {}
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            started = time.perf_counter()
+            for path, username in requests:
+                await send(client, path, username, latencies, statuses)
+            elapsed = time.perf_counter() - started
+        return {
+            "requests": len(requests),
+            "statuses": {str(code): count for code, count in sorted(statuses.items())},
+            "elapsed_s": elapsed,
+            "latency": summarize(latencies),
+        }
+
+    result = await sequential()
+    result["admitted"] = admission.user_limiter.admitted
+    result["rejected"] = admission.user_limiter.rejected
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--duplicates", type=int, default=5, help="Connect simultáneos por usuario.")
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--wg-latency-ms", type=int, default=20)
+    parser.add_argument("--cycles", type=int, default=20, help="Ciclos connect/disconnect del escenario rate_limit.")
+    parser.add_argument("--user-burst", type=int, default=5)
+    parser.add_argument("--user-rate", type=float, default=0.1)
+    parser.add_argument("--output", help="Fichero donde guardar los resultados en JSON.")
+    args = parser.parse_args()
+
+    # Los límites se desactivan para medir solo la coalescencia; 'rate_limit' usa los suyos.
+    os.environ.setdefault("RATE_LIMIT_USER_PER_SECOND", "0")
+    configure_environment(args.wg_latency_ms)
+    from fastapi import FastAPI
+
+    from app.api import routes
+    from app.services.vpn_service import key_pool, node_registry
+
+    async def fake_verify_async(id_token: str) -> dict:
+        return {"email": id_token}
+
+    routes.verify_token_async = fake_verify_async
+    app = FastAPI()
+    app.include_router(routes.router)
+
+    async def run_all() -> dict:
+        # Un solo bucle de eventos: el pool del motor asíncrono queda ligado al primero.
+        results = {}
+        for name in ("duplicates", "pairs"):
+            results[name] = {
+                mode: await scenario(app, mode, name, args.users, args.duplicates, args.concurrency)
+                for mode in ("direct", "coalesced")
+            }
+        results["rate_limit"] = await rate_limit(app, args.cycles, args.user_rate, args.user_burst)
+        return results
+
+    key_pool.start()
+    node_registry.start()
+    try:
+        results = asyncio.run(run_all())
+    finally:
+        node_registry.stop()
+        key_pool.stop()
+
+    write_results(
+        "admission",
+        results,
+        {
+            "users": args.users,
+            "duplicates": args.duplicates,
+            "concurrency": args.concurrency,
+            "wg_latency_ms": args.wg_latency_ms,
+            "cycles": args.cycles,
+            "user_burst": args.user_burst,
+            "user_rate": args.user_rate,
+        },
+        args.output
+    )
+
+
+if __name__ == "__main__":
+    main()
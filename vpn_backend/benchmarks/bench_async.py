@@ -0,0 +1,170 @@
+"""
+Compara /vpn/connect asíncrono con una réplica síncrona (handler 'def' en el
+threadpool, como antes) con muchas conexiones concurrentes de usuarios nuevos.
+
+Usa benchmarks/fake_wg.py con latencia artificial y un verificador de tokens
+falso, así que no necesita root, WireGuard ni Firebase.
+
+Uso (desde vpn_backend/):
+    python -m benchmarks.bench_async --users 1000 --concurrency 1000 --wg-latency-ms 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def configure_environment(wg_latency_ms: int) -> str:
+    """Debe llamarse antes de importar 'app': la configuración se lee al importar."""
+    from cryptography.fernet import Fernet
+
+    workdir = tempfile.mkdtemp(prefix="bench_async_")
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ.setdefault("ENCRYPTION_KEYS", Fernet.generate_key().decode())
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ["LOCAL_STORE_PATH"] = f"{workdir}/local_store.db"
+    # Se miden ráfagas de usuarios nuevos: sin límite global de admisión.
+    os.environ.setdefault("RATE_LIMIT_GLOBAL_PER_SECOND", "0")
+    os.environ["WG_COMMAND"] = f"{sys.executable} {os.path.join(BENCH_DIR, 'fake_wg.py')}"
+    os.environ["WG_CLIENT_CIDR"] = "10.8.0.0/16"
+    os.environ["WG_RECONCILE_INTERVAL"] = "0"
+    os.environ["TELEMETRY_INTERVAL"] = "0"
+    os.environ["WG_REAPER_INTERVAL"] = "0"
+    os.environ["WG_NODE_REFRESH_INTERVAL"] = "0"
+    os.environ["FAKE_WG_STATE"] = f"{workdir}/wg.json"
+    os.environ["FAKE_WG_LATENCY_MS"] = str(wg_latency_ms)
+    return workdir
+
+
+def build_apps():
+    from fastapi import Depends, FastAPI, HTTPException, Response
+    from sqlalchemy.orm import Session
+
+    from app.api import routes
+    from app.db.database import SessionLocal
+    from app.core.config import settings
+    from app.db.models import User
+    from app.services.vpn_service import add_peer_to_server, create_client_config, generate_key_pair, node_registry
+
+    async def fake_verify_async(id_token: str) -> dict:
+        return {"email": id_token}
+
+    routes.verify_token_async = fake_verify_async
+    async_app = FastAPI()
+    async_app.include_router(routes.router)
+
+    def get_sync_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    # Réplica del handler síncrono anterior: ocupa un hilo del threadpool durante toda la petición.
+    sync_app = FastAPI()
+
+    @sync_app.post("/vpn/connect")
+    def connect_vpn_sync(token: routes.Token, db: Session = Depends(get_sync_db)):
+        db_user = db.query(User).filter(User.username == token.id_token).first()
+        if not db_user.wg_public_key:
+            node = node_registry.node_for(settings.WG_NODE_NAME)
+            private_key, public_key = generate_key_pair()
+            client_ip = node.pool.allocate()
+            db_user.wg_public_key = public_key
+            db_user.wg_private_key = private_key
+            db_user.wg_node = node.name
+            db_user.wg_ip_address = client_ip
+            db.commit()
+            if not add_peer_to_server(node, public_key, client_ip):
+                raise HTTPException(status_code=500)
+        config = create_client_config(db_user.wg_private_key, db_user.wg_ip_address, "server", "127.0.0.1")
+        return Response(content=config, media_type="application/octet-stream")
+
+    return {"sync": sync_app, "async": async_app}
+
+
+def reset_state(users: int):
+    from sqlalchemy import delete, insert
+
+    from app.db.database import SessionLocal, create_db_tables
+    from app.db.models import User
+    from app.services.vpn_service import node_registry
+
+    create_db_tables()
+    with SessionLocal() as db:
+        db.execute(delete(User))
+        db.execute(insert(User), [{"username": f"user{i}@bench", "hashed_password": "x"} for i in range(users)])
+        db.commit()
+        node_registry.load(db)
+    if os.path.exists(os.environ["FAKE_WG_STATE"]):
+        os.remove(os.environ["FAKE_WG_STATE"])
+
+
+async def drive(app, users: int, concurrency: int) -> dict:
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    in_flight = 0
+    peak = 0
+    latencies = []
+    errors = 0
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=120) as client:
+        async def one(i: int):
+            nonlocal in_flight, peak, errors
+            async with semaphore:
+                in_flight += 1
+                peak = max(peak, in_flight)
+                start = time.perf_counter()
+                response = await client.post("/vpn/connect", json={"id_token": f"user{i}@bench"})
+                latencies.append(time.perf_counter() - start)
+                in_flight -= 1
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(users)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": users,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "throughput_rps": users / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "peak_client_in_flight": peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--wg-latency-ms", type=int, default=50)
+    args = parser.parse_args()
+
+    configure_environment(args.wg_latency_ms)
+    from app.services.vpn_service import key_pool, node_registry
+
+    apps = build_apps()
+    key_pool.start()
+    node_registry.start()
+    results = {}
+    for name, app in apps.items():
+        reset_state(args.users)
+        results[name] = asyncio.run(drive(app, args.users, args.concurrency))
+    node_registry.stop()
+    key_pool.stop()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
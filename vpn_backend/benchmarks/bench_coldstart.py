@@ -0,0 +1,129 @@
+"""
+Mide el arranque en frío de un worker: cuánto tarda en importar app.main, en
+responder /healthz (acepta conexiones) y en responder /readyz (calentamiento
+terminado), con el desglose por tarea que publica el propio worker.
+
+La primera ejecución crea las tablas (primer despliegue); las siguientes
+reutilizan la base de datos, como un worker nuevo al escalar. Con --users, la
+base de datos se llena antes con usuarios con peer, para medir también la
+reconstrucción de los asignadores de IPs y la lectura del estado de los nodos.
+
+Uso (desde vpn_backend/):
+    python -m benchmarks.bench_coldstart --runs 5 --users 10000 --output coldstart.json
+"""
+import argparse
+import base64
+import ipaddress
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.bench_lifecycle import (
+    BACKEND_DIR, LocalTokenIssuer, build_environment, free_port, start_server, stop_server
+)
+from benchmarks.results import summarize, write_results
+
+IMPORT_SCRIPT = "import time; started = time.perf_counter(); import app.main; print(time.perf_counter() - started)"
+
+
+def measure_import(env: dict, runs: int) -> dict:
+    """Importa app.main en procesos nuevos: ya no tiene efectos secundarios, así que se puede medir aislado."""
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT],
+            cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return summarize(timings)
+
+
+def populate(database_url: str, users: int, cidr: str, node: str):
+    """Inserta usuarios con claves e IP en el nodo por defecto (las tablas ya deben existir)."""
+    from sqlalchemy import create_engine, insert
+
+    from app.db.models import User
+
+    hosts = ipaddress.ip_network(cidr).hosts()
+    next(hosts)  # La primera dirección útil es la del servidor.
+    engine = create_engine(database_url)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {
+                "username": f"user{i}@bench",
+                "hashed_password": "x",
+                "wg_node": node,
+                "wg_ip_address": str(next(hosts)),
+                "wg_public_key": base64.b64encode(os.urandom(32)).decode(),
+                "wg_private_key": base64.b64encode(os.urandom(32)).decode(),
+            }
+            for i in range(users)
+        ])
+    engine.dispose()
+
+
+def boot(env: dict, workers: int) -> dict:
+    process, startup = start_server(env, free_port(), workers)
+    stop_server(process)
+    worker = startup.pop("worker")
+    startup["import_s"] = worker["import_s"]
+    startup["ready_s"] = worker["ready_s"]
+    startup["components"] = {name: component["seconds"] for name, component in worker["components"].items()}
+    return startup
+
+
+def summarize_boots(boots: list) -> dict:
+    if not boots:
+        return {}
+    keys = ["healthz_s", "readyz_s", "import_s", "ready_s"]
+    summary = {key: summarize([boot[key] for boot in boots]) for key in keys}
+    summary["components"] = {
+        name: summarize([boot["components"][name] for boot in boots if boot["components"].get(name) is not None])
+        for name in boots[0]["components"]
+    }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Arranques después del primero.")
+    parser.add_argument("--import-runs", type=int, default=5)
+    parser.add_argument("--users", type=int, default=0, help="Usuarios con peer en la base de datos.")
+    parser.add_argument("--workers", type=int, default=1, help="Workers de uvicorn.")
+    parser.add_argument("--database-url", help="Base de datos a usar (por defecto, SQLite temporal).")
+    parser.add_argument("--async-database-url", help="URL con driver asíncrono, si no se puede derivar.")
+    parser.add_argument("--cidr", default="10.8.0.0/16")
+    parser.add_argument("--output", help="Fichero donde guardar los resultados en JSON.")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_coldstart_")
+    issuer = LocalTokenIssuer(workdir)
+    env = build_environment(workdir, issuer, args.database_url, args.async_database_url, args.cidr)
+    try:
+        results = {"import_app_main": measure_import(env, args.import_runs)}
+        results["first_boot"] = boot(env, args.workers)
+        if args.users:
+            populate(env["DATABASE_URL"], args.users, args.cidr, env.get("WG_NODE_NAME") or env.get("WG_INTERFACE", "wg0"))
+        boots = [boot(env, args.workers) for _ in range(args.runs)]
+        results["restart"] = summarize_boots(boots)
+    finally:
+        issuer.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    write_results(
+        "coldstart",
+        results,
+        {
+            "runs": args.runs,
+            "users": args.users,
+            "workers": args.workers,
+            "database": env["DATABASE_URL"].split("://")[0],
+        },
+        args.output
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Mide el coste por lectura del colector de telemetría con muchos peers.
+
+Genera salidas sintéticas de 'wg show wg0 dump' (sin WireGuard) en las que, en
+cada lectura, una parte de los peers se conecta o desconecta y el resto genera
+tráfico, y mide el tiempo y la memoria de cada 'poll'.
+
+Uso (desde vpn_backend/):
+    python -m benchmarks.bench_collector --peers 50000 --polls 5
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+
+def build_dump(keys: list, handshakes: list, rx: list, tx: list) -> str:
+    lines = ["privkey\tpubkey\t51820\toff"]
+    for i, key in enumerate(keys):
+        lines.append(f"{key}\t(none)\t1.2.3.4:5555\t10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}/32\t{handshakes[i]}\t{rx[i]}\t{tx[i]}\t25")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--peers", type=int, default=50000)
+    parser.add_argument("--polls", type=int, default=5)
+    parser.add_argument("--churn", type=float, default=0.05, help="fracción de peers que cambia de estado por lectura")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_collector_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ.setdefault("SECRET_KEY", "bench")
+
+    from app.db.database import SessionLocal, create_db_tables
+    from app.services.telemetry import TelemetryCollector
+
+    create_db_tables()
+    rng = random.Random(42)
+    keys = [f"{i:043d}=" for i in range(args.peers)]
+    now = time.time()
+    handshakes = [int(now) - rng.randint(0, 120) for _ in keys]
+    rx = [0] * args.peers
+    tx = [0] * args.peers
+
+    state = {"dump": build_dump(keys, handshakes, rx, tx)}
+    collector = TelemetryCollector("wg0", lambda _: state["dump"], SessionLocal, interval=0, active_window=180)
+
+    polls = []
+    tracemalloc.start()
+    for poll in range(args.polls):
+        now += 30
+        for i in range(args.peers):
+            if rng.random() < args.churn:
+                # Alterna entre desconectado (handshake antiguo) y conectado.
+                handshakes[i] = int(now) if handshakes[i] < now - 180 else int(now) - 3600
+            elif handshakes[i] >= now - 180:
+                handshakes[i] = int(now) - rng.randint(0, 60)
+                rx[i] += rng.randint(0, 1 << 20)
+                tx[i] += rng.randint(0, 1 << 18)
+        state["dump"] = build_dump(keys, handshakes, rx, tx)
+        tracemalloc.reset_peak()
+        result = collector.poll(now=now)
+        result["peak_mem_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+        polls.append(result)
+    tracemalloc.stop()
+
+    print(json.dumps({"peers": args.peers, "polls": polls}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Compara la generación de claves de WireGuard: subprocesos 'wg', en proceso y desde el pool.
+
+Uso (desde vpn_backend/):
+    python -m benchmarks.bench_keygen --iterations 200
+"""
+import argparse
+import json
+import shutil
+import time
+
+from app.services.key_pool import KeyPairPool
+from app.services.vpn_service import generate_key_pair_local, generate_key_pair_subprocess
+
+
+def measure(func, iterations: int) -> dict:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "iterations": iterations,
+        "mean_us": sum(timings) / len(timings) * 1e6,
+        "p50_us": timings[len(timings) // 2] * 1e6,
+        "p99_us": timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--pool-size", type=int, default=64)
+    args = parser.parse_args()
+
+    results = {"local": measure(generate_key_pair_local, args.iterations)}
+
+    if shutil.which("wg"):
+        results["subprocess"] = measure(generate_key_pair_subprocess, args.iterations)
+    else:
+        results["subprocess"] = "skipped: 'wg' not found on PATH"
+
+    pool = KeyPairPool(generate_key_pair_local, args.pool_size)
+    pool.start()
+    # Espera a que el pool esté lleno para medir el caso de "hit".
+    while pool.stats()["available"] < args.pool_size:
+        time.sleep(0.01)
+    results["pool"] = measure(pool.get, args.iterations)
+    results["pool"]["stats"] = pool.stats()
+    pool.stop()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
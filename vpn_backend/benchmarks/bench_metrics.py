@@ -0,0 +1,76 @@
+"""
+Mide el coste de la instrumentación: una etapa ('with stage(...)'), una
+observación de histograma y una petición con y sin MetricsMiddleware.
+
+Uso (desde vpn_backend/):
+    python -m benchmarks.bench_metrics --iterations 200000 --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+
+def per_call_ns(func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+async def requests_per_s(app, requests: int) -> float:
+    import httpx
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        start = time.perf_counter()
+        for _ in range(requests):
+            await client.get("/")
+        return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    from fastapi import FastAPI
+
+    from app.core.metrics import Histogram, MetricsMiddleware, stage
+
+    histogram = Histogram("bench_seconds", "bench", ("stage",))
+
+    def empty_stage():
+        with stage("bench"):
+            pass
+
+    results = {
+        "stage_ns": per_call_ns(empty_stage, args.iterations),
+        "histogram_observe_ns": per_call_ns(lambda: histogram.observe(0.003, "bench"), args.iterations),
+    }
+
+    def build(instrumented: bool) -> FastAPI:
+        app = FastAPI()
+
+        @app.get("/")
+        def read_root():
+            return {"ok": True}
+
+        if instrumented:
+            app.add_middleware(MetricsMiddleware, timing_header=False)
+        return app
+
+    plain_app, instrumented_app = build(False), build(True)
+    # Primera ronda de calentamiento (imports perezosos, cachés de rutas).
+    asyncio.run(requests_per_s(plain_app, args.requests // 10 + 1))
+    asyncio.run(requests_per_s(instrumented_app, args.requests // 10 + 1))
+    plain = asyncio.run(requests_per_s(plain_app, args.requests))
+    instrumented = asyncio.run(requests_per_s(instrumented_app, args.requests))
+    results["requests_per_s"] = {"plain": plain, "instrumented": instrumented}
+    results["middleware_overhead_us"] = (1 / instrumented - 1 / plain) * 1e6
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Microbenchmarks de las piezas de /register y /vpn/connect:
+    - generate_key_pair (pool, en proceso y con el binario 'wg' si está en el PATH),
+    - asignación de IPs con muchos usuarios: get_next_available_ip (el asignador
+      anterior, con la lista de IPs usadas leída de la base de datos) frente a IPPool,
+    - create_client_config,
+    - aciertos de la caché de configuraciones, sin y con el almacén compartido (LocalStore),
+    - descifrado de la clave privada guardada: cifrador en caché frente a un Fernet nuevo por llamada,
+    - bcrypt (hash y verificación).
+
+Uso (desde vpn_backend/):
+    python -m benchmarks.bench_micro --users 10000 --output micro.json
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.results import summarize, write_results
+
+
+def configure_environment() -> str:
+    """Debe llamarse antes de importar 'app': la configuración se lee al importar."""
+    from cryptography.fernet import Fernet
+
+    workdir = tempfile.mkdtemp(prefix="bench_micro_")
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ.setdefault("ENCRYPTION_KEYS", ",".join(Fernet.generate_key().decode() for _ in range(2)))
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ["LOCAL_STORE_PATH"] = f"{workdir}/local_store.db"
+    os.environ["WG_CLIENT_CIDR"] = "10.8.0.0/16"
+    return workdir
+
+
+def measure(func, iterations: int) -> dict:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings, scale=1e6, unit="us")
+
+
+def bench_keygen(iterations: int) -> dict:
+    from app.services.vpn_service import (
+        generate_key_pair, generate_key_pair_local, generate_key_pair_subprocess, key_pool
+    )
+
+    results = {"local": measure(generate_key_pair_local, iterations)}
+    if shutil.which("wg"):
+        results["subprocess"] = measure(generate_key_pair_subprocess, iterations)
+    else:
+        results["subprocess"] = "skipped: 'wg' not found on PATH"
+
+    # Con el pool lleno se mide el caso normal de /vpn/connect (un "hit").
+    hits = min(key_pool.stats()["size"], iterations)
+    key_pool.start()
+    while key_pool.stats()["available"] < hits:
+        time.sleep(0.01)
+    results["generate_key_pair"] = measure(generate_key_pair, hits)
+    results["generate_key_pair"]["pool"] = key_pool.stats()
+    key_pool.stop()
+    return results
+
+
+def get_next_available_ip(used_ips: list) -> str:
+    """Asignador anterior a IPPool: busca la próxima IP del rango 10.0.0.X que no esté en la lista."""
+    base_ip = "10.0.0."
+    for i in range(2, 255):
+        ip_candidate = f"{base_ip}{i}"
+        if ip_candidate not in used_ips:
+            return ip_candidate
+    return None
+
+
+def bench_ip_allocation(users: int, iterations: int) -> dict:
+    from sqlalchemy import insert
+
+    from app.db.database import SessionLocal, create_db_tables
+    from app.db.models import User
+    from app.services.ip_pool import IPPool
+
+    pool = IPPool("10.8.0.0/16", node="bench")
+    if users > pool.capacity - 1:
+        raise SystemExit(f"--users no puede superar {pool.capacity - 1} en {pool.network}")
+
+    create_db_tables()
+    ips = [pool.allocate() for _ in range(users)]
+    with SessionLocal() as db:
+        db.execute(insert(User), [
+            {"username": f"user{i}@bench", "hashed_password": "x", "wg_node": "bench", "wg_ip_address": ip}
+            for i, ip in enumerate(ips)
+        ])
+        db.commit()
+
+    def legacy():
+        # Lo que hacía /vpn/connect antes: leer todas las IPs usadas y buscar un hueco.
+        with SessionLocal() as db:
+            used_ips = [ip for (ip,) in db.query(User.wg_ip_address).filter(User.wg_ip_address.isnot(None))]
+        return get_next_available_ip(used_ips)
+
+    def allocate_and_release():
+        pool.release(pool.allocate())
+
+    def rescan():
+        with SessionLocal() as db:
+            pool.rescan(db)
+
+    def load_snapshot():
+        with SessionLocal() as db:
+            if not pool.load_snapshot(db):
+                raise RuntimeError("La instantánea del asignador no está vigente.")
+
+    with SessionLocal() as db:
+        pool.rebuild(db)
+
+    return {
+        "users": users,
+        "get_next_available_ip_with_query": measure(legacy, iterations),
+        "get_next_available_ip_scan_only": measure(lambda: get_next_available_ip(ips), iterations),
+        "ip_pool_allocate_release": measure(allocate_and_release, iterations * 100),
+        "ip_pool_rescan": measure(rescan, max(iterations // 10, 1)),
+        "ip_pool_load_snapshot": measure(load_snapshot, max(iterations // 10, 1)),
+    }
+
+
+def bench_client_config(iterations: int) -> dict:
+    from app.core.config import settings
+    from app.services.vpn_service import create_client_config, generate_key_pair_local
+
+    private_key, _ = generate_key_pair_local()
+    return measure(
+        lambda: create_client_config(
+            private_key, "10.8.0.2", settings.WG_SERVER_PUBLIC_KEY, settings.WG_SERVER_ENDPOINT
+        ),
+        iterations * 100
+    )
+
+
+def bench_config_cache(iterations: int) -> dict:
+    from app.core.config import settings
+    from app.core.local_store import LocalStore
+    from app.services.config_cache import ConfigCache
+
+    users = [f"user{i}@example.com" for i in range(1000)]
+    local = ConfigCache(len(users), 3600)
+    shared = ConfigCache(len(users), 3600, LocalStore(settings.LOCAL_STORE_PATH))
+    shared.invalidate(users[::2])
+    time.sleep(0.001)
+    now = time.time()
+    for cache in (local, shared):
+        for username in users:
+            cache.put(username, "v1", "[Interface]", now)
+    versions = {"v1"}
+    count = iterations * 10
+
+    async def measure_async() -> dict:
+        # Cada acierto consulta el almacén en un hilo, como en /vpn/connect.
+        timings = []
+        for i in range(count):
+            start = time.perf_counter()
+            await shared.get_async(users[i % len(users)], versions)
+            timings.append(time.perf_counter() - start)
+        return summarize(timings, scale=1e6, unit="us")
+
+    results = {
+        "hit_local": measure(lambda: local.get(users[0], versions), count),
+        "hit_shared_store": measure(lambda: shared.get(users[1], versions), count),
+        "hit_shared_store_async": asyncio.run(measure_async()),
+    }
+    results["hit_rate"] = shared.stats()["hit_rate"]
+    return results
+
+
+def bench_secret_encryption(iterations: int) -> dict:
+    from cryptography.fernet import Fernet, MultiFernet
+
+    from app.core.config import settings
+    from app.core.security import decrypt_secret, encrypt_secret
+    from app.services.vpn_service import generate_key_pair_local
+
+    private_key, _ = generate_key_pair_local()
+    stored = encrypt_secret(private_key)
+
+    def decrypt_uncached():
+        # Lo que hacía decrypt_data: construir el cifrador en cada llamada.
+        MultiFernet([Fernet(key.encode()) for key in settings.ENCRYPTION_KEYS]).decrypt(stored.encode())
+
+    return {
+        "keys": len(settings.ENCRYPTION_KEYS),
+        "encrypt_cached": measure(lambda: encrypt_secret(private_key), iterations * 10),
+        "decrypt_cached": measure(lambda: decrypt_secret(stored), iterations * 10),
+        "decrypt_new_cipher": measure(decrypt_uncached, iterations * 10),
+    }
+
+
+def bench_bcrypt(iterations: int, rounds: int) -> dict:
+    from app.core.security import get_password_hash, verify_password
+
+    hashed = get_password_hash("bench-password", rounds)
+    return {
+        "rounds": rounds,
+        "hash": measure(lambda: get_password_hash("bench-password", rounds), iterations),
+        "verify": measure(lambda: verify_password("bench-password", hashed), iterations),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--bcrypt-iterations", type=int, default=5)
+    parser.add_argument("--output", help="Fichero donde guardar los resultados en JSON.")
+    args = parser.parse_args()
+
+    workdir = configure_environment()
+    try:
+        results = {
+            "keygen": bench_keygen(args.iterations),
+            "ip_allocation": bench_ip_allocation(args.users, args.iterations),
+            "create_client_config": bench_client_config(args.iterations),
+            "config_cache": bench_config_cache(args.iterations),
+            "secret_encryption": bench_secret_encryption(args.iterations),
+            "bcrypt": bench_bcrypt(args.bcrypt_iterations, args.bcrypt_rounds),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    write_results("micro", results, vars(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
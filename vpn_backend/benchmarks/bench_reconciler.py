@@ -0,0 +1,63 @@
+"""
+Mide cuánto tarda en aplicarse una ráfaga de altas de peers concurrentes:
+un 'wg set' por peer frente a lotes agrupados por el reconciliador.
+
+Usa benchmarks/fake_wg.py, así que no necesita root ni una interfaz real.
+
+Uso (desde vpn_backend/):
+    python -m benchmarks.bench_reconciler --peers 500 --concurrency 100
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.peer_reconciler import PeerReconciler, WgRunner
+from app.services.vpn_service import generate_key_pair_local
+
+FAKE_WG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_wg.py")
+
+
+def run(peers: list, concurrency: int, window: float, max_batch: int) -> dict:
+    reconciler = PeerReconciler("wg0", WgRunner(f"{sys.executable} {FAKE_WG}"), window, max_batch)
+    reconciler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda peer: reconciler.submit(*peer).result(), peers))
+    elapsed = time.perf_counter() - start
+    reconciler.stop()
+    return {
+        "elapsed_s": elapsed,
+        "peers_per_s": len(peers) / elapsed,
+        "wg_invocations": reconciler.batches,
+        "failed": results.count(False),
+        "peers_on_interface": len(reconciler.dump()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--peers", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--window-ms", type=int, default=20)
+    parser.add_argument("--max-batch", type=int, default=256)
+    args = parser.parse_args()
+
+    results = {}
+    for name, window, max_batch in (
+        ("per_peer", 0, 1),
+        ("batched", args.window_ms / 1000, args.max_batch),
+    ):
+        with tempfile.NamedTemporaryFile(suffix=".json") as state:
+            os.environ["FAKE_WG_STATE"] = state.name
+            peers = [(generate_key_pair_local()[1], f"10.8.{i // 250}.{i % 250 + 2}") for i in range(args.peers)]
+            results[name] = run(peers, args.concurrency, window, max_batch)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
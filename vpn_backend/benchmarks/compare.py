@@ -0,0 +1,69 @@
+"""
+Compara dos ficheros de resultados de los benchmarks (--output) y marca las regresiones:
+latencias (claves *_ms / *_us) que suben o throughput (*_rps) que baja más del umbral.
+
+Uso (desde vpn_backend/):
+    python -m benchmarks.compare antes.json despues.json --threshold 10
+Retorna 1 si hay alguna regresión, para poder usarlo en CI.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Optional
+
+
+def flatten(value, prefix: str = "") -> Dict[str, float]:
+    """Convierte los resultados anidados en {"ruta.a.la.clave": valor} con solo los valores numéricos."""
+    if isinstance(value, dict):
+        items = {}
+        for key, child in value.items():
+            items.update(flatten(child, f"{prefix}.{key}" if prefix else str(key)))
+        return items
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: float(value)}
+    return {}
+
+
+def direction(key: str) -> Optional[int]:
+    """+1 si un valor mayor es peor (latencias), -1 si es mejor (throughput), None si no se juzga."""
+    name = key.rsplit(".", 1)[-1]
+    if name.endswith(("_ms", "_us", "_s")) and not name.startswith("elapsed"):
+        return 1
+    if name.endswith("_rps"):
+        return -1
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Cambio porcentual que cuenta como regresión.")
+    args = parser.parse_args()
+
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)
+    with open(args.candidate) as handle:
+        candidate = json.load(handle)
+    if baseline.get("benchmark") != candidate.get("benchmark"):
+        parser.error(f"Benchmarks distintos: {baseline.get('benchmark')} y {candidate.get('benchmark')}")
+
+    old, new = flatten(baseline.get("results", {})), flatten(candidate.get("results", {}))
+    regressions = 0
+    print(f"{'métrica':<60} {'antes':>12} {'después':>12} {'cambio':>9}")
+    for key in sorted(old.keys() & new.keys()):
+        sense = direction(key)
+        if sense is None:
+            continue
+        change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+        regression = change * sense > args.threshold
+        regressions += regression
+        print(f"{key:<60} {old[key]:>12.3f} {new[key]:>12.3f} {change:>+8.1f}%{'  REGRESIÓN' if regression else ''}")
+
+    print(f"\n{regressions} regresiones (umbral {args.threshold:.0f}%): "
+          f"{baseline.get('git_revision')} -> {candidate.get('git_revision')}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Sustituto local del binario 'wg' para pruebas y benchmarks, sin root ni interfaz real.
+
+Guarda el estado de las interfaces en un fichero JSON (FAKE_WG_STATE) y entiende
+el subconjunto de comandos que usa el backend:
+
+    wg genkey
+    wg pubkey                 (clave privada por stdin)
+    wg set <if> peer <key> allowed-ips <ip>/32 [peer <key> remove] ...
+    wg show <if> dump
+
+Variables de entorno:
+    FAKE_WG_STATE       fichero de estado (por defecto /tmp/fake_wg_state.json)
+    FAKE_WG_LATENCY_MS  latencia artificial por invocación
+    FAKE_WG_FAIL_KEYS   claves (separadas por comas) cuyo 'set' debe fallar
+
+Uso: WG_COMMAND="python benchmarks/fake_wg.py" uvicorn app.main:app
+"""
+import base64
+import fcntl
+import json
+import os
+import sys
+import time
+
+STATE_PATH = os.getenv("FAKE_WG_STATE", "/tmp/fake_wg_state.json")
+INTERFACE_PRIVATE_KEY = base64.b64encode(b"\x01" * 32).decode()
+INTERFACE_PUBLIC_KEY = base64.b64encode(b"\x02" * 32).decode()
+
+
+def load_state(handle) -> dict:
+    handle.seek(0)
+    content = handle.read()
+    return json.loads(content) if content else {}
+
+
+def save_state(handle, state: dict):
+    handle.seek(0)
+    handle.truncate()
+    json.dump(state, handle)
+
+
+def cmd_genkey():
+    raw = bytearray(os.urandom(32))
+    raw[0] &= 248
+    raw[31] = (raw[31] & 127) | 64
+    print(base64.b64encode(bytes(raw)).decode())
+
+
+def cmd_pubkey():
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+    raw = base64.b64decode(sys.stdin.read().strip())
+    public = X25519PrivateKey.from_private_bytes(raw).public_key().public_bytes(
+        encoding=serialization.Encoding.Raw, format=serialization.PublicFormat.Raw
+    )
+    print(base64.b64encode(public).decode())
+
+
+def cmd_set(state: dict, interface: str, args: list) -> int:
+    fail_keys = set(filter(None, os.getenv("FAKE_WG_FAIL_KEYS", "").split(",")))
+    peers = state.setdefault(interface, {})
+    updates = {}
+    i = 0
+    while i < len(args):
+        if args[i] != "peer" or i + 1 >= len(args):
+            print(f"Invalid argument: {args[i]}", file=sys.stderr)
+            return 1
+        key = args[i + 1]
+        if key in fail_keys:
+            print(f"Key is not the correct length or format: `{key}'", file=sys.stderr)
+            return 1
+        i += 2
+        if i < len(args) and args[i] == "remove":
+            updates[key] = None
+            i += 1
+        elif i + 1 < len(args) and args[i] == "allowed-ips":
+            updates[key] = args[i + 1]
+            i += 2
+    # 'wg set' es atómico: o se aplica todo el comando o nada.
+    for key, allowed_ips in updates.items():
+        if allowed_ips is None:
+            peers.pop(key, None)
+        else:
+            peer = peers.setdefault(key, {"handshake": 0, "rx": 0, "tx": 0})
+            peer["allowed_ips"] = allowed_ips
+    return 0
+
+
+def cmd_dump(state: dict, interface: str):
+    lines = [f"{INTERFACE_PRIVATE_KEY}\t{INTERFACE_PUBLIC_KEY}\t51820\toff"]
+    for key, peer in state.get(interface, {}).items():
+        lines.append(
+            f"{key}\t(none)\t(none)\t{peer['allowed_ips']}\t{peer['handshake']}\t{peer['rx']}\t{peer['tx']}\toff"
+        )
+    sys.stdout.write("\n".join(lines) + "\n")
+
+
+def main(argv: list) -> int:
+    latency = float(os.getenv("FAKE_WG_LATENCY_MS", "0"))
+    if latency:
+        time.sleep(latency / 1000)
+
+    if not argv:
+        print("Usage: wg <cmd> [<args>]", file=sys.stderr)
+        return 1
+    if argv[0] == "genkey":
+        cmd_genkey()
+        return 0
+    if argv[0] == "pubkey":
+        cmd_pubkey()
+        return 0
+
+    with open(STATE_PATH, "a+") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        state = load_state(handle)
+        if argv[0] == "set" and len(argv) >= 2:
+            code = cmd_set(state, argv[1], argv[2:])
+            if code == 0:
+                save_state(handle, state)
+            return code
+        if argv[0] == "show" and len(argv) >= 3 and argv[2] == "dump":
+            cmd_dump(state, argv[1])
+            return 0
+
+    print(f"Invalid subcommand: `{' '.join(argv)}'", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,30 @@
+"""
+app.main:app para bench_lifecycle y bench_coldstart: el verificador de tokens de
+firebase_admin descarga los certificados del emisor local (BENCH_FIREBASE_CERT_URL)
+en lugar de los de Google.
+
+La URL no se puede configurar en firebase_admin: se cambia a través de su API interna,
+igual que la precarga de certificados de app/services/firebase_service.py.
+
+Uso: BENCH_FIREBASE_CERT_URL=http://127.0.0.1:<puerto>/certs uvicorn benchmarks.lifecycle_app:app
+"""
+import os
+
+from app.services import firebase_service
+
+_initialize_firebase = firebase_service.initialize_firebase
+
+
+def initialize_firebase():
+    _initialize_firebase()
+    from firebase_admin import auth
+
+    auth._get_client(None)._token_verifier.id_token_verifier.cert_url = os.environ["BENCH_FIREBASE_CERT_URL"]
+
+
+# Antes de importar app.main, para que use esta versión.
+firebase_service.initialize_firebase = initialize_firebase
+
+from app.main import app  # noqa: E402
+
+__all__ = ["app"]
@@ -0,0 +1,63 @@
+"""
+Utilidades comunes de los benchmarks: percentiles y resultados en JSON con los
+datos de la ejecución, para poder compararlos entre versiones (ver benchmarks/compare.py).
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(latencies: List[float], scale: float = 1000.0, unit: str = "ms") -> dict:
+    """Media y percentiles de una lista de duraciones en segundos (por defecto, en milisegundos)."""
+    values = sorted(latencies)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        f"mean_{unit}": sum(values) / len(values) * scale,
+        f"p50_{unit}": percentile(values, 0.50) * scale,
+        f"p95_{unit}": percentile(values, 0.95) * scale,
+        f"p99_{unit}": percentile(values, 0.99) * scale,
+        f"max_{unit}": values[-1] * scale,
+    }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def write_results(name: str, results: dict, parameters: dict, output: Optional[str] = None) -> dict:
+    """Añade los datos de la ejecución a los resultados, los imprime y, si se indica, los guarda en 'output'."""
+    document = {
+        "benchmark": name,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": parameters,
+        "results": results,
+    }
+    text = json.dumps(document, indent=2)
+    print(text)
+    if output:
+        with open(output, "w") as handle:
+            handle.write(text + "\n")
+    return document
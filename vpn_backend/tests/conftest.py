@@ -0,0 +1,34 @@
+"""
+Configuración común de las pruebas: base de datos y almacén local en un directorio
+temporal y ningún hilo en segundo plano. Las variables se fijan antes de importar 'app'.
+"""
+import os
+import tempfile
+
+import pytest
+from cryptography.fernet import Fernet
+
+_workdir = tempfile.mkdtemp(prefix="vpn_tests_")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(_workdir, 'vpn.db')}",
+    "LOCAL_STORE_PATH": os.path.join(_workdir, "local_store.db"),
+    "SECRET_KEY": "tests",
+    "ENCRYPTION_KEYS": Fernet.generate_key().decode(),
+    "WG_COMMAND": "false",
+    "WG_NODE_REFRESH_INTERVAL": "0",
+    "WG_RECONCILE_INTERVAL": "0",
+    "TELEMETRY_INTERVAL": "0",
+    "WG_REAPER_INTERVAL": "0",
+})
+
+
+@pytest.fixture
+def db():
+    """Sesión sobre una base de datos vacía, que se borra al terminar la prueba."""
+    from app.db.database import SessionLocal, engine
+    from app.db.models import Base
+
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as session:
+        yield session
+    Base.metadata.drop_all(bind=engine)
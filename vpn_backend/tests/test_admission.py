@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+import pytest
+
+from app.core.local_store import LocalStore
+from app.services import admission
+from app.services.admission import LOCK_NAMESPACE, RateLimited, TokenBucketLimiter, UserOperations
+
+
+def test_limiter_admits_burst_then_rejects():
+    limiter = TokenBucketLimiter("user", rate=1, burst=2)
+
+    assert limiter.acquire("alice") == 0
+    assert limiter.acquire("alice") == 0
+    assert limiter.acquire("alice") == pytest.approx(1, abs=0.05)
+    # Cada clave tiene su propio bucket.
+    assert limiter.acquire("bob") == 0
+    assert (limiter.admitted, limiter.rejected) == (3, 1)
+
+
+def test_limiter_shares_bucket_across_workers(tmp_path):
+    store = LocalStore(str(tmp_path / "store.db"))
+    first, second = TokenBucketLimiter("user", 1, 2, store), TokenBucketLimiter("user", 1, 2, store)
+
+    assert first.acquire("alice") == 0
+    assert second.acquire("alice") == 0
+    assert first.acquire("alice") > 0
+
+
+def test_refund_never_exceeds_burst():
+    limiter = TokenBucketLimiter("user", rate=1, burst=1)
+    limiter.refund("alice")
+
+    assert limiter.acquire("alice") == 0
+    assert limiter.acquire("alice") > 0
+
+
+def test_admit_returns_user_token_when_global_rejects(monkeypatch, tmp_path):
+    store = LocalStore(str(tmp_path / "store.db"))
+    monkeypatch.setattr(admission, "user_limiter", TokenBucketLimiter("user", 0.01, 1, store))
+    monkeypatch.setattr(admission, "global_limiter", TokenBucketLimiter("global", 0.01, 1, store))
+    admission.global_limiter.acquire("all")
+
+    with pytest.raises(RateLimited) as rejected:
+        asyncio.run(admission.admit("alice"))
+    assert rejected.value.scope == "global"
+
+    admission.global_limiter.refund("all")
+    asyncio.run(admission.admit("alice"))
+
+
+def test_identical_operations_share_one_run():
+    operations = UserOperations()
+    calls = []
+
+    async def connect():
+        calls.append("connect")
+        await asyncio.sleep(0.05)
+        return "config"
+
+    async def main():
+        return await asyncio.gather(*(operations.run("alice", "connect", connect) for _ in range(3)))
+
+    assert asyncio.run(main()) == ["config"] * 3
+    assert calls == ["connect"]
+    assert operations.coalesced == 2
+
+
+def test_different_operations_run_one_after_another():
+    operations = UserOperations()
+    events = []
+
+    def operation(name):
+        async def run():
+            events.append(f"{name}:start")
+            await asyncio.sleep(0.02)
+            events.append(f"{name}:end")
+            return name
+        return run
+
+    async def main():
+        return await asyncio.gather(
+            operations.run("alice", "connect", operation("connect")),
+            operations.run("alice", "disconnect", operation("disconnect")),
+        )
+
+    assert asyncio.run(main()) == ["connect", "disconnect"]
+    assert events == ["connect:start", "connect:end", "disconnect:start", "disconnect:end"]
+
+
+def test_lock_is_renewed_while_the_operation_runs(tmp_path):
+    store = LocalStore(str(tmp_path / "store.db"))
+    # La operación dura más que 'lock_timeout': sin renovar, el cerrojo caducaría a mitad.
+    worker, other_worker = UserOperations(store, lock_timeout=0.3), UserOperations(store, lock_timeout=5)
+    events = []
+
+    async def slow():
+        events.append("slow:start")
+        await asyncio.sleep(0.8)
+        events.append("slow:end")
+
+    async def fast():
+        events.append("fast")
+
+    async def main():
+        first = asyncio.create_task(worker.run("alice", "connect", slow))
+        await asyncio.sleep(0.5)
+        await other_worker.run("alice", "connect", fast)
+        await first
+
+    asyncio.run(main())
+    assert events == ["slow:start", "slow:end", "fast"]
+    assert other_worker.lock_waits == 1
+    assert store.get(LOCK_NAMESPACE, "alice") is None
+
+
+class SlowStore(LocalStore):
+    """Almacén cuyas escrituras tardan, como cuando otro worker tiene la escritura de SQLite."""
+
+    def add(self, *args):
+        time.sleep(0.1)
+        return super().add(*args)
+
+
+def test_lock_contention_does_not_block_the_event_loop(tmp_path):
+    store = SlowStore(str(tmp_path / "store.db"))
+    worker, other_worker = UserOperations(store, lock_timeout=5), UserOperations(store, lock_timeout=5)
+    gaps = []
+
+    async def operation():
+        await asyncio.sleep(0.3)
+        return "done"
+
+    async def other_requests(stop: asyncio.Event):
+        # Otras peticiones del worker: el bucle debe atenderlas mientras tanto.
+        last = time.perf_counter()
+        while not stop.is_set():
+            await asyncio.sleep(0.01)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    async def main():
+        stop = asyncio.Event()
+        ticker = asyncio.create_task(other_requests(stop))
+        results = await asyncio.gather(
+            worker.run("alice", "connect", operation),
+            other_worker.run("alice", "connect", operation),
+        )
+        stop.set()
+        await ticker
+        return results
+
+    assert asyncio.run(main()) == ["done", "done"]
+    assert other_worker.lock_waits + worker.lock_waits == 1
+    assert max(gaps) < 0.08
@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+from app.core.local_store import LocalStore
+from app.services.config_cache import ConfigCache
+
+
+def test_invalidation_after_read_discards_later_put(tmp_path):
+    store = LocalStore(str(tmp_path / "store.db"))
+    connect_worker, disconnect_worker = ConfigCache(10, 60, store), ConfigCache(10, 60, store)
+
+    # El connect lee el usuario, el disconnect de otro worker invalida y después se guarda la configuración.
+    read_at = time.time()
+    disconnect_worker.invalidate(["alice"])
+    connect_worker.put("alice", "v1", "[Interface]", read_at)
+
+    assert connect_worker.get("alice", {"v1"}) is None
+
+
+def test_put_after_invalidation_is_served(tmp_path):
+    store = LocalStore(str(tmp_path / "store.db"))
+    cache = ConfigCache(10, 60, store)
+    cache.invalidate(["alice"])
+    time.sleep(0.001)
+
+    artifact = cache.put("alice", "v1", "[Interface]", time.time())
+
+    assert cache.get("alice", {"v1"}) is artifact
+
+
+def test_get_async_sees_invalidations_from_other_workers(tmp_path):
+    store = LocalStore(str(tmp_path / "store.db"))
+    cache, other_worker = ConfigCache(10, 60, store), ConfigCache(10, 60, store)
+    artifact = cache.put("alice", "v1", "[Interface]", time.time())
+
+    assert asyncio.run(cache.get_async("alice", {"v1"})) is artifact
+    asyncio.run(other_worker.invalidate_async(["alice"]))
+    assert asyncio.run(cache.get_async("alice", {"v1"})) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+class SlowStore(LocalStore):
+    """Almacén cuyas lecturas tardan, como cuando otro worker tiene la escritura de SQLite."""
+
+    def get(self, *args):
+        time.sleep(0.1)
+        return super().get(*args)
+
+
+def test_get_async_does_not_block_the_event_loop(tmp_path):
+    cache = ConfigCache(10, 60, SlowStore(str(tmp_path / "store.db")))
+    for i in range(3):
+        cache.put(f"user{i}", "v1", "[Interface]", time.time())
+    gaps = []
+
+    async def other_requests(stop: asyncio.Event):
+        last = time.perf_counter()
+        while not stop.is_set():
+            await asyncio.sleep(0.01)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    async def main():
+        stop = asyncio.Event()
+        ticker = asyncio.create_task(other_requests(stop))
+        for i in range(3):
+            assert await cache.get_async(f"user{i}", {"v1"})
+        stop.set()
+        await ticker
+
+    asyncio.run(main())
+    assert max(gaps) < 0.08
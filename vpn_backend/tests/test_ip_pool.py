@@ -0,0 +1,89 @@
+from datetime import datetime
+
+from sqlalchemy import update
+
+from app.core.local_store import LocalStore
+from app.db.models import User
+from app.services.ip_pool import IPPool
+
+
+def add_users(db, pool, count, added_at=None):
+    ips = [pool.allocate() for _ in range(count)]
+    db.add_all(
+        User(username=f"user{i}", hashed_password="x", wg_node="node", wg_ip_address=ip, wg_peer_added_at=added_at)
+        for i, ip in enumerate(ips)
+    )
+    db.commit()
+    return ips
+
+
+def test_rebuild_loads_snapshot_when_users_did_not_change(db):
+    ips = add_users(db, IPPool("10.0.0.0/24", node="node"), 10)
+    pool = IPPool("10.0.0.0/24", node="node")
+    assert pool.rebuild(db) == 10
+
+    restarted = IPPool("10.0.0.0/24", node="node")
+    assert restarted.load_snapshot(db)
+    assert restarted.allocated == 10
+    assert restarted.snapshot() == pool.snapshot()
+    assert restarted.allocate() not in ips
+
+
+def test_snapshot_is_stale_after_new_assignment(db):
+    add_users(db, IPPool("10.0.0.0/24", node="node"), 5)
+    IPPool("10.0.0.0/24", node="node").rebuild(db)
+    db.add(User(username="late", hashed_password="x", wg_node="node", wg_ip_address="10.0.0.200",
+                wg_peer_added_at=datetime.utcnow()))
+    db.commit()
+
+    restarted = IPPool("10.0.0.0/24", node="node")
+    assert not restarted.load_snapshot(db)
+    assert restarted.rebuild(db) == 6
+    assert not restarted.reserve("10.0.0.200")
+
+
+def test_snapshot_is_stale_after_release(db):
+    ips = add_users(db, IPPool("10.0.0.0/24", node="node"), 5)
+    IPPool("10.0.0.0/24", node="node").rebuild(db)
+    db.execute(update(User).where(User.wg_ip_address == ips[0]).values(wg_ip_address=None))
+    db.commit()
+
+    restarted = IPPool("10.0.0.0/24", node="node")
+    assert not restarted.load_snapshot(db)
+    assert restarted.rebuild(db) == 4
+    assert restarted.reserve(ips[0])
+
+
+def test_workers_sharing_a_store_never_hand_out_the_same_ip(tmp_path):
+    store = LocalStore(str(tmp_path / "store.db"))
+    first, second = IPPool("10.0.0.0/24", node="node", store=store), IPPool("10.0.0.0/24", node="node", store=store)
+
+    ips = [pool.allocate() for _ in range(5) for pool in (first, second)]
+
+    assert len(set(ips)) == 10
+    # El segundo marcó como usadas las IPs que reclamó el primero.
+    assert second.allocated == 10
+
+
+def test_released_ip_can_be_claimed_by_another_worker(tmp_path):
+    store = LocalStore(str(tmp_path / "store.db"))
+    first, second = IPPool("10.0.0.0/30", node="node", store=store), IPPool("10.0.0.0/30", node="node", store=store)
+    ip = first.allocate()
+    assert second.allocate() is None
+
+    first.release(ip)
+    second.reset()
+
+    assert second.allocate() == ip
+
+
+def test_resync_reads_ips_assigned_by_other_workers(db):
+    pool = IPPool("10.0.0.0/24", node="node")
+    pool.rebuild(db)
+    assert not pool.resync(db)
+
+    ips = add_users(db, IPPool("10.0.0.0/24", node="node"), 3)
+
+    assert pool.resync(db)
+    assert pool.allocated == 3
+    assert pool.allocate() not in ips
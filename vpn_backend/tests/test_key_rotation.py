@@ -0,0 +1,102 @@
+import pytest
+from cryptography.fernet import Fernet, InvalidToken
+from sqlalchemy import update
+
+from app.core import security
+from app.core.config import settings
+from app.core.security import decrypt_secret, encrypt_secret, is_encrypted, rotate_secret
+from app.db.database import SessionLocal
+from app.db.models import KeyRotationProgress, User
+from app.services import key_rotation
+from app.services.key_rotation import rotate_private_keys
+from app.services.vpn_service import generate_key_pair_local
+
+OLD_KEY, NEW_KEY = Fernet.generate_key().decode(), Fernet.generate_key().decode()
+
+
+@pytest.fixture
+def use_keys(monkeypatch):
+    """Cambia ENCRYPTION_KEYS durante la prueba; el cifrador se vuelve a construir."""
+    def use(*keys):
+        monkeypatch.setattr(settings, "ENCRYPTION_KEYS", list(keys))
+        monkeypatch.setattr(security, "_cipher", None)
+    return use
+
+
+def add_users(db, count):
+    private_keys = [generate_key_pair_local()[0] for _ in range(count)]
+    db.add_all(
+        User(username=f"user{i}", hashed_password="x", wg_private_key=encrypt_secret(key))
+        for i, key in enumerate(private_keys)
+    )
+    db.commit()
+    return private_keys
+
+
+def stored_keys(db):
+    db.expire_all()
+    return [value for (value,) in db.query(User.wg_private_key).order_by(User.id)]
+
+
+def test_plaintext_secrets_pass_through():
+    private_key, _ = generate_key_pair_local()
+    stored = encrypt_secret(private_key)
+
+    assert is_encrypted(stored) and not is_encrypted(private_key)
+    assert decrypt_secret(stored) == private_key
+    assert decrypt_secret(private_key) == private_key
+    assert is_encrypted(rotate_secret(private_key))
+
+
+def test_secondary_key_decrypts_until_rotated(use_keys):
+    private_key, _ = generate_key_pair_local()
+    use_keys(OLD_KEY)
+    stored = encrypt_secret(private_key)
+
+    use_keys(NEW_KEY, OLD_KEY)
+    assert decrypt_secret(stored) == private_key
+    rotated = rotate_secret(stored)
+
+    use_keys(NEW_KEY)
+    assert decrypt_secret(rotated) == private_key
+    with pytest.raises(InvalidToken):
+        decrypt_secret(stored)
+
+
+def test_rotation_resumes_after_max_batches(db, use_keys):
+    use_keys(OLD_KEY)
+    private_keys = add_users(db, 5)
+    use_keys(NEW_KEY, OLD_KEY)
+
+    first = rotate_private_keys(SessionLocal, batch_size=2, max_batches=2)
+    assert (first["batches"], first["rotated"], first["finished"]) == (2, 4, False)
+    db.expire_all()
+    assert db.query(KeyRotationProgress.last_user_id).scalar() == 4
+
+    second = rotate_private_keys(SessionLocal, batch_size=2)
+    assert (second["rotated"], second["finished"]) == (1, True)
+    assert rotate_private_keys(SessionLocal, batch_size=2)["already_finished"]
+
+    use_keys(NEW_KEY)
+    assert [decrypt_secret(value) for value in stored_keys(db)] == private_keys
+
+
+def test_rotation_skips_rows_changed_during_the_batch(db, use_keys, monkeypatch):
+    use_keys(OLD_KEY)
+    add_users(db, 3)
+    use_keys(NEW_KEY, OLD_KEY)
+    # Una conexión guarda claves nuevas para user1 después de que la rotación leyera el lote.
+    new_value = encrypt_secret(generate_key_pair_local()[0])
+
+    def rotate_while_user_connects(value):
+        if value == stored_keys(db)[1]:
+            with SessionLocal() as other:
+                other.execute(update(User).where(User.username == "user1").values(wg_private_key=new_value))
+                other.commit()
+        return rotate_secret(value)
+
+    monkeypatch.setattr(key_rotation, "rotate_secret", rotate_while_user_connects)
+    result = rotate_private_keys(SessionLocal, batch_size=10)
+
+    assert (result["rotated"], result["skipped"]) == (2, 1)
+    assert stored_keys(db)[1] == new_value
@@ -0,0 +1,87 @@
+import base64
+import shutil
+import subprocess
+import threading
+import time
+
+import pytest
+
+from app.services import vpn_service
+from app.services.key_pool import KeyPairPool
+from app.services.vpn_service import generate_key_pair_local
+
+# RFC 7748, sección 6.1: clave privada y pública de Alice.
+RFC7748_PRIVATE = bytes.fromhex("77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a")
+RFC7748_PUBLIC = bytes.fromhex("8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a")
+
+
+def test_local_key_pair_matches_rfc7748_vector(monkeypatch):
+    monkeypatch.setattr(vpn_service.os, "urandom", lambda size: RFC7748_PRIVATE)
+
+    private_key, public_key = generate_key_pair_local()
+
+    # La clave privada se guarda ya "clampeada", como la de 'wg genkey'; la pública no cambia.
+    clamped = bytearray(RFC7748_PRIVATE)
+    clamped[0] &= 248
+    clamped[31] = (clamped[31] & 127) | 64
+    assert base64.b64decode(private_key) == bytes(clamped)
+    assert base64.b64decode(public_key) == RFC7748_PUBLIC
+
+
+@pytest.mark.skipif(not shutil.which("wg"), reason="'wg' no está en el PATH")
+def test_local_key_pair_matches_wg_pubkey():
+    private_key, public_key = generate_key_pair_local()
+    result = subprocess.run(["wg", "pubkey"], input=private_key, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == public_key
+
+
+class CountingFactory:
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            return f"private{self.calls}", f"public{self.calls}"
+
+
+def wait_available(pool: KeyPairPool, count: int):
+    deadline = time.monotonic() + 5
+    while pool.stats()["available"] < count:
+        assert time.monotonic() < deadline, "el pool no se rellenó"
+        time.sleep(0.01)
+
+
+def test_key_pool_misses_until_started_then_refills():
+    factory = CountingFactory()
+    pool = KeyPairPool(factory, size=3)
+
+    assert pool.get() == ("private1", "public1")
+    assert pool.stats()["misses"] == 1
+
+    pool.start()
+    try:
+        wait_available(pool, 3)
+        pairs = [pool.get() for _ in range(3)]
+        assert len(set(pairs)) == 3
+        wait_available(pool, 3)
+    finally:
+        pool.stop()
+
+    stats = pool.stats()
+    assert (stats["hits"], stats["misses"], stats["available"]) == (3, 1, 3)
+    assert stats["hit_rate"] == 0.75
+    assert factory.calls == 1 + 3 + 3
+
+
+def test_key_pool_without_size_always_generates():
+    factory = CountingFactory()
+    pool = KeyPairPool(factory, size=0)
+    pool.start()
+
+    pool.get()
+    pool.get()
+
+    assert pool.stats()["misses"] == 2
+    assert factory.calls == 2
@@ -0,0 +1,35 @@
+import time
+
+from app.core.local_store import Lease, LocalStore
+
+
+def test_writes_purge_expired_entries(tmp_path):
+    store = LocalStore(str(tmp_path / "store.db"), purge_interval=0)
+    store.set("ns", "old", "1", time.time() - 1)
+    store.set("ns", "live", "2", time.time() + 60)
+
+    rows = store._connection().execute("SELECT key FROM kv").fetchall()
+    assert rows == [("live",)]
+
+
+def test_purge_waits_for_interval(tmp_path):
+    store = LocalStore(str(tmp_path / "store.db"), purge_interval=3600)
+    store.set("ns", "old", "1", time.time() - 1)
+    store.set("ns", "live", "2", time.time() + 60)
+
+    assert store.get("ns", "old") is None
+    assert store._connection().execute("SELECT COUNT(*) FROM kv").fetchone() == (2,)
+    assert store.purge_expired() == 1
+
+
+def test_lease_is_held_by_one_process_at_a_time(tmp_path):
+    store = LocalStore(str(tmp_path / "store.db"))
+    first, second = Lease(store, "jobs", ttl=30), Lease(store, "jobs", ttl=30)
+
+    assert first.renew() and first.held
+    assert not second.renew() and not second.held
+    assert first.renew()
+
+    first.stop()
+    assert not first.held
+    assert second.renew() and second.held
@@ -0,0 +1,83 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.metrics import MetricsMiddleware, MetricsRegistry, server_timing, stage
+
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Peticiones.", ("route",))
+    in_flight = registry.gauge("in_flight", "En curso.")
+    latency = registry.histogram("latency_seconds", "Latencia.", buckets=(0.1, 1.0))
+    registry.callback("nodes", "Nodos.", "gauge", ("node",), lambda: [(("a",), 2), (("b",), None)])
+
+    requests.inc('/vpn/"connect"')
+    requests.inc('/vpn/"connect"', amount=2)
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(3)
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Peticiones.",
+        "# TYPE requests_total counter",
+        'requests_total{route="/vpn/\\"connect\\""} 3',
+        "# HELP in_flight En curso.",
+        "# TYPE in_flight gauge",
+        "in_flight 1",
+        "# HELP latency_seconds Latencia.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1.0"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 3.55",
+        "latency_seconds_count 3",
+        "# HELP nodes Nodos.",
+        "# TYPE nodes gauge",
+        'nodes{node="a"} 2',
+    ]
+
+
+def test_failing_callback_renders_without_samples():
+    registry = MetricsRegistry()
+    registry.callback("broken", "Rota.", "gauge", (), lambda: 1 / 0)
+
+    assert registry.render().splitlines() == ["# HELP broken Rota.", "# TYPE broken gauge"]
+
+
+def test_server_timing_adds_up_repeated_stages():
+    assert server_timing([("db", 0.001), ("auth", 0.002), ("db", 0.0005)]) == "db;dur=1.50, auth;dur=2.00"
+
+
+def timed_app(timing_header: bool) -> TestClient:
+    app = FastAPI()
+
+    @app.get("/work")
+    def work():
+        with stage("db"):
+            pass
+        return {}
+
+    app.add_middleware(MetricsMiddleware, timing_header=timing_header)
+    return TestClient(app)
+
+
+def test_server_timing_header_only_on_request():
+    client = timed_app(timing_header=True)
+
+    timed = client.get("/work", headers={"X-Debug-Timing": "1"}).headers["server-timing"]
+    assert [entry.split(";")[0] for entry in timed.split(", ")] == ["db", "total"]
+    assert "server-timing" not in client.get("/work").headers
+    assert "server-timing" not in timed_app(timing_header=False).get("/work", headers={"X-Debug-Timing": "1"}).headers
+    assert any('method="GET",route="/work",status="200"' in line for line in metrics.REQUEST_SECONDS.render())
+
+
+def test_metrics_endpoint_is_disabled_by_default():
+    from app.main import app
+
+    assert settings.METRICS_ENABLED is False
+    assert TestClient(app).get("/metrics").status_code == 404
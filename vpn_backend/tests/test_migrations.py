@@ -0,0 +1,117 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from app.db.migrations import pending_migrations, run_migrations
+from app.db.models import Base
+
+# Esquema de la primera versión de la API, antes de cualquier migración.
+BASELINE_SCHEMA = [
+    """CREATE TABLE users (
+        id INTEGER NOT NULL PRIMARY KEY,
+        username VARCHAR UNIQUE,
+        hashed_password VARCHAR,
+        is_active BOOLEAN,
+        created_at DATETIME,
+        wg_public_key VARCHAR UNIQUE,
+        wg_private_key VARCHAR UNIQUE,
+        wg_ip_address VARCHAR UNIQUE
+    )""",
+    "CREATE INDEX ix_users_id ON users (id)",
+    "CREATE UNIQUE INDEX ix_users_username ON users (username)",
+    """CREATE TABLE connection_logs (
+        id INTEGER NOT NULL PRIMARY KEY,
+        user_id INTEGER,
+        ip_address VARCHAR,
+        connected_at DATETIME,
+        disconnected_at DATETIME
+    )""",
+    "CREATE INDEX ix_connection_logs_id ON connection_logs (id)",
+    "CREATE INDEX ix_connection_logs_user_id ON connection_logs (user_id)",
+]
+
+
+def baseline_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text(
+            "INSERT INTO connection_logs (user_id, ip_address, connected_at, disconnected_at) "
+            "VALUES (1, '10.0.0.2', '2024-01-01 10:00:00', '2024-01-01 11:00:00')"
+        ))
+        conn.execute(text(
+            "INSERT INTO users (username, wg_public_key, wg_ip_address) "
+            "VALUES ('connected', 'A', '10.0.0.2'), ('idle', NULL, NULL)"
+        ))
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+def test_migrations_upgrade_baseline_schema(tmp_path):
+    engine = baseline_engine(tmp_path)
+    assert pending_migrations(engine)
+
+    applied = run_migrations(engine)
+    assert {"connection_logs_telemetry", "connection_logs_rollups", "users_peer_added_at", "users_nodes"} <= set(applied)
+    assert not pending_migrations(engine)
+    assert run_migrations(engine) == []
+
+    inspector = inspect(engine)
+    columns = {column["name"] for column in inspector.get_columns("connection_logs")}
+    assert {"public_key", "interface", "rx_bytes", "tx_bytes", "rolled_up"} <= columns
+    assert {
+        "uq_connection_logs_open_session", "ix_connection_logs_user_connected", "ix_connection_logs_pending_rollup"
+    } <= {index["name"] for index in inspector.get_indexes("connection_logs")}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT rx_bytes, tx_bytes, rolled_up FROM connection_logs")).all() == [(0, 0, False)]
+        marked = conn.execute(text("SELECT username, wg_peer_added_at IS NOT NULL FROM users ORDER BY username")).all()
+    assert marked == [("connected", 1), ("idle", 0)]
+
+    # La misma IP puede estar en dos nodos, pero no dos veces en el mismo.
+    assert "ix_users_wg_node" in {index["name"] for index in inspector.get_indexes("users")}
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE users SET wg_node = 'a' WHERE username = 'connected'"))
+        conn.execute(text("INSERT INTO users (username, wg_node, wg_ip_address) VALUES ('other', 'b', '10.0.0.2')"))
+    with pytest.raises(IntegrityError), engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (username, wg_node, wg_ip_address) VALUES ('dup', 'a', '10.0.0.2')"))
+
+
+def test_open_session_migration_drops_duplicates(tmp_path):
+    engine = baseline_engine(tmp_path)
+    with engine.begin() as conn:
+        for statement in (
+            "ALTER TABLE connection_logs ADD COLUMN public_key VARCHAR",
+            "ALTER TABLE connection_logs ADD COLUMN interface VARCHAR",
+        ):
+            conn.execute(text(statement))
+        conn.execute(text(
+            "INSERT INTO connection_logs (public_key, interface, connected_at) "
+            "VALUES ('A', 'wg0', '2024-01-01'), ('A', 'wg0', '2024-01-01'), ('A', 'wg1', '2024-01-01')"
+        ))
+
+    run_migrations(engine)
+
+    with engine.connect() as conn:
+        open_sessions = conn.execute(text(
+            "SELECT interface FROM connection_logs WHERE disconnected_at IS NULL ORDER BY interface"
+        )).scalars().all()
+    assert open_sessions == ["wg0", "wg1"]
+
+
+def test_ip_pool_state_migration_replaces_cidr_only_snapshots(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE ip_pool_state (id INTEGER NOT NULL PRIMARY KEY, cidr VARCHAR, bitmap BLOB, "
+            "allocated INTEGER, updated_at DATETIME)"
+        ))
+        conn.execute(text("CREATE UNIQUE INDEX ix_ip_pool_state_cidr ON ip_pool_state (cidr)"))
+        conn.execute(text("INSERT INTO ip_pool_state (cidr, allocated) VALUES ('10.0.0.0/24', 3)"))
+    Base.metadata.create_all(bind=engine)
+
+    assert "ip_pool_state_nodes" in run_migrations(engine)
+
+    with engine.begin() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM ip_pool_state")).scalar() == 0
+        conn.execute(text("INSERT INTO ip_pool_state (node, cidr) VALUES ('a', '10.0.0.0/24'), ('b', '10.0.0.0/24')"))
@@ -0,0 +1,60 @@
+from app.core.local_store import Lease, LocalStore
+from app.db.database import SessionLocal
+from app.db.models import User
+from app.core.config import settings
+from app.services.nodes import NodeRegistry
+from app.services.wg_drivers import FakeDriver, create_driver
+
+
+def registry_with_peer(db, store):
+    driver = FakeDriver()
+    registry = NodeRegistry(SessionLocal, driver_factory=lambda *_: driver, lease=Lease(store, "wg-nodes", ttl=30))
+    registry.load(db)
+    node = registry.nodes()[0]
+    db.add(User(username="alice", hashed_password="x", wg_public_key="A", wg_node=node.name,
+                wg_ip_address=node.pool.allocate()))
+    db.commit()
+    return registry, driver, node
+
+
+def test_sync_peers_runs_only_in_the_lease_owner(db, tmp_path):
+    store = LocalStore(str(tmp_path / "store.db"))
+    owner = Lease(store, "wg-nodes", ttl=30)
+    assert owner.renew()
+    registry, driver, node = registry_with_peer(db, store)
+
+    assert registry.sync_peers() == {}
+    assert driver.calls == 0
+
+    owner.stop()
+    assert registry.sync_peers() == {node.name: {"added": 1, "removed": 0}}
+    assert set(node.reconciler.dump()) == {"A"}
+
+
+def test_ssh_driver_times_out_connections_and_commands():
+    runner = create_driver("ssh", "wg@node-2")
+
+    assert f"ConnectTimeout={settings.WG_SSH_CONNECT_TIMEOUT}" in runner.command
+    assert runner.timeout == settings.WG_SSH_CONNECT_TIMEOUT + settings.WG_COMMAND_TIMEOUT
+    assert 255 in runner.unavailable_codes
+
+
+def test_unavailable_node_leaves_placement_until_it_answers(db):
+    driver = FakeDriver()
+    registry = NodeRegistry(SessionLocal, driver_factory=lambda *_: driver)
+    registry.load(db)
+    node = registry.nodes()[0]
+    assert registry.place() is node
+
+    driver.down = True
+    assert node.reconciler.apply_many({"A": "10.0.0.2"}) == {"A": False}
+    assert not node.healthy
+    assert node.stats()["last_error"] == "El nodo no responde."
+    assert registry.place() is None
+    assert registry.sticky_node(node.name, has_ip=False) is None
+    assert registry.sticky_node(node.name, has_ip=True) is node
+
+    driver.down = False
+    node.sync()
+    assert node.healthy
+    assert registry.place() is node
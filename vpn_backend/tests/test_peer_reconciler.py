@@ -0,0 +1,146 @@
+import time
+
+import pytest
+
+from app.services.peer_reconciler import PeerChange, PeerReconciler, WgCommandError, WgRunner, WgUnavailable
+from app.services.wg_drivers import FakeDriver
+
+
+def make_reconciler(driver, **kwargs):
+    return PeerReconciler("wg0", driver, window=0, max_batch=256, **kwargs)
+
+
+def results(changes):
+    return [[future.result(timeout=0) for future in change.futures] for change in changes]
+
+
+def test_coalesce_shares_result_of_identical_changes():
+    driver = FakeDriver()
+    reconciler = make_reconciler(driver)
+    first, second = PeerChange("A", "10.0.0.2"), PeerChange("A", "10.0.0.2")
+
+    reconciler._apply([first, second])
+
+    assert results([first]) == [[True]]
+    assert driver.calls == 1
+    assert reconciler.dump() == {"A": "10.0.0.2"}
+
+
+def test_coalesce_resolves_superseded_add_as_failed():
+    driver = FakeDriver()
+    reconciler = make_reconciler(driver)
+    add, remove = PeerChange("A", "10.0.0.2"), PeerChange("A", None)
+
+    reconciler._apply([add, remove])
+
+    assert results([add, remove]) == [[False], [True]]
+    assert reconciler.dump() == {}
+
+
+def test_coalesce_resolves_superseded_remove_as_failed():
+    driver = FakeDriver()
+    reconciler = make_reconciler(driver)
+    reconciler.apply_many({"A": "10.0.0.2"})
+    remove, add = PeerChange("A", None), PeerChange("A", "10.0.0.3")
+
+    reconciler._apply([remove, add])
+
+    assert results([remove, add]) == [[False], [True]]
+    assert reconciler.dump() == {"A": "10.0.0.3"}
+
+
+def test_reconcile_only_removes_peers_in_managed_range():
+    driver = FakeDriver()
+    reconciler = make_reconciler(driver, managed_cidr="10.0.0.0/24")
+    reconciler.apply_many({"stale": "10.0.0.5", "operator": "192.168.1.10", "wrong_ip": "10.0.0.9"})
+
+    added, removed = reconciler.reconcile({"wrong_ip": "10.0.0.7", "missing": "10.0.0.8"})
+
+    assert (added, removed) == (2, 1)
+    assert reconciler.dump() == {"operator": "192.168.1.10", "wrong_ip": "10.0.0.7", "missing": "10.0.0.8"}
+
+
+def test_reconcile_skips_users_with_operation_in_flight():
+    driver = FakeDriver()
+    # 'leaving' ya se quitó de la interfaz pero su disconnect aún no borró las claves;
+    # 'joining' ya está en la interfaz y su connect aún no guardó el estado final.
+    reconciler = make_reconciler(
+        driver,
+        managed_cidr="10.0.0.0/24",
+        desired_state=lambda: ({"leaving": "10.0.0.2"}, {"leaving", "joining"})
+    )
+    reconciler.apply_many({"joining": "10.0.0.3"})
+
+    assert reconciler.reconcile() == (0, 0)
+    assert reconciler.dump() == {"joining": "10.0.0.3"}
+
+
+def test_runner_kills_hung_command():
+    runner = WgRunner("sleep", timeout=0.2)
+    started = time.perf_counter()
+
+    with pytest.raises(WgCommandError, match="no respondió"):
+        runner(["5"])
+    assert time.perf_counter() - started < 2
+
+
+def test_runner_reports_os_errors_as_command_errors(tmp_path):
+    # Existe pero no tiene permiso de ejecución: PermissionError.
+    command = tmp_path / "wg"
+    command.write_text("#!/bin/sh\n")
+    command.chmod(0o644)
+
+    with pytest.raises(WgCommandError, match="No se pudo ejecutar"):
+        WgRunner(str(command))(["show"])
+
+
+def test_runner_maps_unavailable_exit_codes():
+    # Como ssh cuando no consigue conectar con el nodo.
+    runner = WgRunner("sh -c 'exit 255'", unavailable_codes=(255,))
+    with pytest.raises(WgUnavailable):
+        runner(["show"])
+
+    with pytest.raises(WgCommandError) as error:
+        WgRunner("sh -c 'exit 1'", unavailable_codes=(255,))(["show"])
+    assert not isinstance(error.value, WgUnavailable)
+
+
+class CountingDownDriver(FakeDriver):
+    """Nodo que no responde; cuenta los intentos."""
+
+    def __call__(self, args):
+        self.calls += 1
+        raise WgUnavailable("sin conexión")
+
+
+def test_unavailable_node_fails_batch_without_retrying_each_peer():
+    driver = CountingDownDriver()
+    reconciler = make_reconciler(driver)
+    changes = [PeerChange("A", "10.0.0.2"), PeerChange("B", "10.0.0.3"), PeerChange("C", None)]
+
+    reconciler._apply(changes)
+
+    assert results(changes) == [[False], [False], [False]]
+    assert driver.calls == 1
+
+
+class BrokenOnceDriver(FakeDriver):
+    """Lanza un error que no es de 'wg' en la primera llamada."""
+
+    def __call__(self, args):
+        if not self.calls:
+            self.calls += 1
+            raise RuntimeError("driver roto")
+        return super().__call__(args)
+
+
+def test_thread_survives_unexpected_driver_error():
+    reconciler = make_reconciler(BrokenOnceDriver())
+    reconciler.start()
+    try:
+        assert reconciler.submit("A", "10.0.0.2").result(timeout=5) is False
+        assert reconciler.submit("A", "10.0.0.2").result(timeout=5) is True
+        assert reconciler.running
+    finally:
+        reconciler.stop()
+    assert reconciler.dump() == {"A": "10.0.0.2"}
@@ -0,0 +1,66 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from cryptography.fernet import Fernet
+from fastapi import HTTPException
+
+from app.api import routes
+from app.db.database import AsyncSessionLocal, SessionLocal, async_engine
+from app.db.models import User
+from app.services.nodes import NodeRegistry
+from app.services.wg_drivers import FakeDriver
+
+
+def start_worker(db) -> NodeRegistry:
+    """Nodos de un worker: su propio asignador de IPs y, sin almacén compartido, sin reclamas."""
+    registry = NodeRegistry(SessionLocal, driver_factory=lambda *_: FakeDriver())
+    registry.load(db)
+    return registry
+
+
+def connect(monkeypatch, registry: NodeRegistry, username: str):
+    monkeypatch.setattr(routes, "node_registry", registry)
+
+    async def main():
+        try:
+            async with AsyncSessionLocal() as session:
+                return await routes.provision_peer(session, username)
+        finally:
+            await async_engine.dispose()
+
+    return asyncio.run(main())
+
+
+def test_stale_worker_rescans_instead_of_giving_up(db, monkeypatch):
+    usernames = [f"user{i}" for i in range(routes.MAX_IP_ASSIGN_ATTEMPTS + 2)]
+    db.add_all(User(username=username, hashed_password="x") for username in usernames + ["late"])
+    db.commit()
+    worker, stale_worker = start_worker(db), start_worker(db)
+
+    # Más IPs asignadas por el otro worker que reintentos: antes terminaba en 409.
+    for username in usernames:
+        connect(monkeypatch, worker, username)
+    connect(monkeypatch, stale_worker, "late")
+
+    db.expire_all()
+    ips = [ip for (ip,) in db.query(User.wg_ip_address)]
+    assert None not in ips
+    assert len(set(ips)) == len(usernames) + 1
+    assert stale_worker.nodes()[0].pool.allocated == len(usernames) + 1
+
+
+def test_key_missing_from_encryption_keys_is_a_server_error(db, monkeypatch):
+    worker = start_worker(db)
+    node = worker.nodes()[0]
+    # Clave privada cifrada con una clave que ya no está en ENCRYPTION_KEYS.
+    db.add(User(
+        username="alice", hashed_password="x", wg_public_key="A", wg_node=node.name,
+        wg_ip_address=node.pool.allocate(), wg_peer_added_at=datetime.utcnow(),
+        wg_private_key=Fernet(Fernet.generate_key()).encrypt(b"private").decode()
+    ))
+    db.commit()
+
+    with pytest.raises(HTTPException) as error:
+        connect(monkeypatch, worker, "alice")
+    assert error.value.status_code == 500
@@ -0,0 +1,47 @@
+import time
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app.db.database import SessionLocal
+from app.db.models import User
+from app.services.ip_pool import IPPool
+from app.services.peer_reconciler import PeerReconciler
+from app.services.reaper import PeerReaper
+from app.services.wg_drivers import FakeDriver
+
+TTL = 3600
+
+
+def test_reaper_only_removes_peers_added_before_cutoff(db):
+    now = time.time()
+    old = datetime.utcfromtimestamp(now - 2 * TTL)
+    users = {
+        # Peer inactivo desde hace más del TTL.
+        "stale": ("10.0.0.2", old),
+        # Connect en curso: la IP está guardada y el 'wg set' todavía no terminó.
+        "connecting": ("10.0.0.3", datetime.utcfromtimestamp(now)),
+        # Sin marca: no tiene un peer gestionado por la API.
+        "unmarked": ("10.0.0.4", None),
+    }
+    db.add_all(
+        User(username=name, hashed_password="x", wg_public_key=name, wg_ip_address=ip, wg_node="node", wg_peer_added_at=added)
+        for name, (ip, added) in users.items()
+    )
+    db.commit()
+    driver = FakeDriver()
+    reconciler = PeerReconciler("wg0", driver, window=0, max_batch=256)
+    reconciler.apply_many({name: ip for name, (ip, _) in users.items()})
+    pool = IPPool("10.0.0.0/24", node="node")
+    pool.rebuild(db)
+    reaped = []
+    reaper = PeerReaper(reconciler, SessionLocal, pool, ttl=TTL, interval=0, on_reaped=reaped.extend, node="node")
+
+    assert reaper.reap(now) == {"peers": 3, "reaped": 1, "skipped": 0}
+
+    assert reaped == ["stale"]
+    assert set(reconciler.dump()) == {"connecting", "unmarked"}
+    db.expire_all()
+    ips = dict(db.execute(select(User.username, User.wg_ip_address)).all())
+    assert ips == {"stale": None, "connecting": "10.0.0.3", "unmarked": "10.0.0.4"}
+    assert pool.allocated == 2
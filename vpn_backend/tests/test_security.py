@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.api import routes
+from app.core import security
+from app.core.config import settings
+from app.core.security import HashingBusy, HashingPool, get_password_hash, verify_password
+from app.db.database import AsyncSessionLocal, async_engine
+
+
+def test_bcrypt_rounds_setting_sets_the_cost(monkeypatch):
+    monkeypatch.setattr(settings, "BCRYPT_ROUNDS", 4)
+
+    hashed = get_password_hash("secret")
+
+    assert hashed.startswith("$2b$04$")
+    assert get_password_hash("secret", 5).startswith("$2b$05$")
+    assert verify_password("secret", hashed)
+    assert not verify_password("other", hashed)
+
+
+def test_hashing_pool_rejects_when_full():
+    pool = HashingPool(workers=1, max_pending=1)
+
+    async def main():
+        busy = asyncio.create_task(pool.run(time.sleep, 0.5))
+        await asyncio.sleep(0)
+        with pytest.raises(HashingBusy):
+            await pool.run(time.sleep, 0)
+        await busy
+        # Con el hueco libre, se vuelve a admitir.
+        await pool.run(time.sleep, 0)
+
+    try:
+        asyncio.run(main())
+    finally:
+        pool.stop()
+    assert pool.rejected == 1
+    assert pool.pending == 0
+
+
+def test_register_sheds_with_503_while_hashing_is_saturated(db, monkeypatch):
+    monkeypatch.setattr(security.hashing_pool, "max_pending", 0)
+
+    async def main():
+        try:
+            async with AsyncSessionLocal() as session:
+                await routes.register_user(routes.UserCreate(username="alice", password="secret"), session)
+        finally:
+            await async_engine.dispose()
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main())
+    assert error.value.status_code == 503
+    assert error.value.headers["Retry-After"] == "1"
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.core.startup import Readiness
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """La aplicación con un arranque vacío: las tareas las registra cada prueba."""
+    fresh = Readiness()
+    for name in ("_components", "ready_seconds", "import_seconds"):
+        monkeypatch.setattr(main.readiness, name, getattr(fresh, name))
+    return TestClient(main.app)
+
+
+def run(name, func, required=True):
+    return asyncio.run(main.readiness.run(name, func, required=required))
+
+
+def fail():
+    raise RuntimeError("sin conexión")
+
+
+def test_routes_answer_503_until_required_tasks_finish(client):
+    assert client.get("/").json()["detail"] == "Service is starting, please retry."
+    main.readiness.add("database")
+    main.readiness.add("key_pool", required=False)
+
+    response = client.get("/")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert client.get("/readyz").json()["status"] == "starting"
+
+    run("database", lambda: 3)
+    assert client.get("/").status_code == 503
+
+    run("key_pool", lambda: None, required=False)
+    assert client.get("/").status_code == 200
+    assert client.get("/readyz").status_code == 200
+
+
+def test_optional_failures_do_not_block_readiness(client):
+    run("database", lambda: 3)
+    run("firebase_certs", lambda: False, required=False)
+    run("hashing_pool", fail, required=False)
+
+    assert client.get("/").status_code == 200
+    components = client.get("/readyz").json()["components"]
+    assert components["firebase_certs"]["status"] == "failed"
+    assert components["hashing_pool"]["error"] == "sin conexión"
+
+
+def test_required_failure_keeps_the_worker_out_of_rotation(client):
+    run("database", fail)
+    main.readiness.add("peer_state", required=False)
+    main.readiness.skip("peer_state")
+
+    assert client.get("/").json()["detail"] == "Service unavailable: startup failed."
+    readyz = client.get("/readyz")
+    assert readyz.status_code == 503
+    assert readyz.json()["status"] == "failed"
+    # La sonda de vida no depende del arranque.
+    assert client.get("/healthz").json() == {"status": "ok"}
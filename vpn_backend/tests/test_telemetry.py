@@ -0,0 +1,32 @@
+import time
+
+from sqlalchemy import select
+
+from app.db.database import SessionLocal
+from app.db.models import ConnectionLog
+from app.services.telemetry import TelemetryCollector
+from app.services.wg_drivers import FakeDriver
+
+
+def make_collector(driver):
+    return TelemetryCollector("wg0", driver, SessionLocal, interval=0, active_window=180, label="node")
+
+
+def test_two_collectors_open_one_session_per_peer(db):
+    driver = FakeDriver()
+    driver(["set", "wg0", "peer", "A", "allowed-ips", "10.0.0.2/32"])
+    first, second = make_collector(driver), make_collector(driver)
+    first.poll()
+    second.poll()
+
+    now = time.time()
+    driver.interfaces["wg0"]["A"].update(handshake=int(now), rx=100, tx=50)
+    assert first.poll(now)["opened"] == 1
+    assert second.poll(now)["opened"] == 1
+
+    sessions = db.execute(select(ConnectionLog.public_key, ConnectionLog.disconnected_at)).all()
+    assert sessions == [("A", None)]
+
+    driver(["set", "wg0", "peer", "A", "remove"])
+    assert first.poll(now + 1)["closed"] == 1
+    assert db.execute(select(ConnectionLog.disconnected_at)).scalar() is not None
@@ -0,0 +1,73 @@
+import asyncio
+import sqlite3
+import time
+
+from app.core.local_store import LocalStore
+from app.services import firebase_service
+from app.services.token_cache import TokenCache
+
+
+def claims(email: str, ttl: float = 3600) -> dict:
+    return {"email": email, "exp": time.time() + ttl}
+
+
+def test_entries_expire_at_the_token_exp():
+    cache = TokenCache(10)
+    cache.put("short", claims("alice", ttl=0.2))
+    cache.put("expired", claims("bob", ttl=-1))
+
+    assert cache.get("short")["email"] == "alice"
+    assert cache.get("expired") is None
+    time.sleep(0.25)
+    assert cache.get("short") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TokenCache(2)
+    cache.put("a", claims("alice"))
+    cache.put("b", claims("bob"))
+    cache.get("a")
+    cache.put("c", claims("carol"))
+
+    assert cache.get("b") is None
+    assert cache.get("a")["email"] == "alice"
+    assert cache.get("c")["email"] == "carol"
+
+
+def test_other_workers_hit_the_shared_store(tmp_path):
+    store = LocalStore(str(tmp_path / "store.db"))
+    worker, other_worker = TokenCache(10, store), TokenCache(10, store)
+    worker.put("token", claims("alice"))
+
+    assert other_worker.get("token")["email"] == "alice"
+    assert other_worker.get("token")["email"] == "alice"
+    stats = other_worker.stats()
+    assert (stats["hits"], stats["shared_hits"], stats["misses"]) == (2, 1, 0)
+
+
+class BrokenStore(LocalStore):
+    def get(self, *args):
+        raise sqlite3.OperationalError("database is locked")
+
+    def set(self, *args):
+        raise sqlite3.OperationalError("database is locked")
+
+
+def test_store_errors_fail_open(tmp_path):
+    cache = TokenCache(10, BrokenStore(str(tmp_path / "store.db")))
+
+    assert cache.get("token") is None
+    cache.put("token", claims("alice"))
+    assert cache.get("token")["email"] == "alice"
+
+
+def test_async_verification_reads_the_shared_store(tmp_path, monkeypatch):
+    store = LocalStore(str(tmp_path / "store.db"))
+    TokenCache(10, store).put("token", claims("alice"))
+    cache = TokenCache(10, store)
+    monkeypatch.setattr(firebase_service, "token_cache", cache)
+
+    assert cache.get_local("token") is None
+    assert asyncio.run(firebase_service.verify_token_async("token"))["email"] == "alice"
+    assert cache.stats()["shared_hits"] == 1
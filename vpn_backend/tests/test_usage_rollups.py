@@ -0,0 +1,71 @@
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app.db.models import ConnectionLog, UsageRollup
+from app.services.usage_rollups import refresh_rollups, split_session
+
+
+def rollups(db, scope, granularity):
+    rows = db.execute(
+        select(UsageRollup.bucket_start, UsageRollup.sessions, UsageRollup.rx_bytes, UsageRollup.tx_bytes, UsageRollup.seconds)
+        .where(UsageRollup.scope == scope, UsageRollup.granularity == granularity)
+        .order_by(UsageRollup.bucket_start)
+    )
+    return [tuple(row) for row in rows]
+
+
+def test_session_across_hours_midnight_and_month_is_split_by_overlap(db):
+    # 3 horas: de 22:30 del 31 de enero a 01:30 del 1 de febrero.
+    db.add(ConnectionLog(
+        user_id=7, interface="wg0", public_key="A", rx_bytes=6000, tx_bytes=600,
+        connected_at=datetime(2024, 1, 31, 22, 30), disconnected_at=datetime(2024, 2, 1, 1, 30)
+    ))
+    db.commit()
+
+    assert refresh_rollups(db) == 1
+
+    assert rollups(db, "user", "hour") == [
+        (datetime(2024, 1, 31, 22), 1, 1000, 100, 1800),
+        (datetime(2024, 1, 31, 23), 0, 2000, 200, 3600),
+        (datetime(2024, 2, 1, 0), 0, 2000, 200, 3600),
+        (datetime(2024, 2, 1, 1), 0, 1000, 100, 1800),
+    ]
+    assert rollups(db, "user", "day") == [
+        (datetime(2024, 1, 31), 1, 3000, 300, 5400),
+        (datetime(2024, 2, 1), 0, 3000, 300, 5400),
+    ]
+    assert rollups(db, "server", "month") == [
+        (datetime(2024, 1, 1), 1, 3000, 300, 5400),
+        (datetime(2024, 2, 1), 0, 3000, 300, 5400),
+    ]
+
+
+def test_sessions_in_same_bucket_are_added(db):
+    db.add_all([
+        ConnectionLog(user_id=1, interface="wg0", rx_bytes=10, tx_bytes=1,
+                      connected_at=datetime(2024, 3, 1, 10, 0), disconnected_at=datetime(2024, 3, 1, 10, 10)),
+        ConnectionLog(user_id=2, interface="wg0", rx_bytes=20, tx_bytes=2,
+                      connected_at=datetime(2024, 3, 1, 10, 20), disconnected_at=datetime(2024, 3, 1, 10, 30)),
+    ])
+    db.commit()
+    refresh_rollups(db)
+    # Una segunda pasada no vuelve a sumar las sesiones ya contadas.
+    assert refresh_rollups(db) == 0
+
+    assert rollups(db, "server", "hour") == [(datetime(2024, 3, 1, 10), 2, 30, 3, 1200)]
+
+
+def test_split_session_parts_add_up_to_totals():
+    parts = list(split_session(datetime(2024, 12, 31, 23, 59, 59), datetime(2025, 1, 1, 2, 0, 1), 1001, 7, "hour"))
+
+    assert [part[0] for part in parts] == [
+        datetime(2024, 12, 31, 23), datetime(2025, 1, 1, 0), datetime(2025, 1, 1, 1), datetime(2025, 1, 1, 2)
+    ]
+    assert [sum(values) for values in zip(*(part[1:] for part in parts))] == [1, 1001, 7, 7202]
+    assert [part[4] for part in parts] == [1, 3600, 3600, 1]
+
+
+def test_split_session_without_duration_stays_in_start_bucket():
+    moment = datetime(2024, 5, 5, 5, 5)
+    assert list(split_session(moment, moment, 10, 20, "day")) == [(datetime(2024, 5, 5), 1, 10, 20, 0)]